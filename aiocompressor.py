@@ -0,0 +1,164 @@
+import os
+import asyncio
+from collections import deque
+
+from cache import file_identity
+from compressor import (get_ffmpeg_path, hidden_window_startupinfo, parse_probe_output, parse_progress_block,
+                        cached_video_info, remember_video_info, get_video_info_opencv,
+                        build_compress_command, compress_settings, get_output_cache, output_cache_key,
+                        restore_cached_output, store_cached_output, select_pipeline, PIPELINE_FILTERS,
+                        EncodeProgress)
+from capabilities import FFmpegCapabilityError
+
+class FFmpegError(RuntimeError):
+    """ffmpeg exited with an error. `returncode` and the last lines of its log are attached."""
+
+    def __init__(self, returncode, log_tail):
+        self.returncode = returncode
+        self.log_tail = list(log_tail)
+        super().__init__(f"FFmpeg exited with error code {returncode}" +
+                         "".join(f"\n  {line}" for line in self.log_tail))
+
+async def _run_blocking(func, *args):
+    # Short disk-bound steps (fingerprints, cache copies) run on the loop's default executor
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+async def probe_video_async(file_path):
+    """Async counterpart of compressor.probe_video: header-only probe through ffmpeg, or None."""
+    if not os.path.exists(file_path):
+        return None
+    process = await asyncio.create_subprocess_exec(
+        get_ffmpeg_path(), '-hide_banner', '-i', file_path,
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        startupinfo=hidden_window_startupinfo())
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=30)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return parse_probe_output(stderr.decode('utf-8', errors='replace'))
+
+async def get_video_info_async(file_path, use_cache=True):
+    """Async counterpart of compressor.get_video_info, sharing its on-disk probe cache."""
+    identity = file_identity(file_path) if use_cache else None
+    cached = cached_video_info(identity)
+    if cached:
+        return cached
+    try:
+        info = await probe_video_async(file_path)
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Error probing video with FFmpeg: {e}")
+        info = None
+    if info is None:
+        info = await _run_blocking(get_video_info_opencv, file_path)
+    remember_video_info(identity, info)
+    return info
+
+async def _drain_log(stream, tail):
+    # Keep reading stderr so ffmpeg never blocks on a full pipe; keep the last lines for errors
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+async def run_ffmpeg_async(cmd, total_duration=0):
+    """
+    Async counterpart of compressor.run_ffmpeg: an async iterator of EncodeProgress objects.
+    The iteration ends normally when ffmpeg succeeds and raises FFmpegError when it fails.
+    Cancelling the task that iterates (or closing the iterator) kills ffmpeg.
+    """
+    cmd = [cmd[0], '-nostdin', '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        startupinfo=hidden_window_startupinfo())
+    log_tail = deque(maxlen=20)
+    log_task = asyncio.ensure_future(_drain_log(process.stderr, log_tail))
+    try:
+        fields = {}
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            key, sep, value = line.decode('utf-8', errors='replace').strip().partition('=')
+            if not sep:
+                continue
+            fields[key] = value
+            if key == 'progress':
+                yield parse_progress_block(fields, total_duration)
+                fields = {}
+        await process.wait()
+        await log_task
+        if process.returncode != 0:
+            raise FFmpegError(process.returncode, log_tail)
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        log_task.cancel()
+
+async def compress_video_async(input_path, output_path, target_height, total_duration=0, threads=0, fast_path=True,
+                               source_info=None, crf=23, preset='medium', use_cache=True, fragmented=False, tier=None):
+    """
+    Async counterpart of compressor.compress_video, built on asyncio subprocesses: one event loop
+    can supervise any number of encodes without a thread per job.
+    Use it as an async iterator of EncodeProgress objects:
+
+        async for progress in compress_video_async("in.mp4", "out.mp4", 720):
+            print(f"{progress:.0%} ETA {format_eta(progress.eta)}")
+
+    Finishing the loop means success; a failed encode raises FFmpegError, a missing input
+    FileNotFoundError and an ffmpeg build without the needed encoders FFmpegCapabilityError. Cancelling the task kills ffmpeg. See wait_for_compression for a plain
+    True/False result. Parameters are those of compress_video.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(input_path)
+
+    ffmpeg_exe = get_ffmpeg_path()
+    # Inspecting a new ffmpeg build runs it a few times, so keep that off the loop too
+    pipeline = await _run_blocking(select_pipeline, ffmpeg_exe, PIPELINE_FILTERS, tier)
+    cache_key = None
+    if use_cache and get_output_cache():
+        cache_key = await _run_blocking(output_cache_key, input_path, output_path,
+                                        compress_settings(target_height, crf, preset, fast_path, fragmented, tier,
+                                                          pipeline))
+        if await _run_blocking(restore_cached_output, cache_key, output_path):
+            yield EncodeProgress(1.0, total_size=os.path.getsize(output_path), eta=0.0, done=True)
+            return
+
+    if source_info is None:
+        source_info = await get_video_info_async(input_path)
+    if not total_duration and source_info:
+        total_duration = source_info.get('duration', 0)
+    cmd = build_compress_command(ffmpeg_exe, input_path, output_path, target_height, source_info, threads,
+                                 fast_path, crf, preset, fragmented, pipeline)
+    progress_iterator = run_ffmpeg_async(cmd, total_duration)
+    try:
+        async for progress in progress_iterator:
+            yield progress
+    finally:
+        # Kill ffmpeg now rather than whenever the inner iterator is garbage collected
+        await progress_iterator.aclose()
+
+    if cache_key:
+        await _run_blocking(store_cached_output, cache_key, output_path)
+
+async def wait_for_compression(progress_iterator, progress_callback=None):
+    """
+    Run a compress_video_async (or run_ffmpeg_async) iterator to the end.
+    progress_callback: optional callable(EncodeProgress)
+    Returns True on success, False if ffmpeg failed (cancellation still propagates).
+    """
+    try:
+        async for progress in progress_iterator:
+            if progress_callback:
+                progress_callback(progress)
+        return True
+    except (FFmpegError, FFmpegCapabilityError, OSError) as e:
+        print(f"Compression failed: {e}")
+        return False
@@ -2,33 +2,60 @@ import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import threading
 import os
-import shutil
+import time
 import tempfile
  
 from PIL import Image, ImageDraw
 
 import sys
 import traceback
-from compressor import compress_video, get_video_info, get_thumbnail
+from quality import compress_video_auto_quality
+from compressor import compress_video, compress_video_target_size, compress_video_sample, get_video_info, get_thumbnail, default_thumbnail_seek, get_preview_strip, format_eta, save_output, ALL_RESOLUTIONS, SPEED_TIERS, DEFAULT_TIER
+from cache import get_cache_dir, prune_stale_files
+from telemetry import JobTelemetry, record_job, record_phase
+from predictor import predict_resolutions, format_prediction
 
 # Configuration
 ctk.set_appearance_mode("Dark")
 ctk.set_default_color_theme("blue")
 
 class VideoCompressorApp(ctk.CTk):
+    # Resolution menu entry that runs the sample-based quality search instead of a fixed height
+    AUTO_QUALITY_LABEL = "Auto (Best Quality/Size)"
+    # Frame picking modes of the comparison strip
+    STRIP_EVEN_LABEL = "Evenly Spaced"
+    STRIP_SCENES_LABEL = "Scene Changes"
+
+    # Unsaved outputs in the work folder older than this are left over from a crash; a file
+    # another running instance is still writing keeps a fresh mtime
+    WORK_FILE_MAX_AGE = 24 * 3600
+
     def __init__(self):
         super().__init__()
 
         # Window Setup
         self.title("Video Compressor Pro")
         self.geometry("1400x900")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        prune_stale_files(get_cache_dir("work"), self.WORK_FILE_MAX_AGE)
         self.input_video_path = None
         self.temp_output_path = None
+        self.output_saved = False # temp_output_path was moved to where the user saved it
+        self.sample_path = None # Last preview sample clip
+        self.showing_sample = False # The output preview shows the sample rather than temp_output_path
         
         # Video Metadata
         self.video_duration = 0
+        self.input_info = None # get_video_info of the input, for the size/time estimates
+        self.resolution_choices = {} # Resolution menu entry (with its estimate) -> ALL_RESOLUTIONS key
         self.last_compressed_resolution = None # Track last success
+        self.last_compressed_target_size = None
+        self.last_compressed_tier = None
+        self.last_auto_choice = None # Settings picked by the auto quality search
+        self.job_telemetry = None # Metrics of the running compression, recorded when it finishes
         self.is_compressing = False
+        self.is_sampling = False
+        self.strip_generation = 0 # Bumped for every strip request, so stale results are dropped
         
         # Threading control
         self.stop_event = threading.Event()
@@ -36,18 +63,10 @@ class VideoCompressorApp(ctk.CTk):
         # UI Constants
         self.PREVIEW_WIDTH = 550
         self.PREVIEW_HEIGHT = 380
+        self.STRIP_HEIGHT = 202 # Two rows of compressor.PREVIEW_STRIP_SIZE frames
         
         # Resolution mapping (Label -> Height int)
-        self.ALL_RESOLUTIONS = {
-            "144p": 144,
-            "240p": 240,
-            "360p": 360,
-            "480p": 480,
-            "720p": 720,
-            "1080p": 1080,
-            "1440p": 1440,
-            "2160p (4K)": 2160
-        }
+        self.ALL_RESOLUTIONS = dict(ALL_RESOLUTIONS)
 
         # Grid Layout
         self.grid_columnconfigure(1, weight=1)
@@ -73,13 +92,37 @@ class VideoCompressorApp(ctk.CTk):
                                                  command=self.change_resolution_event, variable=self.resolution_var, height=35)
         self.resolution_menu.grid(row=3, column=0, padx=20, pady=10)
 
+        # Optional settings (fill the stretchy row, aligned to the top)
+        self.options_frame = ctk.CTkFrame(self.sidebar_frame, fg_color="transparent")
+        self.options_frame.grid(row=4, column=0, padx=20, pady=(10, 0), sticky="n")
+
+        # Speed tiers trade encode time for file size (see SPEED_TIERS in compressor.py)
+        self.tier_label = ctk.CTkLabel(self.options_frame, text="Speed:", anchor="w", font=ctk.CTkFont(size=14))
+        self.tier_label.pack(pady=(0, 5))
+        self.tier_var = ctk.StringVar(value=DEFAULT_TIER)
+        self.tier_menu = ctk.CTkOptionMenu(self.options_frame, values=list(SPEED_TIERS), variable=self.tier_var,
+                                           command=self.change_tier_event,
+                                           height=35)
+        self.tier_menu.pack(pady=(0, 10))
+
+        self.size_label = ctk.CTkLabel(self.options_frame, text="Max File Size (MB):", anchor="w", font=ctk.CTkFont(size=14))
+        self.size_label.pack(pady=(0, 5))
+        self.target_size_entry = ctk.CTkEntry(self.options_frame, placeholder_text="Optional, e.g. 25", height=35)
+        self.target_size_entry.pack()
+        self.target_size_entry.bind("<KeyRelease>", lambda e: self.change_resolution_event(self.resolution_var.get()))
+
         self.compress_btn = ctk.CTkButton(self.sidebar_frame, text="Start Compression", command=self.start_compression, state="disabled", 
                                           fg_color="green", height=50, font=ctk.CTkFont(size=16, weight="bold"))
         self.compress_btn.grid(row=5, column=0, padx=20, pady=20)
+
+        # Encodes a few seconds at the chosen resolution and estimates the full job's size and time
+        self.sample_btn = ctk.CTkButton(self.sidebar_frame, text="Preview Sample", command=self.start_sample, state="disabled",
+                                        height=40, font=ctk.CTkFont(size=14))
+        self.sample_btn.grid(row=6, column=0, padx=20, pady=(0, 20))
         
         self.save_btn = ctk.CTkButton(self.sidebar_frame, text="Save Video", command=self.save_video, state="disabled", 
                                       fg_color="blue", height=40, font=ctk.CTkFont(size=14, weight="bold"))
-        self.save_btn.grid(row=6, column=0, padx=20, pady=(0, 20))
+        self.save_btn.grid(row=7, column=0, padx=20, pady=(0, 20))
 
         # Main Area
         self.main_frame = ctk.CTkFrame(self, corner_radius=10)
@@ -117,7 +160,20 @@ class VideoCompressorApp(ctk.CTk):
         self.output_preview_label = ctk.CTkLabel(self.output_frame, text="Waiting for compression...", width=self.PREVIEW_WIDTH, height=self.PREVIEW_HEIGHT, 
                                                  fg_color="gray20", corner_radius=15, font=ctk.CTkFont(size=16))
         self.output_preview_label.pack(pady=5, padx=10)
-        self.output_preview_label.bind("<Button-1>", lambda e: self.play_video_system(self.temp_output_path))
+        self.output_preview_label.bind("<Button-1>", lambda e: self.play_output_preview())
+
+        # === Comparison Strip ===
+        # Frames from across the video, input above output at the same timestamps
+        self.strip_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        self.strip_frame.grid(row=1, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+
+        self.strip_mode = ctk.CTkSegmentedButton(self.strip_frame, values=[self.STRIP_EVEN_LABEL, self.STRIP_SCENES_LABEL],
+                                                 command=lambda _: self.refresh_preview_strip())
+        self.strip_mode.set(self.STRIP_EVEN_LABEL)
+        self.strip_mode.pack(pady=(0, 5))
+
+        self.strip_label = None
+        self.reset_strip_label("Frames from across the video appear here")
 
         # Progress
         self.progressbar = ctk.CTkProgressBar(self.main_frame, height=15)
@@ -145,7 +201,7 @@ class VideoCompressorApp(ctk.CTk):
                                                          fg_color="gray20", corner_radius=15, font=ctk.CTkFont(size=16))
                 self.output_preview_label.pack(pady=5, padx=10)
                 # Rebind
-                self.output_preview_label.bind("<Button-1>", lambda e: self.play_video_system(self.temp_output_path))
+                self.output_preview_label.bind("<Button-1>", lambda e: self.play_output_preview())
                 
             elif which == "input":
                 if hasattr(self, 'input_preview_label') and self.input_preview_label:
@@ -162,10 +218,84 @@ class VideoCompressorApp(ctk.CTk):
             print(f"Critical error resetting label: {e}")
             traceback.print_exc()
 
+    def reset_strip_label(self, text_placeholder=""):
+        """Recreates the comparison strip label (same 'pyimage' workaround as reset_preview_label)."""
+        try:
+            if self.strip_label:
+                try:
+                    self.strip_label.destroy()
+                except: pass
+            self.strip_label = ctk.CTkLabel(self.strip_frame, text=text_placeholder, height=self.STRIP_HEIGHT,
+                                            fg_color="gray20", corner_radius=10, font=ctk.CTkFont(size=14))
+            self.strip_label.pack(fill="x", padx=10)
+        except Exception as e:
+            print(f"Error resetting strip label: {e}")
+
+    def refresh_preview_strip(self):
+        """Rebuild the comparison strip in the background: input frames, plus the finished output's."""
+        if not self.input_video_path:
+            return
+        self.strip_generation += 1
+        generation = self.strip_generation
+        output_path = None if self.is_compressing else self.temp_output_path
+        mode = 'scene' if self.strip_mode.get() == self.STRIP_SCENES_LABEL else 'even'
+        self.reset_strip_label("Loading frames...")
+        threading.Thread(target=self.load_preview_strip_thread,
+                         args=(generation, self.input_video_path, output_path, mode), daemon=True).start()
+
+    def load_preview_strip_thread(self, generation, input_path, output_path, mode):
+        try:
+            sheet = get_preview_strip(input_path, output_path, mode=mode)
+        except Exception as e:
+            print(f"Strip error: {e}")
+            sheet = None
+        self.after(0, lambda: self.show_preview_strip(generation, sheet))
+
+    def show_preview_strip(self, generation, sheet):
+        if generation != self.strip_generation:
+            return # A newer video or mode was picked meanwhile
+        if sheet is None:
+            self.reset_strip_label("Could not extract frames")
+            return
+        try:
+            ctk_image = ctk.CTkImage(light_image=sheet, dark_image=sheet, size=sheet.size)
+            self.reset_strip_label()
+            self.strip_label.configure(image=ctk_image, text="")
+            self.strip_label.image = ctk_image
+        except Exception as e:
+            print(f"Strip error: {e}")
+            self.reset_strip_label("Could not extract frames")
+
+    def get_target_size_bytes(self):
+        """Max file size from the sidebar entry in bytes, None if empty. Raises ValueError if not a positive number."""
+        text = self.target_size_entry.get().strip()
+        if not text:
+            return None
+        size_mb = float(text)
+        if size_mb <= 0:
+            raise ValueError("size must be positive")
+        return int(size_mb * 1_000_000)
+
+    def selected_resolution(self):
+        """The chosen ALL_RESOLUTIONS key (or another menu entry), without its estimate."""
+        return self.resolution_choices.get(self.resolution_var.get(), self.resolution_var.get())
+
+    def change_tier_event(self, tier):
+        # Estimates depend on the tier's encoder
+        self.refresh_resolution_estimates()
+        self.change_resolution_event(self.resolution_var.get())
+
     def change_resolution_event(self, new_res):
+        new_res = self.resolution_choices.get(new_res, new_res)
         try:
-            # Check if this resolution was just compressed
-            if self.last_compressed_resolution and new_res == self.last_compressed_resolution:
+            try:
+                target_size = self.get_target_size_bytes()
+            except ValueError:
+                target_size = None
+            # Check if these settings were just compressed
+            if (self.last_compressed_resolution and new_res == self.last_compressed_resolution
+                    and target_size == self.last_compressed_target_size
+                    and self.tier_var.get() == self.last_compressed_tier):
                 self.compress_btn.configure(state="disabled")
             else:
                 if self.input_video_path:
@@ -206,10 +336,10 @@ class VideoCompressorApp(ctk.CTk):
             if file_path:
                 self.input_video_path = file_path
                 self.reset_preview_label("input", "Loading...")
-                self.show_thumbnail_with_overlay(file_path, "input")
                 
                 # Get video info to set resolutions
                 info = get_video_info(file_path)
+                self.input_info = info
                 if info:
                     orig_w = info.get('width', 0)
                     orig_h = info.get('height', 0)
@@ -221,15 +351,22 @@ class VideoCompressorApp(ctk.CTk):
                     self.video_duration = 0
                     self.update_resolution_options(9999) 
                 
+                self.show_thumbnail_with_overlay(file_path, "input")
+                
                 self.status_label.configure(text=f"Loaded: {os.path.basename(file_path)}")
                 
                 # Reset output
                 self.last_compressed_resolution = None 
+                self.last_compressed_target_size = None
+                self.last_compressed_tier = None
                 self.reset_preview_label("output", "Waiting for compression...")
 
                 self.output_info_label.configure(text="")
-                self.temp_output_path = None
+                self.discard_temp_output()
+                self.remove_sample()
                 self.save_btn.configure(state="disabled")
+                self.sample_btn.configure(state="normal" if self.video_duration else "disabled")
+                self.refresh_preview_strip()
         except Exception as e:
             messagebox.showerror("Error Opening File", f"An error occurred while opening the file:\n{str(e)}")
             traceback.print_exc()
@@ -241,25 +378,60 @@ class VideoCompressorApp(ctk.CTk):
             
             # Sort them numerically descending
             available_res.sort(key=lambda x: self.ALL_RESOLUTIONS[x], reverse=True)
-            
+            self.resolution_choices = {}
+
             if not available_res:
                 available_res = ["No Lower Res Available"]
                 self.resolution_menu.configure(values=available_res, state="disabled")
                 self.resolution_var.set("No Lower Res Available")
                 self.compress_btn.configure(state="disabled")
             else:
-                self.resolution_menu.configure(values=available_res, state="normal")
-                self.resolution_var.set(available_res[0]) 
+                self.resolution_var.set(available_res[0])
+                self.refresh_resolution_estimates(available_res)
+                self.resolution_menu.configure(state="normal")
                 self.compress_btn.configure(state="normal")
         except Exception as e:
             print(f"Error updating options: {e}")
 
+    def refresh_resolution_estimates(self, keys=None):
+        """
+        Label each resolution in the menu (`keys`, default: the ones it lists now) with its predicted
+        size and encode time for the chosen tier (see predictor.py), keeping the selection.
+        Estimates improve as jobs are recorded.
+        """
+        selected = self.selected_resolution()
+        keys = [key for key in (keys or self.resolution_choices.values()) if key in self.ALL_RESOLUTIONS]
+        if not keys:
+            return
+        try:
+            predictions = predict_resolutions(self.input_info, self.tier_var.get(), self.input_video_path,
+                                              {key: self.ALL_RESOLUTIONS[key] for key in keys})
+        except Exception as e:
+            print(f"Error estimating sizes: {e}")
+            predictions = {}
+        choices = {}
+        for key in keys:
+            estimate = format_prediction(predictions.get(key))
+            choices[f"{key}  {estimate}" if estimate else key] = key
+        self.resolution_choices = choices
+        labels = list(choices) + [self.AUTO_QUALITY_LABEL]
+        self.resolution_menu.configure(values=labels)
+        label = next((label for label, key in choices.items() if key == selected), None)
+        if label is None:
+            # e.g. auto quality is selected, which has no estimate
+            label = selected if selected in labels else labels[0]
+        self.resolution_var.set(label)
+
     def show_thumbnail_with_overlay(self, video_path, which_label="input"):
         try:
-            thumb = get_thumbnail(video_path)
+            # Decoded straight at preview size, skipping black lead-in frames; cached for the input only
+            thumb = get_thumbnail(video_path, size=(self.PREVIEW_WIDTH, self.PREVIEW_HEIGHT),
+                                  seek=default_thumbnail_seek(self.video_duration),
+                                  use_cache=(which_label == "input"))
             if thumb:
                 # Force size for clean UI
-                thumb = thumb.resize((self.PREVIEW_WIDTH, self.PREVIEW_HEIGHT), Image.Resampling.LANCZOS)
+                if thumb.size != (self.PREVIEW_WIDTH, self.PREVIEW_HEIGHT):
+                    thumb = thumb.resize((self.PREVIEW_WIDTH, self.PREVIEW_HEIGHT), Image.Resampling.LANCZOS)
                 
                 img_with_overlay = self.draw_play_overlay(thumb)
                 
@@ -277,6 +449,9 @@ class VideoCompressorApp(ctk.CTk):
              # If error setting image, try reset
              self.reset_preview_label(which_label, "Preview Error")
 
+    def play_output_preview(self):
+        self.play_video_system(self.sample_path if self.showing_sample else self.temp_output_path)
+
     def play_video_system(self, video_path):
         """Opens the video in the system default player."""
         if not video_path:
@@ -284,9 +459,10 @@ class VideoCompressorApp(ctk.CTk):
                  self.open_file_dialog()
             return
             
-        # BLOCK opening output video if currently compressing
+        # The output is a fragmented MP4, so it can be watched while compressing once the first fragment is written
         if self.is_compressing and video_path == self.temp_output_path:
-            return
+            if not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
+                return
         
         try:
             if os.name == 'nt': # Windows
@@ -307,37 +483,63 @@ class VideoCompressorApp(ctk.CTk):
                 
             if not self.input_video_path: return
             
-            res_str = self.resolution_var.get()
-            if res_str not in self.ALL_RESOLUTIONS:
+            res_str = self.selected_resolution()
+            if res_str == self.AUTO_QUALITY_LABEL:
+                target_height = None # Picked by the quality search
+            elif res_str in self.ALL_RESOLUTIONS:
+                target_height = self.ALL_RESOLUTIONS[res_str]
+            else:
                 messagebox.showerror("Error", "Invalid resolution selected")
                 return
 
-            target_height = self.ALL_RESOLUTIONS[res_str]
+            try:
+                target_size = self.get_target_size_bytes()
+            except ValueError:
+                messagebox.showerror("Error", "Max file size must be a positive number of MB")
+                return
+            if target_size and target_height is None:
+                messagebox.showerror("Error", "Auto quality picks its own size. Clear Max File Size or choose a resolution.")
+                return
             
-            temp_fd, temp_path = tempfile.mkstemp(suffix=".mp4")
+            # Encode inside the app's own folder rather than the system temp dir, which is often a
+            # separate filesystem (tmpfs); on the same filesystem as the save location, Save is a rename
+            temp_fd, temp_path = tempfile.mkstemp(suffix=".mp4", dir=get_cache_dir("work"))
             os.close(temp_fd)
+            self.discard_temp_output()
             self.temp_output_path = temp_path
+            self.output_saved = False
+            self.remove_sample()
             
             # Start New Compression: Clear previous preview by re-creating label
-            self.reset_preview_label("output", "Compressing...")
+            self.reset_preview_label("output", "Compressing...\n(click to watch so far)")
             self.output_info_label.configure(text="")
 
             self.last_compressed_resolution = None # Reset for this new run
+            self.last_auto_choice = None
             
             # Set State to Running
             self.stop_event.clear()
             self.is_compressing = True
+            # Target size and auto quality pick their own encoder settings
+            tier = self.tier_var.get() if target_height is not None and not target_size else None
+            self.job_telemetry = JobTelemetry('gui', self.input_video_path, self.temp_output_path,
+                                              resolution=res_str, target_size=target_size, tier=tier)
+            self.refresh_preview_strip() # Input frames only until the new output exists
             
             # Change Button to Cancel
             self.compress_btn.configure(text="Cancel Compression", fg_color="red", hover_color="darkred")
             
             self.upload_btn.configure(state="disabled")
             self.save_btn.configure(state="disabled")
+            self.sample_btn.configure(state="disabled")
             self.resolution_menu.configure(state="disabled")
+            self.tier_menu.configure(state="disabled")
+            self.target_size_entry.configure(state="disabled")
             self.progressbar.set(0) # Reset
-            self.status_label.configure(text=f"Compressing to {res_str}...")
+            size_note = f" (max {target_size / 1_000_000:g} MB)" if target_size else f" ({tier})" if tier else ""
+            self.status_label.configure(text=f"Compressing to {res_str}{size_note}...")
 
-            threading.Thread(target=self.run_compression_thread, args=(self.input_video_path, self.temp_output_path, target_height), daemon=True).start()
+            threading.Thread(target=self.run_compression_thread, args=(self.input_video_path, self.temp_output_path, target_height, target_size, self.job_telemetry, tier), daemon=True).start()
         except Exception as e:
             messagebox.showerror("Error Starting", f"Could not start compression: {e}")
             self.compression_finished(False)
@@ -346,55 +548,101 @@ class VideoCompressorApp(ctk.CTk):
         self.status_label.configure(text="Cancelling...")
         self.stop_event.set()
 
-    def update_progress(self, percentage):
-        """Callback to update progress bar from thread."""
+    def update_progress(self, progress):
+        """Callback to update progress bar from thread. `progress` is a compressor.EncodeProgress."""
         try:
-            self.progressbar.set(percentage)
-            self.status_label.configure(text=f"Compressing... {int(percentage * 100)}%")
+            self.progressbar.set(progress)
+            text = f"Compressing... {int(progress * 100)}%"
+            if getattr(progress, 'fps', 0):
+                text += f"  ({progress.fps:.0f} fps, {progress.speed:.1f}x, ETA {format_eta(progress.eta)})"
+            self.status_label.configure(text=text)
         except:
             pass
 
-    def run_compression_thread(self, input_path, output_path, target_height):
+    def run_compression_thread(self, input_path, output_path, target_height, target_size=None, telemetry=None, tier=None):
         try:
             def progress_callback(p):
                 self.after(0, lambda: self.update_progress(p))
                 
-            success = compress_video(input_path, output_path, target_height, 
-                                     total_duration=self.video_duration, 
-                                     progress_callback=progress_callback,
-                                     stop_event=self.stop_event)
-            self.after(0, lambda: self.compression_finished(success))
+            if target_height is None:
+                def status_callback(message):
+                    self.after(0, lambda: self.status_label.configure(text=f"Testing samples... {message}"))
+
+                success, choice = compress_video_auto_quality(input_path, output_path,
+                                                              total_duration=self.video_duration,
+                                                              progress_callback=progress_callback,
+                                                              stop_event=self.stop_event,
+                                                              status_callback=status_callback,
+                                                              fragmented=True, telemetry=telemetry)
+                self.last_auto_choice = choice
+            elif target_size:
+                success = compress_video_target_size(input_path, output_path, target_height, target_size,
+                                                     total_duration=self.video_duration,
+                                                     progress_callback=progress_callback,
+                                                     stop_event=self.stop_event,
+                                                     fragmented=True, telemetry=telemetry)
+            else:
+                success = compress_video(input_path, output_path, target_height, 
+                                         total_duration=self.video_duration, 
+                                         progress_callback=progress_callback,
+                                         stop_event=self.stop_event,
+                                         fragmented=True, telemetry=telemetry, tier=tier)
+            self.after(0, lambda: self.compression_finished(success, target_size))
         except Exception as e:
             print(f"Thread Error: {e}")
             traceback.print_exc()
             self.after(0, lambda: self.compression_finished(False))
 
-    def compression_finished(self, success):
+    def compression_finished(self, success, target_size=None):
         self.is_compressing = False
+        telemetry, self.job_telemetry = self.job_telemetry, None
+        if telemetry is None:
+            telemetry = JobTelemetry('gui', self.input_video_path, self.temp_output_path)
         try:
             # Reset Button to Start
             self.compress_btn.configure(text="Start Compression", fg_color="green", hover_color="darkgreen", state="normal")
             
             self.resolution_menu.configure(state="normal")
+            self.tier_menu.configure(state="normal")
             self.upload_btn.configure(state="normal")
+            self.target_size_entry.configure(state="normal")
+            self.sample_btn.configure(state="normal")
             
             if success:
                 self.progressbar.set(1)
                 self.status_label.configure(text="Compression Done!")
-                self.show_thumbnail_with_overlay(self.temp_output_path, "output")
+                with telemetry.phase('thumbnail'):
+                    self.show_thumbnail_with_overlay(self.temp_output_path, "output")
+                self.refresh_preview_strip()
                 
                 # Show output info
-                info = get_video_info(self.temp_output_path)
+                info = get_video_info(self.temp_output_path, use_cache=False)
                 if info:
-                    self.output_info_label.configure(text=f"Result Size: {info.get('width')}x{info.get('height')} ")
+                    size_mb = os.path.getsize(self.temp_output_path) / 1_000_000
+                    text = f"Result Size: {info.get('width')}x{info.get('height')} ({size_mb:.1f} MB) "
+                    if self.last_auto_choice:
+                        choice = self.last_auto_choice
+                        text += f"\nAuto: {choice['height']}p, CRF {choice['crf']}"
+                        if choice['searched']:
+                            text += f", SSIM {choice['score']:.3f}"
+                        else:
+                            text += " (too short to search)"
+                    self.output_info_label.configure(text=text)
                 
                 # Mark as last compressed so button disables if user selects this resolution again
-                self.last_compressed_resolution = self.resolution_var.get()
+                self.last_compressed_resolution = self.selected_resolution()
+                self.last_compressed_target_size = target_size
+                self.last_compressed_tier = self.tier_var.get()
                 self.change_resolution_event(self.resolution_var.get())
                 
                 self.save_btn.configure(state="normal")
+                record_job(telemetry.finish(True))
+                # The finished job is now part of the history the estimates learn from
+                self.refresh_resolution_estimates()
                 messagebox.showinfo("Success", "Compression complete! Click the preview to watch in your media player.")
             else:
+                if not self.stop_event.is_set():
+                    record_job(telemetry.finish(False))
                 # Cleanup incomplete temp file
                 if self.temp_output_path and os.path.exists(self.temp_output_path):
                     try:
@@ -414,6 +662,120 @@ class VideoCompressorApp(ctk.CTk):
         except Exception as e:
             print(f"Error in finish callback: {e}")
 
+    def discard_temp_output(self):
+        """Delete the compressed output unless it was saved (then temp_output_path is the user's file)."""
+        if self.temp_output_path and not self.output_saved:
+            try:
+                os.remove(self.temp_output_path)
+            except OSError:
+                pass
+        self.temp_output_path = None
+        self.output_saved = False
+
+    def on_close(self):
+        # Stop a running encode so its file can go too, then drop whatever wasn't saved
+        self.stop_event.set()
+        self.discard_temp_output()
+        self.remove_sample()
+        self.destroy()
+
+    def remove_sample(self):
+        """Delete the last preview sample; the output preview goes back to the compressed output."""
+        self.showing_sample = False
+        if self.sample_path:
+            try:
+                os.remove(self.sample_path)
+            except OSError:
+                pass
+            self.sample_path = None
+
+    def start_sample(self):
+        """Encode a short sample at the chosen resolution and show it, with the full encode's estimated size and time."""
+        try:
+            if self.is_sampling:
+                self.status_label.configure(text="Cancelling...")
+                self.stop_event.set()
+                return
+            if not self.input_video_path or self.is_compressing:
+                return
+
+            res_str = self.selected_resolution()
+            if res_str not in self.ALL_RESOLUTIONS:
+                messagebox.showinfo("Preview Sample", "Choose a resolution to preview. Auto quality tests its own samples.")
+                return
+            target_height = self.ALL_RESOLUTIONS[res_str]
+
+            self.remove_sample()
+            temp_fd, self.sample_path = tempfile.mkstemp(suffix=".mp4", prefix="sample_", dir=get_cache_dir("work"))
+            os.close(temp_fd)
+
+            self.stop_event.clear()
+            self.is_sampling = True
+            self.sample_btn.configure(text="Cancel Sample")
+            self.compress_btn.configure(state="disabled")
+            self.upload_btn.configure(state="disabled")
+            self.resolution_menu.configure(state="disabled")
+            self.tier_menu.configure(state="disabled")
+            self.reset_preview_label("output", f"Encoding a {res_str} sample...")
+            self.output_info_label.configure(text="")
+            self.progressbar.set(0)
+            # A sample shows the resolution at the default quality; a size limit only changes the bitrate
+            size_note = " (ignoring Max File Size)" if self.target_size_entry.get().strip() else ""
+            self.status_label.configure(text=f"Encoding a {res_str} sample{size_note}...")
+
+            tier = self.tier_var.get()
+            telemetry = JobTelemetry('sample', self.input_video_path, self.sample_path, resolution=res_str, tier=tier)
+            threading.Thread(target=self.run_sample_thread,
+                             args=(self.input_video_path, self.sample_path, target_height, res_str, telemetry, tier),
+                             daemon=True).start()
+        except Exception as e:
+            messagebox.showerror("Error Starting", f"Could not start the sample: {e}")
+            self.sample_finished(None, None, None)
+
+    def run_sample_thread(self, input_path, sample_path, target_height, res_str, telemetry, tier=None):
+        def progress_callback(p):
+            self.after(0, lambda: self.progressbar.set(p))
+
+        try:
+            estimate = compress_video_sample(input_path, sample_path, target_height,
+                                             progress_callback=progress_callback, stop_event=self.stop_event,
+                                             telemetry=telemetry, tier=tier)
+        except Exception as e:
+            print(f"Thread Error: {e}")
+            traceback.print_exc()
+            estimate = None
+        self.after(0, lambda: self.sample_finished(estimate, res_str, telemetry))
+
+    def sample_finished(self, estimate, res_str, telemetry):
+        self.is_sampling = False
+        self.sample_btn.configure(text="Preview Sample")
+        self.upload_btn.configure(state="normal")
+        self.resolution_menu.configure(state="normal")
+        self.tier_menu.configure(state="normal")
+        self.change_resolution_event(self.resolution_var.get())
+        try:
+            if estimate:
+                self.showing_sample = True
+                self.progressbar.set(1)
+                self.show_thumbnail_with_overlay(self.sample_path, "output")
+                self.output_info_label.configure(
+                    text=f"{res_str} sample: {estimate['sample_seconds']:.0f}s of video, "
+                         f"{estimate['sample_bytes'] / 1_000_000:.1f} MB\n"
+                         f"Full video: ~{estimate['estimated_bytes'] / 1_000_000:.0f} MB, "
+                         f"~{format_eta(estimate['estimated_seconds'])} to compress")
+                self.status_label.configure(text="Sample ready. Click the output preview to watch it.")
+                record_job(telemetry.finish(True))
+                return
+            cancelled = self.stop_event.is_set()
+            if telemetry is not None and not cancelled:
+                record_job(telemetry.finish(False))
+            self.remove_sample()
+            self.progressbar.set(0)
+            self.status_label.configure(text="Sample cancelled." if cancelled else "Sample failed!")
+            self.reset_preview_label("output", "Cancelled" if cancelled else "Sample failed")
+        except Exception as e:
+            print(f"Error in sample callback: {e}")
+
     def save_video(self):
         try:
             if not self.temp_output_path: return
@@ -421,7 +783,9 @@ class VideoCompressorApp(ctk.CTk):
             original_name = os.path.basename(self.input_video_path)
             
             # Use the resolution that was *actually* compressed, not the pending dropdown selection
-            res_tag = self.last_compressed_resolution if self.last_compressed_resolution else self.resolution_var.get()
+            res_tag = self.last_compressed_resolution if self.last_compressed_resolution else self.selected_resolution()
+            if res_tag == self.AUTO_QUALITY_LABEL and self.last_auto_choice:
+                res_tag = f"{self.last_auto_choice['height']}p"
             default_name = f"compressed_{res_tag.split(' ')[0]}_{original_name}"
             
             save_path = filedialog.asksaveasfilename(defaultextension=".mp4", 
@@ -429,7 +793,16 @@ class VideoCompressorApp(ctk.CTk):
                                                      initialfile=default_name)
             if save_path:
                 try:
-                    shutil.copy2(self.temp_output_path, save_path)
+                    # The first save turns the fragmented preview into a regular MP4 (a stream copy)
+                    # and drops the temp file; saving again copies from the saved file
+                    start = time.monotonic()
+                    method = save_output(self.temp_output_path, save_path, move=not self.output_saved,
+                                         defragment=not self.output_saved)
+                    record_phase('gui', 'save', time.monotonic() - start, method=method)
+                    if not self.output_saved:
+                        self.temp_output_path = save_path
+                        self.output_saved = True
+                    print(f"Saved output ({method}): {save_path}")
                     messagebox.showinfo("Saved", f"Video saved to:\n{save_path}")
                 except Exception as e:
                     messagebox.showerror("Error", f"Failed to save: {e}")
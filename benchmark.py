@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from cache import get_cache_dir
+from compressor import (get_ffmpeg_path, get_video_info, get_thumbnail, compress_video, select_pipeline,
+                        hidden_window_startupinfo, ALL_RESOLUTIONS, SPEED_TIERS)
+from quality import parse_score
+
+BENCH_FPS = 30
+DEFAULT_SIZES = [720, 1080]
+DEFAULT_DURATIONS = [5]
+DEFAULT_PRESETS = ['veryfast', 'medium']
+# Tier cases encode each reference clip to the next resolution down
+DEFAULT_TIER_SIZES = [720, 1080]
+
+# Entry points whose cold start is measured ('' = the bare interpreter, for reference)
+STARTUP_MODULES = ['', 'compressor', 'jobqueue', 'watcher', 'aiocompressor', 'server', 'predictor', 'app']
+# Modules that are expensive to load; startup cases report which of them an import pulled in
+HEAVY_MODULES = ('cv2', 'numpy', 'PIL', 'imageio_ffmpeg', 'customtkinter', 'tkinter')
+DEFAULT_STARTUP_REPEAT = 5
+
+# Runs in a fresh interpreter: times one import, then reports its peak memory and which heavy
+# modules it loaded. Memory is read in the child: on Linux, ru_maxrss as seen by the parent keeps
+# the high-water mark of the forked parent from before exec.
+_STARTUP_PROBE = """
+import sys, time, json, importlib
+start = time.perf_counter()
+if sys.argv[1]:
+    importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+peak_kb = None
+try:
+    with open('/proc/self/status') as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except (OSError, StopIteration):
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize',
+                'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = Counters(cb=ctypes.sizeof(Counters))
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        peak_kb = counters.PeakWorkingSetSize // 1024
+    else:
+        import resource
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak_kb = peak_kb // 1024 if sys.platform == 'darwin' else peak_kb
+print(json.dumps({'import': elapsed, 'peak_rss_kb': peak_kb,
+                  'loaded': [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+# Relative slowdown (wall time) beyond which compare() reports a regression
+DEFAULT_THRESHOLD = 0.10
+
+def synthetic_source(height, duration, directory=None):
+    """
+    Path to a deterministic synthetic clip of the given height and duration, generating it if needed.
+    Clips are 16:9, 30 fps, with a sine-tone AAC track.
+    """
+    directory = directory or get_cache_dir("bench_sources")
+    width = (height * 16 // 9) // 2 * 2
+    path = os.path.join(directory, f"testsrc2_{height}p_{duration}s.mp4")
+    if os.path.exists(path):
+        return path
+
+    tmp_path = path + ".tmp.mp4"
+    cmd = [
+        get_ffmpeg_path(), '-y', '-nostdin', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={BENCH_FPS}:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-threads', '1',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-fflags', '+bitexact', '-flags', '+bitexact', '-map_metadata', '-1',
+        '-shortest',
+        tmp_path
+    ]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, startupinfo=hidden_window_startupinfo())
+    os.replace(tmp_path, path)
+    return path
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run([get_ffmpeg_path(), '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, startupinfo=hidden_window_startupinfo())
+        return result.stdout.splitlines()[0]
+    except Exception:
+        return "unknown"
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'ffmpeg': ffmpeg_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def _measure(func, repeat):
+    """
+    Run func() `repeat` times. func returns (ok, extra_metrics_dict).
+    Reports the median wall time and the metrics of that run.
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ok, metrics = func()
+        metrics['wall'] = time.perf_counter() - start
+        if not ok:
+            return None
+        runs.append(metrics)
+    median_wall = statistics.median(r['wall'] for r in runs)
+    return min(runs, key=lambda r: abs(r['wall'] - median_wall))
+
+def bench_encode(source, source_height, duration, target_height, preset, work_dir, repeat=1):
+    output = os.path.join(work_dir, f"out_{target_height}_{preset}.mp4")
+
+    def run():
+        usage = {}
+        ok = compress_video(source, output, target_height, total_duration=duration, preset=preset,
+                            fast_path=False, usage=usage, use_cache=False)
+        metrics = {
+            'cpu_user': usage.get('cpu_user'),
+            'cpu_sys': usage.get('cpu_sys'),
+            'peak_rss_kb': usage.get('peak_rss_kb'),
+            'output_bytes': os.path.getsize(output) if ok else 0,
+        }
+        return ok, metrics
+
+    result = _measure(run, repeat)
+    if result is None:
+        return None
+    frames = duration * BENCH_FPS
+    result['fps'] = frames / result['wall'] if result['wall'] > 0 else 0
+    result['name'] = f"encode/{source_height}p-{duration}s/{target_height}p/{preset}"
+    return result
+
+def measure_ssim(source, encoded):
+    """SSIM of an encode against its source, scaled back up to the source size first. None on failure."""
+    info = get_video_info(source)
+    if not info:
+        return None
+    cmd = [get_ffmpeg_path(), '-hide_banner', '-nostdin', '-i', source, '-i', encoded,
+           '-lavfi', f"[1:v]scale={info['width']}:{info['height']}:flags=bicubic[d];[0:v:0][d]ssim",
+           '-f', 'null', '-']
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, errors='replace', startupinfo=hidden_window_startupinfo())
+    return parse_score(result.stderr, 'ssim')
+
+def bench_tier(source, label, duration, target_height, tier, work_dir, repeat=1):
+    """
+    Encode `source` at a speed tier: fps, output bitrate and SSIM, plus the encoder the tier
+    resolved to on this ffmpeg build.
+    """
+    output = os.path.join(work_dir, f"tier_{target_height}_{tier}.mp4")
+
+    def run():
+        usage = {}
+        ok = compress_video(source, output, target_height, total_duration=duration, tier=tier,
+                            fast_path=False, usage=usage, use_cache=False)
+        metrics = {
+            'cpu_user': usage.get('cpu_user'),
+            'cpu_sys': usage.get('cpu_sys'),
+            'peak_rss_kb': usage.get('peak_rss_kb'),
+            'output_bytes': os.path.getsize(output) if ok else 0,
+        }
+        return ok, metrics
+
+    result = _measure(run, repeat)
+    if result is None:
+        return None
+    info = get_video_info(source) or {}
+    frames = duration * (info.get('fps') or BENCH_FPS)
+    result['fps'] = frames / result['wall'] if result['wall'] > 0 else 0
+    # Whole-file bitrate, audio included; the audio is the same in every tier
+    result['kbps'] = result['output_bytes'] * 8 / duration / 1000 if duration > 0 else 0
+    result['ssim'] = measure_ssim(source, output)
+    result['encoder'] = select_pipeline(get_ffmpeg_path(), tier=tier)['video']
+    result['name'] = f"tier/{label}/{target_height}p/{tier}"
+    return result
+
+def bench_probe(source, source_height, duration, repeat=1):
+    result = _measure(lambda: (get_video_info(source, use_cache=False) is not None, {}), repeat)
+    if result:
+        result['name'] = f"probe/{source_height}p-{duration}s"
+    return result
+
+def bench_thumbnail(source, source_height, duration, repeat=1):
+    result = _measure(lambda: (get_thumbnail(source, size=(550, 380), use_cache=False) is not None, {}), repeat)
+    if result:
+        result['name'] = f"thumbnail/{source_height}p-{duration}s"
+    return result
+
+def bench_startup(module, repeat=DEFAULT_STARTUP_REPEAT):
+    """
+    Cold start of `module` in a fresh interpreter: import time (the case's wall time), time until
+    the process exited, peak memory of the process and the heavy modules it loaded. The first run also writes bytecode caches, so use a repeat of 3 or more.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    def run():
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, module] + list(HEAVY_MODULES),
+                                cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                universal_newlines=True, startupinfo=hidden_window_startupinfo())
+        if result.returncode != 0:
+            return False, {}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        probe['process_wall'] = time.perf_counter() - start
+        return True, probe
+
+    result = _measure(run, repeat)
+    if result is None:
+        return None
+    # Compare import time rather than process time, which includes interpreter start-up
+    result['wall'] = result.pop('import')
+    result['name'] = f"startup/{module or 'interpreter'}"
+    return result
+
+def run_startup_suite(modules=None, repeat=DEFAULT_STARTUP_REPEAT, log=print):
+    """
+    Cold-start benchmark of the app's entry points.
+    Returns: {'machine': {...}, 'results': [ {name, wall, process_wall, peak_rss_kb, loaded}, ... ]}
+    """
+    results = []
+    for module in (STARTUP_MODULES if modules is None else modules):
+        result = bench_startup(module, repeat)
+        if result is None:
+            log(f"Could not import {module}, skipped.")
+            continue
+        results.append(result)
+        log(format_result(result))
+    return {'machine': machine_info(), 'results': results}
+
+def run_suite(sizes=None, durations=None, presets=None, targets=None, repeat=1, log=print):
+    """
+    Run every benchmark case. targets defaults to each ALL_RESOLUTIONS height below the source.
+    Returns: {'machine': {...}, 'results': [ {name, wall, fps, cpu_user, cpu_sys, peak_rss_kb, output_bytes}, ... ]}
+    """
+    sizes = sizes or DEFAULT_SIZES
+    durations = durations or DEFAULT_DURATIONS
+    presets = presets or DEFAULT_PRESETS
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="vc_bench_")
+    try:
+        for height in sizes:
+            for duration in durations:
+                source = synthetic_source(height, duration)
+                cases = [bench_probe(source, height, duration, repeat),
+                         bench_thumbnail(source, height, duration, repeat)]
+                heights = targets or [h for h in ALL_RESOLUTIONS.values() if h < height]
+                for target in heights:
+                    for preset in presets:
+                        cases.append(bench_encode(source, height, duration, target, preset, work_dir, repeat))
+                for case in cases:
+                    if case is None:
+                        log("A benchmark case failed, see the output above.")
+                        continue
+                    results.append(case)
+                    log(format_result(case))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'machine': machine_info(), 'results': results}
+
+def _tier_target(height):
+    lower = [h for h in ALL_RESOLUTIONS.values() if h < height]
+    return max(lower) if lower else height
+
+def run_tier_suite(sizes=None, duration=5, tiers=None, clips=(), repeat=1, log=print):
+    """
+    Benchmark the speed tiers: every tier encodes the synthetic clips of `sizes` and any real
+    `clips` to the next resolution down.
+    Returns: {'machine': {...}, 'results': [ {name, wall, fps, kbps, ssim, encoder, ...}, ... ]}
+    """
+    sources = [(synthetic_source(height, duration), f"{height}p-{duration}s", height, duration)
+               for height in (sizes or DEFAULT_TIER_SIZES)]
+    for clip in clips:
+        info = get_video_info(clip)
+        if not info or not info.get('duration'):
+            log(f"Could not probe {clip}, skipped.")
+            continue
+        sources.append((clip, os.path.basename(clip), info['height'], info['duration']))
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="vc_bench_")
+    try:
+        for source, label, height, source_duration in sources:
+            for tier in (tiers or list(SPEED_TIERS)):
+                case = bench_tier(source, label, source_duration, _tier_target(height), tier, work_dir, repeat)
+                if case is None:
+                    log(f"Tier {tier} failed on {label}, see the output above.")
+                    continue
+                results.append(case)
+                log(format_result(case))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'machine': machine_info(), 'results': results}
+
+def format_result(result):
+    text = f"{result['name']:<40} {result['wall']:8.3f}s"
+    if result.get('fps'):
+        text += f" {result['fps']:8.1f} fps"
+    if result.get('cpu_user') is not None:
+        text += f"  cpu {result['cpu_user'] + result['cpu_sys']:.2f}s"
+    if result.get('peak_rss_kb'):
+        text += f"  rss {result['peak_rss_kb'] / 1024:.0f} MB"
+    if result.get('output_bytes'):
+        text += f"  {result['output_bytes'] / 1e6:.2f} MB out"
+    if result.get('kbps'):
+        text += f"  {result['kbps']:.0f} kbit/s"
+    if result.get('ssim') is not None:
+        text += f"  SSIM {result['ssim']:.4f}"
+    if result.get('encoder'):
+        text += f"  ({result['encoder']})"
+    if 'loaded' in result:
+        text += f"  loads: {', '.join(result['loaded']) or '-'}"
+    return text
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two results files case by case on wall time and, where both runs recorded it, peak memory.
+    Returns: list of dicts {name, baseline, current, change, rss_change, regression} for cases present
+    in both, where change is the relative wall time difference (+0.25 = 25% slower) and rss_change
+    the relative peak memory difference (None if unknown).
+    """
+    base = {r['name']: r for r in baseline.get('results', [])}
+    rows = []
+    for result in current.get('results', []):
+        old = base.get(result['name'])
+        if not old or not old.get('wall'):
+            continue
+        change = (result['wall'] - old['wall']) / old['wall']
+        rss_change = None
+        if old.get('peak_rss_kb') and result.get('peak_rss_kb'):
+            rss_change = (result['peak_rss_kb'] - old['peak_rss_kb']) / old['peak_rss_kb']
+        rows.append({'name': result['name'], 'baseline': old['wall'], 'current': result['wall'],
+                     'change': change, 'rss_change': rss_change,
+                     'regression': change > threshold or (rss_change or 0) > threshold})
+    return rows
+
+def print_comparison(rows, threshold):
+    regressions = 0
+    for row in rows:
+        flag = "REGRESSION" if row['regression'] else ""
+        regressions += row['regression']
+        rss = f"  rss {row['rss_change']:+7.1%}" if row.get('rss_change') is not None else ""
+        print(f"{row['name']:<40} {row['baseline']:8.3f}s -> {row['current']:8.3f}s  {row['change']:+7.1%}{rss}  {flag}")
+    print(f"{regressions} regression(s) over {threshold:.0%} in {len(rows)} comparable case(s)")
+    return regressions
+
+def _write_and_compare(report, output, baseline_path, threshold):
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    if not baseline_path:
+        return 0
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    return 1 if print_comparison(compare(baseline, report, threshold), threshold) else 0
+
+def _int_list(text):
+    return [int(x) for x in text.split(',') if x.strip()]
+
+def _str_list(text):
+    return [x.strip() for x in text.split(',') if x.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python benchmark.py", description="Encode benchmarks on synthetic clips.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="Run the benchmark suite.")
+    run.add_argument('-o', '--output', default="benchmark_results.json", help="Where to write the JSON results.")
+    run.add_argument('--sizes', type=_int_list, default=DEFAULT_SIZES, help="Source heights, e.g. 720,1080.")
+    run.add_argument('--durations', type=_int_list, default=DEFAULT_DURATIONS, help="Source durations in seconds.")
+    run.add_argument('--presets', type=_str_list, default=DEFAULT_PRESETS, help="x264 presets to encode with.")
+    run.add_argument('--targets', type=_int_list, default=None, help="Target heights (default: every lower resolution).")
+    run.add_argument('--repeat', type=int, default=1, help="Runs per case; the median is reported.")
+    run.add_argument('--baseline', help="Compare against this earlier results file when done.")
+    run.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (0.10 = 10%%).")
+
+    startup = sub.add_parser('startup', help="Measure cold-start import time and memory of the entry points.")
+    startup.add_argument('-o', '--output', default="startup_results.json", help="Where to write the JSON results.")
+    startup.add_argument('--modules', type=_str_list, default=None,
+                         help=f"Modules to import (default: {','.join(m for m in STARTUP_MODULES if m)}).")
+    startup.add_argument('--repeat', type=int, default=DEFAULT_STARTUP_REPEAT, help="Runs per module; the median is reported.")
+    startup.add_argument('--baseline', help="Compare against this earlier results file when done.")
+    startup.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (0.10 = 10%%).")
+
+    tiers = sub.add_parser('tiers', help="Measure fps, bitrate and SSIM of each speed tier on reference clips.")
+    tiers.add_argument('-o', '--output', default="tier_results.json", help="Where to write the JSON results.")
+    tiers.add_argument('--sizes', type=_int_list, default=DEFAULT_TIER_SIZES, help="Heights of the synthetic clips, e.g. 720,1080.")
+    tiers.add_argument('--duration', type=int, default=5, help="Length of the synthetic clips in seconds.")
+    tiers.add_argument('--tiers', type=_str_list, default=None, help=f"Tiers to run (default: {','.join(SPEED_TIERS)}).")
+    tiers.add_argument('--clip', action='append', default=[], help="A real video to benchmark as well; repeat for more.")
+    tiers.add_argument('--repeat', type=int, default=1, help="Runs per case; the median is reported.")
+    tiers.add_argument('--baseline', help="Compare against this earlier results file when done.")
+    tiers.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (0.10 = 10%%).")
+
+    cmp_parser = sub.add_parser('compare', help="Compare two results files.")
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('current')
+    cmp_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="Slowdown that counts as a regression (0.10 = 10%%).")
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        report = run_suite(args.sizes, args.durations, args.presets, args.targets, args.repeat)
+        return _write_and_compare(report, args.output, args.baseline, args.threshold)
+    if args.command == 'startup':
+        modules = [''] + args.modules if args.modules else None
+        report = run_startup_suite(modules, args.repeat)
+        return _write_and_compare(report, args.output, args.baseline, args.threshold)
+    if args.command == 'tiers':
+        report = run_tier_suite(args.sizes, args.duration, args.tiers, args.clip, args.repeat)
+        return _write_and_compare(report, args.output, args.baseline, args.threshold)
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    return 1 if print_comparison(compare(baseline, current, args.threshold), args.threshold) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,10 +32,12 @@ echo [INFO] Building Executable...
 :: --windowed: no console window popup
 :: --add-data: include customtkinter layout files
 :: --name: output filename
+:: --exclude-module: OpenCV is optional; leaving it (and numpy) out keeps the exe small and quick to start
 
 pyinstaller --noconfirm --onefile --windowed --name "VideoCompressorPro" ^
     --add-data "%CTK_PATH%;customtkinter" ^
     --hidden-import "PIL._tkinter_finder" ^
+    --exclude-module cv2 --exclude-module numpy ^
     app.py
 
 echo.
@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+def get_cache_dir(*parts):
+    """
+    Returns (and creates) the app's cache directory, optionally a named sub-folder of it.
+    Override the location with the VIDEO_COMPRESSOR_CACHE_DIR environment variable.
+    """
+    base = os.environ.get("VIDEO_COMPRESSOR_CACHE_DIR")
+    if not base:
+        if os.name == 'nt':
+            base = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "VideoCompressorPro", "cache")
+        elif sys.platform == "darwin":
+            base = os.path.join(os.path.expanduser("~"), "Library", "Caches", "VideoCompressorPro")
+        else:
+            base = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "video-compressor-pro")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def get_data_dir(*parts):
+    """
+    Returns (and creates) the app's data directory for state that must survive, unlike the cache.
+    Override the location with the VIDEO_COMPRESSOR_DATA_DIR environment variable.
+    """
+    base = os.environ.get("VIDEO_COMPRESSOR_DATA_DIR")
+    if not base:
+        if os.name == 'nt':
+            base = os.path.join(os.environ.get("APPDATA", os.path.expanduser("~")), "VideoCompressorPro")
+        elif sys.platform == "darwin":
+            base = os.path.join(os.path.expanduser("~"), "Library", "Application Support", "VideoCompressorPro")
+        else:
+            base = os.path.join(os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")), "video-compressor-pro")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def file_identity(file_path):
+    """
+    Cheap identity of a file on disk: (normalized absolute path, size, mtime in ns).
+    Returns None if the file can't be stat'ed.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return os.path.normcase(os.path.abspath(file_path)), st.st_size, st.st_mtime_ns
+
+def file_fingerprint(file_path, sample_bytes=256 * 1024):
+    """
+    Fast content fingerprint: the size plus a SHA-1 of three samples (start, middle, end).
+    Unlike file_identity it survives copies and renames, and it costs three small reads
+    however large the file is. Returns None if the file can't be read.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        digest = hashlib.sha1(str(size).encode('ascii'))
+        with open(file_path, 'rb') as f:
+            for offset in (0, max(0, size // 2 - sample_bytes // 2), max(0, size - sample_bytes)):
+                f.seek(offset)
+                digest.update(f.read(sample_bytes))
+    except OSError:
+        return None
+    return f"{size}-{digest.hexdigest()}"
+
+# ioctl request for a copy-on-write clone of a whole file on Linux (Btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+def clone_file(src_path, dst_path):
+    """
+    Copy-on-write clone (reflink) of src_path to dst_path: instant and without writing the data
+    again, but only on filesystems that support it (Btrfs/XFS on Linux, APFS on macOS).
+    Returns True if cloned; False leaves nothing behind so the caller can fall back to a copy.
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            import fcntl
+            with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        if sys.platform == "darwin":
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            # clonefile(2) refuses to overwrite
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            return libc.clonefile(os.fsencode(src_path), os.fsencode(dst_path), 0) == 0
+    except (OSError, AttributeError):
+        pass
+    try:
+        os.remove(dst_path)
+    except OSError:
+        pass
+    return False
+
+def copy_file_fast(src_path, dst_path):
+    """Clone src_path to dst_path where the filesystem allows it, otherwise copy it."""
+    if not clone_file(src_path, dst_path):
+        shutil.copyfile(src_path, dst_path)
+
+def prune_stale_files(directory, max_age_seconds):
+    """
+    Delete files in `directory` not modified for max_age_seconds, e.g. work files left behind by a
+    crash. Files still being written keep a fresh mtime. Returns the number of files deleted.
+    """
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            # Still open elsewhere (Windows) or already gone
+            pass
+    return removed
+
+class JsonCache:
+    """
+    Small persistent key -> JSON value store with LRU eviction.
+    Reads are served from memory; writes are flushed to disk at most every `flush_interval`
+    seconds (and at exit) so bulk updates don't rewrite the file for every entry.
+    """
+
+    def __init__(self, path, max_entries=20000, flush_interval=2.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries = None
+        self._dirty = False
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, list):
+                for key, value in data:
+                    self._entries[key] = value
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._load()
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def remove(self, key):
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._dirty or self._entries is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                # Stored oldest -> newest so the LRU order survives a reload
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        except OSError as e:
+            print(f"Warning: could not write cache {self.path}: {e}")
+
+class FileCache:
+    """
+    Directory of cached files with a total size budget and least-recently-used eviction.
+    Entries are addressed by an arbitrary string key; a hit refreshes the file's mtime,
+    which is what eviction orders by.
+    """
+
+    def __init__(self, directory, max_bytes, suffix=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def get(self, key):
+        """Returns the cached file's path, or None on a miss."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def put_bytes(self, key, data):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write cache entry: {e}")
+            return None
+        self.evict(keep=path)
+        return path
+
+    def put_file(self, key, src_path, move=False, clone_only=False):
+        """
+        Store a copy of src_path (or move it in when move=True). clone_only=True stores it only if
+        the filesystem can clone it without writing the data again.
+        Returns the cached path or None.
+        """
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if move:
+                shutil.move(src_path, tmp_path)
+            elif clone_only:
+                if not clone_file(src_path, tmp_path):
+                    return None
+            else:
+                copy_file_fast(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write cache entry: {e}")
+            return None
+        self.evict(keep=path)
+        return path
+
+    def remove(self, key):
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+
+    def total_bytes(self):
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, os.path.join(self.directory, name), st.st_size))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the directory fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, _, size in entries)
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,140 @@
+import os
+import re
+import shutil
+import threading
+import subprocess
+
+from cache import JsonCache, get_cache_dir, file_identity
+
+# Bump when the shape of the inspected capabilities changes, so old cache entries are ignored
+CAPABILITIES_VERSION = 1
+
+class FFmpegCapabilityError(RuntimeError):
+    """The ffmpeg build lacks an encoder or filter a job needs; raised before ffmpeg is started."""
+
+def parse_version(text):
+    """(version string, configure flags) from `ffmpeg -version` output."""
+    match = re.search(r"ffmpeg version (\S+)", text)
+    configuration = re.search(r"^configuration:(.*)$", text, re.MULTILINE)
+    return (match.group(1) if match else "unknown",
+            configuration.group(1).split() if configuration else [])
+
+def parse_encoders(text):
+    """
+    `ffmpeg -encoders` listing as {name: {'type', 'frame_threads', 'slice_threads', 'experimental'}},
+    type being 'video', 'audio' or 'subtitle'.
+    """
+    encoders = {}
+    # The legend above the ------ line uses the same layout as the entries
+    _, _, listing = text.partition("------")
+    for match in re.finditer(r"^\s*([VAS])([F.])([S.])([X.])[B.][D.]\s+(\S+)", listing, re.MULTILINE):
+        kind, frame, slices, experimental, name = match.groups()
+        encoders[name] = {'type': {'V': 'video', 'A': 'audio', 'S': 'subtitle'}[kind],
+                          'frame_threads': frame == 'F', 'slice_threads': slices == 'S',
+                          'experimental': experimental == 'X'}
+    return encoders
+
+def parse_filters(text):
+    """`ffmpeg -filters` listing as {name: {'slice_threads', 'timeline'}}."""
+    filters = {}
+    for match in re.finditer(r"^\s*([T.])([S.])[C.]\s+(\S+)\s+\S*->\S*", text, re.MULTILINE):
+        timeline, slices, name = match.groups()
+        filters[name] = {'slice_threads': slices == 'S', 'timeline': timeline == 'T'}
+    return filters
+
+def parse_pix_fmts(text):
+    """Pixel formats from `ffmpeg -pix_fmts` that ffmpeg can convert to (usable as -pix_fmt)."""
+    _, _, listing = text.partition("-----")
+    return sorted(name for flags, name in re.findall(r"^([I.]O[H.][P.][B.])\s+(\S+)", listing, re.MULTILINE))
+
+def inspect_ffmpeg(ffmpeg_exe, startupinfo=None):
+    """
+    Ask an ffmpeg binary what it can do. Takes four short ffmpeg runs, so use get_capabilities,
+    which caches the answer.
+    Returns dict with version, configuration, threads (built with a threading library),
+    encoders, filters and pix_fmts, or None if the binary can't be run.
+    """
+    outputs = {}
+    try:
+        for option in ('-version', '-encoders', '-filters', '-pix_fmts'):
+            result = subprocess.run([ffmpeg_exe, '-hide_banner', option], stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                                    errors='replace', startupinfo=startupinfo, timeout=30)
+            if result.returncode != 0:
+                return None
+            outputs[option] = result.stdout
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Could not inspect FFmpeg at {ffmpeg_exe}: {e}")
+        return None
+
+    version, configuration = parse_version(outputs['-version'])
+    return {
+        'version': version,
+        'configuration': configuration,
+        'threads': not ('--disable-pthreads' in configuration and '--disable-w32threads' in configuration),
+        'encoders': parse_encoders(outputs['-encoders']),
+        'filters': parse_filters(outputs['-filters']),
+        'pix_fmts': parse_pix_fmts(outputs['-pix_fmts']),
+    }
+
+_capabilities_disk = None
+_capabilities_memory = {}
+_capabilities_lock = threading.Lock()
+
+def get_capabilities_cache():
+    """Disk cache of inspected ffmpeg builds, keyed by the binary's path."""
+    global _capabilities_disk
+    if _capabilities_disk is None:
+        _capabilities_disk = JsonCache(os.path.join(get_cache_dir(), "ffmpeg_capabilities.json"), max_entries=16)
+    return _capabilities_disk
+
+def get_capabilities(ffmpeg_exe, startupinfo=None):
+    """
+    Capabilities of the ffmpeg binary (see inspect_ffmpeg), inspected once per binary: the result is
+    kept in memory and on disk, keyed by the binary's path and only trusted while its size and
+    mtime are unchanged, so an upgraded ffmpeg is inspected again.
+    Returns None if the binary can't be found or run.
+    """
+    resolved = shutil.which(ffmpeg_exe) or ffmpeg_exe
+    identity = file_identity(resolved)
+    if identity is None:
+        return None
+    with _capabilities_lock:
+        if identity in _capabilities_memory:
+            return _capabilities_memory[identity]
+
+        key, size, mtime_ns = identity
+        cached = get_capabilities_cache().get(key)
+        if (cached and cached.get('size') == size and cached.get('mtime_ns') == mtime_ns
+                and cached.get('version') == CAPABILITIES_VERSION):
+            capabilities = cached['capabilities']
+        else:
+            capabilities = inspect_ffmpeg(resolved, startupinfo)
+            if capabilities:
+                get_capabilities_cache().put(key, {'size': size, 'mtime_ns': mtime_ns,
+                                                   'version': CAPABILITIES_VERSION,
+                                                   'capabilities': capabilities})
+        if capabilities:
+            _capabilities_memory[identity] = capabilities
+        return capabilities
+
+def pick_encoder(capabilities, candidates, stage):
+    """
+    The first of `candidates` (ordered fastest first) the build has; with unknown capabilities,
+    the first candidate. Raises FFmpegCapabilityError if the build has none of them.
+    """
+    if capabilities is None:
+        return candidates[0]
+    for name in candidates:
+        if name in capabilities['encoders']:
+            return name
+    raise FFmpegCapabilityError(f"FFmpeg {capabilities['version']} has no {stage} encoder; "
+                                f"it needs one of: {', '.join(candidates)}")
+
+def require_filters(capabilities, names):
+    """Raise FFmpegCapabilityError unless the build has every filter in `names` (unknown builds pass)."""
+    if capabilities is None:
+        return
+    missing = [name for name in names if name not in capabilities['filters']]
+    if missing:
+        raise FFmpegCapabilityError(f"FFmpeg {capabilities['version']} lacks the filter(s): {', '.join(missing)}")
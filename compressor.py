@@ -1,18 +1,95 @@
 
 import os
-import cv2
-import imageio_ffmpeg
+import sys
+import importlib
 
 import subprocess
 import re
+import glob
+import time
+import argparse
+import contextlib
+import threading
+import shutil
+import tempfile
+import io
+import queue
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from PIL import Image
+from collections import OrderedDict, deque
+
+from cache import JsonCache, FileCache, get_cache_dir, file_identity, file_fingerprint, clone_file, copy_file_fast
+from governor import get_governor, estimate_job
+from telemetry import JobTelemetry, record_job
+from capabilities import get_capabilities, pick_encoder, require_filters, FFmpegCapabilityError
+
+class _LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access, so `import compressor`
+    stays cheap for headless workers and the CLI: OpenCV (with numpy) alone costs more start-up
+    time and memory than the rest of the app, and most runs never touch it.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (loaded)' if self._module else ''}>"
+
+cv2 = _LazyModule('cv2')
+imageio_ffmpeg = _LazyModule('imageio_ffmpeg')
+Image = _LazyModule('PIL.Image')
+ImageDraw = _LazyModule('PIL.ImageDraw')
+
+_opencv_available = None
+
+def opencv_available():
+    """OpenCV is optional: it is only the fallback prober and thumbnailer when ffmpeg fails."""
+    global _opencv_available
+    if _opencv_available is None:
+        try:
+            cv2._load()
+            _opencv_available = True
+        except ImportError:
+            _opencv_available = False
+    return _opencv_available
+
+# Resolution mapping (Label -> Height int), shared by the GUI and the CLI
+ALL_RESOLUTIONS = {
+    "144p": 144,
+    "240p": 240,
+    "360p": 360,
+    "480p": 480,
+    "720p": 720,
+    "1080p": 1080,
+    "1440p": 1440,
+    "2160p (4K)": 2160
+}
+
+# Extensions picked up when a directory is given to the batch command (same as the GUI open dialog)
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+
+_ffmpeg_path = None
 
 def get_ffmpeg_path():
-    """Returns the path to the ffmpeg executable bundled with imageio-ffmpeg."""
+    """Returns the path to the ffmpeg executable bundled with imageio-ffmpeg (looked up once per process)."""
+    global _ffmpeg_path
+    if _ffmpeg_path:
+        return _ffmpeg_path
     try:
         path = imageio_ffmpeg.get_ffmpeg_exe()
         if os.path.exists(path):
+            _ffmpeg_path = path
             return path
         else:
             print(f"Warning: imageio-ffmpeg returned path that doesn't exist: {path}")
@@ -21,14 +98,177 @@ def get_ffmpeg_path():
         print(f"Error finding ffmpeg: {e}")
         return "ffmpeg" # Fallback to system PATH
 
-def get_video_info(file_path):
+# Encoders per pipeline stage, fastest first; each job uses the first one the ffmpeg build has.
+# libx264 is the only H.264 encoder with the crf/preset controls the app exposes.
+VIDEO_ENCODERS = ('libx264',)
+AUDIO_ENCODERS = ('libfdk_aac', 'aac')
+PIPELINE_FILTERS = ('scale',)
+
+# Named speed tiers, fastest first. Each lists (encoder, options) best first and a job uses the
+# first whose encoder the ffmpeg build has. The CRFs are set so every tier lands at about the
+# same SSIM; measured fps and bitrates are in the README (benchmark.py tiers).
+SPEED_TIERS = OrderedDict([
+    ('fastest', (('libx264', ['-preset', 'veryfast', '-crf', '23']),)),
+    ('balanced', (('libx264', ['-preset', 'medium', '-crf', '23']),)),
+    ('small', (('libx265', ['-preset', 'medium', '-crf', '28']),
+               ('libx264', ['-preset', 'slow', '-crf', '23']))),
+    ('smallest', (('libsvtav1', ['-preset', '8', '-crf', '38']),
+                  ('libaom-av1', ['-cpu-used', '6', '-row-mt', '1', '-crf', '38', '-b:v', '0']),
+                  ('libvpx-vp9', ['-deadline', 'good', '-cpu-used', '4', '-row-mt', '1', '-crf', '42', '-b:v', '0']),
+                  ('libx265', ['-preset', 'slow', '-crf', '28']))),
+])
+DEFAULT_TIER = 'balanced'
+# Options an encoder always gets (x265 logs every frame otherwise), and the codec tag its
+# output needs: Apple players only accept HEVC in MP4 under hvc1
+ENCODER_ARGS = {'libx265': ['-x265-params', 'log-level=error']}
+ENCODER_TAGS = {'libx265': ['-tag:v', 'hvc1']}
+
+def pick_tier(capabilities, tier):
+    """
+    (encoder, options) of a speed tier for an ffmpeg build (None: unknown build, first choice).
+    Raises ValueError for an unknown tier and FFmpegCapabilityError if the build has none of its encoders.
+    """
+    if tier not in SPEED_TIERS:
+        raise ValueError(f"Unknown speed tier '{tier}'. Choose from: {', '.join(SPEED_TIERS)}")
+    choices = dict(SPEED_TIERS[tier])
+    encoder = pick_encoder(capabilities, [name for name, _ in SPEED_TIERS[tier]], f"'{tier}' tier")
+    return encoder, choices[encoder]
+
+def select_pipeline(ffmpeg_exe, filters=PIPELINE_FILTERS, tier=None):
+    """
+    Encoders for a job, checked against what the ffmpeg build can do (see capabilities.py):
+    dict with 'video', 'video_args' (the speed tier's encoder options, None without a tier),
+    'audio', 'mov_text' (whether text subtitles can go into MP4) and 'threads' (whether -threads
+    means anything to this build). Call it before starting ffmpeg: it raises
+    FFmpegCapabilityError when the build lacks an encoder or one of `filters`, instead of a
+    doomed ffmpeg run failing halfway.
+    tier: a SPEED_TIERS name; None keeps libx264 at the caller's crf/preset
+    """
+    capabilities = get_capabilities(ffmpeg_exe, hidden_window_startupinfo())
+    require_filters(capabilities, filters)
+    if tier is None:
+        video, video_args = pick_encoder(capabilities, VIDEO_ENCODERS, "H.264"), None
+    else:
+        video, video_args = pick_tier(capabilities, tier)
+    return {
+        'video': video,
+        'video_args': video_args,
+        'audio': pick_encoder(capabilities, AUDIO_ENCODERS, "AAC"),
+        'mov_text': capabilities is None or 'mov_text' in capabilities['encoders'],
+        'threads': capabilities is None or capabilities['threads'],
+    }
+
+def video_codec_args(pipeline, crf=23, preset='medium'):
+    """-c:v and its options: the pipeline's speed tier settings, or the encoder at crf/preset."""
+    options = pipeline.get('video_args')
+    if options is None:
+        options = ['-crf', str(crf), '-preset', preset]
+    video = pipeline['video']
+    return ['-c:v', video, *options, *ENCODER_ARGS.get(video, []), *ENCODER_TAGS.get(video, [])]
+
+def thread_args(pipeline, threads):
+    """-threads arguments for a thread cap (none for 0 / None, or for a build without threading)."""
+    return ['-threads', str(threads)] if threads and pipeline['threads'] else []
+
+def hidden_window_startupinfo():
+    """On Windows, keeps ffmpeg from flashing a console window. None elsewhere."""
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+_DURATION_PATTERN = re.compile(r"Duration:\s*(\d+:\d+:\d+(?:\.\d+)?)")
+_BITRATE_PATTERN = re.compile(r"bitrate:\s*(\d+)\s*kb/s")
+_STREAM_PATTERN = re.compile(r"^\s*Stream #\d+:(\d+)[^:]*:\s*(Video|Audio|Subtitle|Data|Attachment):\s*([^\s,]+)(.*)$")
+_SIZE_PATTERN = re.compile(r",\s*(\d{2,5})x(\d{2,5})")
+_FPS_PATTERN = re.compile(r"([\d.]+)\s*(?:fps|tbr)")
+_ROTATION_PATTERN = re.compile(r"rotation of (-?\d+(?:\.\d+)?) degrees")
+
+_probe_cache = None
+
+def get_probe_cache():
+    """Shared on-disk cache of probe results, keyed by path and validated by size + mtime."""
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = JsonCache(os.path.join(get_cache_dir(), "probe_cache.json"))
+    return _probe_cache
+
+def parse_probe_output(text):
+    """
+    Parse the stream header that `ffmpeg -i <file>` prints to stderr.
+    Returns dict with width, height, duration (seconds), fps, video_codec, audio_codec,
+    bitrate (kb/s) and a list of streams, or None if there is no video stream.
+    """
+    info = {'width': 0, 'height': 0, 'duration': 0, 'fps': 0.0, 'video_codec': None,
+            'audio_codec': None, 'bitrate': 0, 'streams': []}
+    rotation = 0
+    video_seen = False
+    for line in text.splitlines():
+        match = _DURATION_PATTERN.search(line)
+        if match and not info['duration']:
+            info['duration'] = parse_time_str(match.group(1))
+            bitrate = _BITRATE_PATTERN.search(line)
+            if bitrate:
+                info['bitrate'] = int(bitrate.group(1))
+            continue
+
+        match = _STREAM_PATTERN.match(line)
+        if match:
+            index, kind, codec, rest = int(match.group(1)), match.group(2).lower(), match.group(3), match.group(4)
+            info['streams'].append({'index': index, 'type': kind, 'codec': codec})
+            if kind == 'video' and not video_seen and 'attached pic' not in rest:
+                video_seen = True
+                info['video_codec'] = codec
+                size = _SIZE_PATTERN.search(rest)
+                if size:
+                    info['width'], info['height'] = int(size.group(1)), int(size.group(2))
+                fps = _FPS_PATTERN.search(rest)
+                if fps:
+                    info['fps'] = float(fps.group(1))
+            elif kind == 'audio' and info['audio_codec'] is None:
+                info['audio_codec'] = codec
+            continue
+
+        match = _ROTATION_PATTERN.search(line)
+        if match and video_seen and not rotation:
+            rotation = int(round(float(match.group(1))))
+
+    if not video_seen or not info['width']:
+        return None
+    # ffmpeg auto-rotates when encoding, so report the displayed orientation
+    if abs(rotation) % 180 == 90:
+        info['width'], info['height'] = info['height'], info['width']
+    return info
+
+def probe_video(file_path):
+    """
+    Header-only probe through the bundled ffmpeg: reads container/stream headers, decodes no frames.
+    Returns the parse_probe_output dict or None.
+    """
+    try:
+        if not os.path.exists(file_path):
+            return None
+        startupinfo = hidden_window_startupinfo()
+        # Without an output file ffmpeg prints the input header and exits (non-zero), which is all we need
+        result = subprocess.run([get_ffmpeg_path(), '-hide_banner', '-i', file_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, errors='replace',
+                                startupinfo=startupinfo, timeout=30)
+        return parse_probe_output(result.stderr)
+    except Exception as e:
+        print(f"Error probing video with FFmpeg: {e}")
+        return None
+
+def get_video_info_opencv(file_path):
     """
     Get video metadata using OpenCV.
-    Returns dict with width, height, duration (seconds).
+    Returns dict with width, height, duration (seconds), or None (also when OpenCV isn't installed).
     """
+    if not opencv_available():
+        return None
     cap = None
     try:
-        print(f"Getting video info for: {file_path}")
         cap = cv2.VideoCapture(file_path)
         if not cap.isOpened():
             return None
@@ -50,27 +290,344 @@ def get_video_info(file_path):
         if cap:
             cap.release()
 
-def get_thumbnail(file_path):
+def get_video_info(file_path, use_cache=True):
     """
-    Extract the first frame of the video as an image for preview.
+    Get video metadata: header probe through ffmpeg, falling back to OpenCV when it is installed.
+    Results are cached on disk, so asking again for an unchanged file costs one stat call.
+    Returns dict with width, height, duration (seconds) and, when probed by ffmpeg,
+    fps, codecs, bitrate and streams. None if the file can't be read.
+    """
+    print(f"Getting video info for: {file_path}")
+    identity = file_identity(file_path) if use_cache else None
+    cached = cached_video_info(identity)
+    if cached:
+        return cached
+
+    info = probe_video(file_path)
+    if info is None:
+        info = get_video_info_opencv(file_path)
+
+    remember_video_info(identity, info)
+    return info
+
+def cached_video_info(identity):
+    """Probe cache lookup for a file_identity() result. None on a miss or if the file changed since."""
+    if not identity:
+        return None
+    key, size, mtime_ns = identity
+    cached = get_probe_cache().get(key)
+    if cached and cached.get('size') == size and cached.get('mtime_ns') == mtime_ns:
+        return dict(cached['info'])
+    return None
+
+def remember_video_info(identity, info):
+    if info and identity:
+        key, size, mtime_ns = identity
+        get_probe_cache().put(key, {'size': size, 'mtime_ns': mtime_ns, 'info': info})
+
+_thumbnail_memory = OrderedDict()
+_thumbnail_lock = threading.Lock()
+_THUMBNAIL_MEMORY_ENTRIES = 32
+_thumbnail_disk = None
+
+def get_thumbnail_cache():
+    """Disk tier of the thumbnail cache (PNG files, 200 MB budget)."""
+    global _thumbnail_disk
+    if _thumbnail_disk is None:
+        _thumbnail_disk = FileCache(get_cache_dir("thumbnails"), 200 * 1024 * 1024, suffix=".png")
+    return _thumbnail_disk
+
+def default_thumbnail_seek(duration):
+    """A seek point past typical black lead-in / title frames: 10% in, at most 10 seconds."""
+    if not duration or duration <= 0:
+        return 0
+    return min(duration * 0.1, 10.0)
+
+def _extract_thumbnail_ffmpeg(file_path, size=None, seek=0):
+    """
+    Grab one frame with ffmpeg, scaled to `size` before it ever reaches Python.
+    Only keyframes are decoded, so seeking into a long file stays cheap.
     Returns: PIL Image or None
     """
+    if not os.path.exists(file_path):
+        return None
+    cmd = [get_ffmpeg_path(), '-v', 'error', '-skip_frame', 'nokey']
+    if seek:
+        cmd += ['-ss', f"{seek:.3f}"]
+    cmd += ['-i', file_path, '-map', '0:v:0', '-frames:v', '1']
+    if size:
+        cmd += ['-vf', f"scale={size[0]}:{size[1]}:flags=bilinear"]
+    cmd += ['-f', 'image2pipe', '-c:v', 'bmp', 'pipe:1']
+
+    startupinfo = hidden_window_startupinfo()
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            startupinfo=startupinfo, timeout=30)
+    if result.returncode != 0 or not result.stdout:
+        if seek:
+            # Seek point past the last keyframe (very short clips): fall back to the first frame
+            return _extract_thumbnail_ffmpeg(file_path, size, 0)
+        return None
+    image = Image.open(io.BytesIO(result.stdout))
+    image.load()
+    return image.convert('RGB')
+
+def _get_thumbnail_opencv(file_path, size=None):
+    """
+    Extract the first frame of the video with OpenCV.
+    Returns: PIL Image or None (also when OpenCV isn't installed)
+    """
+    if not opencv_available():
+        return None
     cap = None
     try:
         cap = cv2.VideoCapture(file_path)
         ret, frame = cap.read()
         if ret:
+            if size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
             # Convert to RGB (OpenCV uses BGR)
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             return Image.fromarray(frame_rgb)
         return None
-    except Exception as e:
-        print(f"Error getting thumbnail: {e}")
-        return None
     finally:
         if cap:
             cap.release()
 
+def get_thumbnail(file_path, size=None, seek=0, use_cache=True):
+    """
+    Extract a frame of the video as an image for preview.
+    size: (width, height) to decode straight to, instead of the full source resolution
+    seek: seconds into the video to take the frame from (0 = first frame)
+    Thumbnails are cached in memory and on disk, keyed by file identity, size and seek point.
+    Returns: PIL Image or None
+    """
+    try:
+        identity = file_identity(file_path) if use_cache else None
+        key = None
+        if identity:
+            key = f"{identity[0]}|{identity[1]}|{identity[2]}|{size}|{seek:.3f}"
+            with _thumbnail_lock:
+                if key in _thumbnail_memory:
+                    _thumbnail_memory.move_to_end(key)
+                    return _thumbnail_memory[key].copy()
+            cached_path = get_thumbnail_cache().get(key)
+            if cached_path:
+                try:
+                    image = Image.open(cached_path)
+                    image.load()
+                    _remember_thumbnail(key, image)
+                    return image.copy()
+                except OSError:
+                    get_thumbnail_cache().remove(key)
+
+        image = _extract_thumbnail_ffmpeg(file_path, size, seek)
+        if image is None:
+            image = _get_thumbnail_opencv(file_path, size)
+
+        if image is not None and key:
+            _remember_thumbnail(key, image)
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', compress_level=1)
+            get_thumbnail_cache().put_bytes(key, buffer.getvalue())
+            return image.copy()
+        return image
+    except Exception as e:
+        print(f"Error getting thumbnail: {e}")
+        return None
+
+def _remember_thumbnail(key, image):
+    with _thumbnail_lock:
+        _thumbnail_memory[key] = image
+        _thumbnail_memory.move_to_end(key)
+        while len(_thumbnail_memory) > _THUMBNAIL_MEMORY_ENTRIES:
+            _thumbnail_memory.popitem(last=False)
+
+PREVIEW_STRIP_FRAMES = 6
+PREVIEW_STRIP_SIZE = (176, 99)
+SCENE_THRESHOLD = 0.3
+_SCENE_TIME_PATTERN = re.compile(r"pts_time:\s*(-?[\d.]+)")
+
+def preview_timestamps(duration, count=PREVIEW_STRIP_FRAMES):
+    """Evenly spaced seek points, one in the middle of each of `count` equal stretches of the video."""
+    if not duration or duration <= 0 or count <= 0:
+        return []
+    step = duration / count
+    return [round(step * (i + 0.5), 3) for i in range(count)]
+
+def pick_spread(times, count):
+    """Keep `count` of the sorted `times`, spread over the whole list rather than the first few."""
+    times = sorted(times)
+    if len(times) <= count:
+        return times
+    return [times[int(i * len(times) / count)] for i in range(count)]
+
+def detect_scene_changes(file_path, count=PREVIEW_STRIP_FRAMES, threshold=SCENE_THRESHOLD, duration=0):
+    """
+    Timestamps of up to `count` scene changes, found in one decode pass at thumbnail resolution.
+    Missing points (a single-shot video has no cuts) are filled with evenly spaced ones.
+    Returns: sorted list of seconds
+    """
+    if not duration:
+        info = get_video_info(file_path)
+        duration = info.get('duration', 0) if info else 0
+    cmd = [get_ffmpeg_path(), '-hide_banner', '-nostdin', '-i', file_path, '-map', '0:v:0', '-an', '-sn',
+           '-vf', f"scale=160:-2:flags=fast_bilinear,select='gt(scene,{threshold})',showinfo", '-f', 'null', '-']
+    times = []
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                startupinfo=hidden_window_startupinfo())
+        for line in result.stderr.decode('utf-8', errors='replace').splitlines():
+            if 'showinfo' in line:
+                match = _SCENE_TIME_PATTERN.search(line)
+                if match:
+                    times.append(float(match.group(1)))
+    except OSError as e:
+        print(f"Error detecting scene changes: {e}")
+
+    # Skip the frame right at a cut, it is often still blended with the previous shot
+    times = [t + 0.1 for t in pick_spread(times, count) if not duration or t + 0.1 < duration]
+    if len(times) < count:
+        gap = duration / (count * 2) if duration else 0
+        for t in preview_timestamps(duration, count):
+            if len(times) >= count:
+                break
+            if all(abs(t - other) >= gap for other in times):
+                times.append(t)
+    return sorted(round(t, 3) for t in times)
+
+def split_bmp_stream(data):
+    """Split the output of ffmpeg's image2pipe BMP encoder into PIL images."""
+    images = []
+    pos = 0
+    while pos + 6 <= len(data) and data[pos:pos + 2] == b'BM':
+        length = int.from_bytes(data[pos + 2:pos + 6], 'little')
+        if length <= 0 or pos + length > len(data):
+            break
+        image = Image.open(io.BytesIO(data[pos:pos + length]))
+        image.load()
+        images.append(image.convert('RGB'))
+        pos += length
+    return images
+
+def build_frames_filter(count, size):
+    """filter_complex that fits the first frame of each of `count` inputs into `size` and concatenates them."""
+    w, h = size
+    chains = [f"[{i}:v:0]scale={w}:{h}:force_original_aspect_ratio=decrease:flags=bilinear,"
+              f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,trim=end_frame=1,setpts=PTS-STARTPTS[f{i}]"
+              for i in range(count)]
+    inputs = "".join(f"[f{i}]" for i in range(count))
+    return ";".join(chains) + f";{inputs}concat=n={count}:v=1:a=0[frames]"
+
+def extract_frames(file_path, timestamps, size=PREVIEW_STRIP_SIZE):
+    """
+    Grab one frame at each timestamp in a single ffmpeg run: every seek point is opened as its own
+    input with a fast input seek, and the frames are scaled to `size` before they reach Python.
+    Returns: list of PIL Images (one per timestamp), or None if extraction failed
+    """
+    if not timestamps or not os.path.exists(file_path):
+        return None
+    cmd = [get_ffmpeg_path(), '-hide_banner', '-nostdin', '-v', 'error']
+    for t in timestamps:
+        cmd += ['-ss', f"{t:.3f}", '-i', file_path]
+    # passthrough: exactly one output image per frame, no frame-rate padding
+    cmd += ['-filter_complex', build_frames_filter(len(timestamps), size), '-map', '[frames]',
+            '-vsync', 'passthrough', '-f', 'image2pipe', '-c:v', 'bmp', 'pipe:1']
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                startupinfo=hidden_window_startupinfo(), timeout=120)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Error extracting preview frames: {e}")
+        return None
+    frames = split_bmp_stream(result.stdout)
+    if result.returncode != 0 or len(frames) != len(timestamps):
+        print(f"Error extracting preview frames from {file_path}: "
+              f"{result.stderr.decode('utf-8', errors='replace').strip()[-300:]}")
+        return None
+    return frames
+
+def _draw_caption(draw, text, x, y, right_align=False, width=0):
+    left, top, right, bottom = draw.textbbox((0, 0), text)
+    box_w, box_h = right - left + 8, bottom - top + 6
+    if right_align:
+        x += width - box_w
+    draw.rectangle((x, y, x + box_w, y + box_h), fill=(0, 0, 0))
+    draw.text((x + 4 - left, y + 3 - top), text, fill=(255, 255, 255))
+
+def build_contact_sheet(rows, labels=(), column_labels=(), gap=4, background=(30, 30, 30)):
+    """
+    Lay out rows of equally sized frames as one image. `labels` go in the corner of each row,
+    `column_labels` (e.g. timestamps) in the corner of each frame of the first row.
+    Returns: PIL Image or None if there are no frames
+    """
+    rows = [row for row in rows if row]
+    if not rows:
+        return None
+    w, h = rows[0][0].size
+    columns = max(len(row) for row in rows)
+    sheet = Image.new('RGB', (columns * w + (columns - 1) * gap, len(rows) * h + (len(rows) - 1) * gap), background)
+    draw = ImageDraw.Draw(sheet)
+    for r, row in enumerate(rows):
+        y = r * (h + gap)
+        for c, frame in enumerate(row):
+            sheet.paste(frame, (c * (w + gap), y))
+        if r < len(labels) and labels[r]:
+            _draw_caption(draw, labels[r], 0, y)
+    for c, text in enumerate(column_labels[:columns]):
+        if text:
+            _draw_caption(draw, text, c * (w + gap), 0, right_align=True, width=w)
+    return sheet
+
+def get_preview_strip(input_path, output_path=None, count=PREVIEW_STRIP_FRAMES, size=PREVIEW_STRIP_SIZE,
+                      mode='even', use_cache=True):
+    """
+    Contact sheet for judging quality at a glance: `count` frames of the input in one row and, if
+    output_path is given, the output at the same timestamps in the row below.
+    mode: 'even' for evenly spaced frames, 'scene' for frames just after scene changes in the input
+    Each row costs one ffmpeg run; sheets are cached with the thumbnails.
+    Returns: PIL Image or None
+    """
+    paths = [p for p in (input_path, output_path) if p]
+    key = None
+    if use_cache:
+        identities = [file_identity(p) for p in paths]
+        if all(identities):
+            key = f"strip|{identities}|{count}|{size}|{mode}"
+            cached_path = get_thumbnail_cache().get(key)
+            if cached_path:
+                try:
+                    image = Image.open(cached_path)
+                    image.load()
+                    return image.convert('RGB')
+                except OSError:
+                    get_thumbnail_cache().remove(key)
+
+    info = get_video_info(input_path)
+    duration = info.get('duration', 0) if info else 0
+    if mode == 'scene':
+        timestamps = detect_scene_changes(input_path, count, duration=duration)
+    else:
+        timestamps = preview_timestamps(duration, count)
+    if not timestamps:
+        return None
+
+    rows = []
+    for path in paths:
+        # An encode can end a frame or two before its source; never seek past a file's own end
+        path_info = info if path == input_path else get_video_info(path)
+        end = max(0.0, (path_info.get('duration', 0) if path_info else 0) - 0.5)
+        frames = extract_frames(path, [min(t, end) if end else t for t in timestamps], size)
+        if frames is None:
+            return None
+        rows.append(frames)
+    labels = ["Input", "Output"] if output_path else ["Input"]
+    sheet = build_contact_sheet(rows, labels, [format_eta(t) for t in timestamps])
+
+    if sheet is not None and key:
+        buffer = io.BytesIO()
+        sheet.save(buffer, format='PNG', compress_level=1)
+        get_thumbnail_cache().put_bytes(key, buffer.getvalue())
+    return sheet
+
 def parse_time_str(time_str):
     """Converts HH:MM:SS.xx to seconds."""
     try:
@@ -84,80 +641,192 @@ def parse_time_str(time_str):
     except Exception:
         return 0
 
-def compress_video(input_path, output_path, target_height, total_duration=0, progress_callback=None, stop_event=None):
+# How often the supervising loop wakes up to check stop_event, even if ffmpeg is silent
+PROGRESS_POLL_INTERVAL = 0.1
+
+class EncodeProgress(float):
     """
-    Compress video using subprocess to parse progress.
-    stop_event: threading.Event to check for cancellation
+    Progress report passed to progress_callback.
+    The object itself is the completed fraction (0.0 - 1.0), so callbacks that treat it as a
+    number keep working; the attributes carry ffmpeg's structured progress fields.
+    """
+
+    def __new__(cls, fraction, out_time=0.0, fps=0.0, speed=0.0, total_size=0, bitrate=0.0, frame=0, eta=None, done=False):
+        obj = super().__new__(cls, fraction)
+        obj.fraction = float(fraction)
+        obj.out_time = out_time        # seconds of output written
+        obj.fps = fps                  # encode frames per second
+        obj.speed = speed              # realtime factor (2.0 = twice as fast as playback)
+        obj.total_size = total_size    # bytes written so far
+        obj.bitrate = bitrate          # kbit/s of the output so far
+        obj.frame = frame
+        obj.eta = eta                  # seconds remaining, None if unknown
+        obj.done = done
+        return obj
+
+    def __repr__(self):
+        return (f"EncodeProgress({self.fraction:.3f}, out_time={self.out_time:.2f}, fps={self.fps:.1f}, "
+                f"speed={self.speed:.2f}, total_size={self.total_size}, eta={self.eta})")
+
+def _to_number(value, cast=float, suffix=""):
+    try:
+        value = value.strip()
+        if suffix and value.endswith(suffix):
+            value = value[:-len(suffix)]
+        return cast(value)
+    except (ValueError, AttributeError):
+        return cast(0)
+
+def parse_progress_block(fields, total_duration=0):
+    """Turn one block of ffmpeg `-progress` key=value pairs into an EncodeProgress."""
+    out_time = _to_number(fields.get('out_time_us', '0'), int) / 1e6
+    if out_time <= 0 and 'out_time' in fields:
+        out_time = parse_time_str(fields['out_time'])
+    out_time = max(out_time, 0.0)
+    speed = _to_number(fields.get('speed', '0'), float, 'x')
+    done = fields.get('progress') == 'end'
+
+    fraction = 0.0
+    eta = None
+    if total_duration > 0:
+        fraction = 1.0 if done else min(out_time / total_duration, 1.0)
+        if done:
+            eta = 0.0
+        elif speed > 0:
+            eta = max(total_duration - out_time, 0.0) / speed
+
+    return EncodeProgress(
+        fraction,
+        out_time=out_time,
+        fps=_to_number(fields.get('fps', '0')),
+        speed=speed,
+        total_size=_to_number(fields.get('total_size', '0'), int),
+        bitrate=_to_number(fields.get('bitrate', '0'), float, 'kbits/s'),
+        frame=_to_number(fields.get('frame', '0'), int),
+        eta=eta,
+        done=done
+    )
+
+def format_eta(seconds):
+    """Seconds -> 'M:SS' or 'H:MM:SS'; '--:--' when unknown."""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, sec = divmod(rem, 60)
+    return f"{h}:{m:02d}:{sec:02d}" if h else f"{m}:{sec:02d}"
+
+def _read_progress(stream, blocks):
+    """Reader thread: collect `-progress` key=value lines into blocks; None marks end of output."""
+    try:
+        fields = {}
+        for line in stream:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            fields[key] = value
+            if key == 'progress':
+                blocks.put(fields)
+                fields = {}
+    except (OSError, ValueError):
+        pass
+    finally:
+        blocks.put(None)
+
+def _read_log(stream, tail):
+    """Reader thread: keep draining stderr so ffmpeg never blocks on a full pipe; keep the last lines for errors."""
+    try:
+        for line in stream:
+            tail.append(line.rstrip())
+    except (OSError, ValueError):
+        pass
+
+def _wait_with_usage(process, usage):
+    """
+    Reap the ffmpeg process. Where os.wait4 exists, also record that one process's resource use
+    into `usage` (cpu_user / cpu_sys seconds, peak_rss_kb), which a process-wide
+    RUSAGE_CHILDREN reading can't give when several jobs run at once.
+    """
+    if usage is None or not hasattr(os, 'wait4'):
+        process.wait()
+        return
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        process.wait()
+        return
+    process.returncode = os.waitstatus_to_exitcode(status)
+    usage['cpu_user'] = usage.get('cpu_user', 0.0) + rusage.ru_utime
+    usage['cpu_sys'] = usage.get('cpu_sys', 0.0) + rusage.ru_stime
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    usage['peak_rss_kb'] = max(usage.get('peak_rss_kb', 0), peak_kb)
+
+def run_ffmpeg(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+    """
+    Run an ffmpeg command with its machine-readable progress channel (-progress pipe:1).
+    Progress is read on a separate thread, so stop_event is honoured within
+    PROGRESS_POLL_INTERVAL even while ffmpeg prints nothing (probing, muxing, flushing).
+    progress_callback receives EncodeProgress objects.
+    usage: optional dict that accumulates ffmpeg's CPU time and peak memory (see _wait_with_usage)
+    Returns True if ffmpeg exited cleanly, False on error or cancellation.
     """
     process = None
     try:
-        ffmpeg_exe = get_ffmpeg_path()
-        print(f"Using FFmpeg path: {ffmpeg_exe}")
-        
-        # Check permissions/existence just in case
-        if not os.path.exists(input_path):
-            print("Input file not found.")
-            return False
+        startupinfo = hidden_window_startupinfo()
 
-        cmd = [
-            ffmpeg_exe,
-            '-y', 
-            '-i', input_path,
-            '-vf', f'scale=-2:{target_height}',
-            '-c:v', 'libx264',
-            '-crf', '23',
-            '-preset', 'medium',
-            '-c:a', 'aac',
-            output_path
-        ]
-        
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
+        cmd = [cmd[0], '-nostdin', '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
         process = subprocess.Popen(
             cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE, # We parse stderr for progress
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, # key=value progress blocks
+            stderr=subprocess.PIPE, # log, kept for error reporting
             universal_newlines=True,
+            errors='replace',
             startupinfo=startupinfo
         )
-        
-        time_pattern = re.compile(r"time=(\d{2}:\d{2}:\d{2}\.\d+)")
-        
+
+        blocks = queue.Queue()
+        log_tail = deque(maxlen=20)
+        readers = [
+            threading.Thread(target=_read_progress, args=(process.stdout, blocks), daemon=True),
+            threading.Thread(target=_read_log, args=(process.stderr, log_tail), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+
         while True:
             # Check for cancellation
             if stop_event and stop_event.is_set():
                 print("Compression cancelled.")
                 process.kill()
+                process.wait()
                 return False
 
-            # Read line-by-line. 
-            # Note: loop might block on readline if no output, but ffmpeg usually verbose.
-            line = process.stderr.readline()
-            
-            if not line and process.poll() is not None:
-                # Process finished and no more output
+            try:
+                block = blocks.get(timeout=PROGRESS_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            if block is None:
+                # ffmpeg closed its output, i.e. it is exiting
                 break
-            
-            if line:
-                # print(line.strip()) # Debug
-                if progress_callback and total_duration > 0:
-                    match = time_pattern.search(line)
-                    if match:
-                        time_str = match.group(1)
-                        current_seconds = parse_time_str(time_str)
-                        if total_duration > 0:
-                            percentage = min(current_seconds / total_duration, 1.0)
-                            progress_callback(percentage)
-        
+
+            if progress_callback:
+                progress_callback(parse_progress_block(block, total_duration))
+
+        _wait_with_usage(process, usage)
+        for reader in readers:
+            reader.join(timeout=1)
+
         if stop_event and stop_event.is_set(): # Double check
              return False
              
         # Check return code
         if process.returncode != 0:
              print(f"FFmpeg exited with error code: {process.returncode}")
+             for line in log_tail:
+                 print(f"  {line}")
              return False
 
         return True
@@ -171,3 +840,1404 @@ def compress_video(input_path, output_path, target_height, total_duration=0, pro
             except:
                 pass
         return False
+
+# Codecs that can be stream-copied into the output container without re-encoding
+MP4_VIDEO_CODECS = {'h264', 'hevc', 'av1', 'vp9', 'mpeg4'}
+MP4_AUDIO_CODECS = {'aac'}
+TEXT_SUBTITLE_CODECS = {'subrip', 'srt', 'ass', 'ssa', 'mov_text', 'webvtt', 'text'}
+
+def plan_streams(info, target_height, output_path, fast_path=True):
+    """
+    Decide per stream what the encode has to do, based on the probed source.
+    - video: 'copy' (remux only) when the source is already at or below target_height in a codec
+      the container accepts, 'encode' without scaling when it is small enough but incompatible,
+      otherwise 'scale' (the normal downscale + encode); without a target_height the video is
+      re-encoded at its own size ('encode')
+    - audio: 'copy' when the codec is already compatible, 'encode' otherwise, None without audio
+    - subtitles: text tracks are kept (converted to mov_text for MP4); bitmap ones are dropped,
+      except in MKV, which copies every track (MP4 mov_text tracks are converted to SRT instead)
+    - data / attachment streams are always dropped
+    Returns: dict with 'video', 'audio', 'subtitles' (stream indices), 'subtitle_codec', 'dropped'
+    """
+    mkv = output_path.lower().endswith('.mkv')
+    plan = {'video': 'scale' if target_height else 'encode', 'audio': 'encode', 'subtitles': [],
+            'subtitle_codec': 'copy' if mkv else 'mov_text', 'dropped': []}
+    streams = info.get('streams', []) if info else []
+    if not streams:
+        return plan
+
+    source_height = info.get('height', 0)
+    if fast_path and target_height and source_height and source_height <= target_height:
+        plan['video'] = 'copy' if (mkv or info.get('video_codec') in MP4_VIDEO_CODECS) else 'encode'
+
+    audio_codec = info.get('audio_codec')
+    if not audio_codec:
+        plan['audio'] = None
+    elif fast_path and (mkv or audio_codec in MP4_AUDIO_CODECS):
+        plan['audio'] = 'copy'
+
+    subtitles = [stream for stream in streams
+                 if stream['type'] == 'subtitle' and (mkv or stream['codec'] in TEXT_SUBTITLE_CODECS)]
+    if mkv and any(stream['codec'] == 'mov_text' for stream in subtitles):
+        # Matroska can't hold mov_text as is; one -c:s converts every track, so bitmap ones can't come along
+        plan['subtitle_codec'] = 'srt'
+        subtitles = [stream for stream in subtitles if stream['codec'] in TEXT_SUBTITLE_CODECS]
+    kept = {stream['index'] for stream in subtitles}
+    for stream in streams:
+        if stream['index'] in kept:
+            plan['subtitles'].append(stream['index'])
+        elif stream['type'] in ('subtitle', 'data', 'attachment'):
+            plan['dropped'].append(stream)
+    return plan
+
+def stream_map_args(plan, pipeline, source_input=0, video_map='0:v:0'):
+    """
+    -map / -c:s arguments for the streams a plan keeps: video_map (a stream specifier or a
+    filter graph label like '[v0]'), and the first audio stream and the kept subtitle tracks
+    of source_input. Subtitles are dropped when the ffmpeg build can't write them into the container.
+    """
+    subtitles = plan['subtitles']
+    if subtitles and plan['subtitle_codec'] == 'mov_text' and not pipeline['mov_text']:
+        print("This FFmpeg build can't write MP4 subtitles, dropping them")
+        subtitles = []
+    args = ['-map', video_map, '-map', f'{source_input}:a:0?']
+    for index in subtitles:
+        args += ['-map', f'{source_input}:{index}']
+    if subtitles:
+        args += ['-c:s', plan['subtitle_codec']]
+    for stream in plan['dropped']:
+        print(f"Dropping {stream['type']} stream #{stream['index']} ({stream['codec']})")
+    return args
+
+def audio_codec_args(plan, encoder='aac'):
+    """-c:a arguments for a stream plan (or for an unprobed source); encoder is the AAC encoder to use."""
+    if plan and plan.get('audio') == 'copy':
+        return ['-c:a', 'copy']
+    return ['-c:a', encoder]
+
+# Finished outputs are kept in a disk cache, keyed by the input's content fingerprint and every
+# setting that affects the result. Bump the version when the ffmpeg command lines change.
+OUTPUT_CACHE_VERSION = 2
+DEFAULT_OUTPUT_CACHE_MB = 2048
+_output_cache = None
+
+def get_output_cache():
+    """
+    Disk cache of finished outputs, shared by the GUI and headless runs.
+    Budget in MB from VIDEO_COMPRESSOR_OUTPUT_CACHE_MB (default 2048); 0 disables it and returns None.
+    """
+    global _output_cache
+    try:
+        budget_mb = float(os.environ.get("VIDEO_COMPRESSOR_OUTPUT_CACHE_MB", DEFAULT_OUTPUT_CACHE_MB))
+    except ValueError:
+        budget_mb = DEFAULT_OUTPUT_CACHE_MB
+    if budget_mb <= 0:
+        return None
+    if _output_cache is None:
+        _output_cache = FileCache(get_cache_dir("outputs"), 0)
+    _output_cache.max_bytes = int(budget_mb * 1024 * 1024)
+    return _output_cache
+
+def output_cache_key(input_path, output_path, settings):
+    """Cache key for encoding input_path with `settings` into output_path's container, or None if the input can't be read."""
+    fingerprint = file_fingerprint(input_path)
+    if fingerprint is None:
+        return None
+    settings = dict(settings, container=os.path.splitext(output_path)[1].lower(), version=OUTPUT_CACHE_VERSION)
+    return f"{fingerprint}|{json.dumps(settings, sort_keys=True)}"
+
+def restore_cached_output(key, output_path, progress_callback=None):
+    """Copy a cached result to output_path. Returns True on a hit."""
+    cache = get_output_cache()
+    cached = cache.get(key) if cache and key else None
+    if not cached:
+        return False
+    try:
+        copy_file_fast(cached, output_path)
+    except OSError as e:
+        print(f"Warning: could not restore cached output: {e}")
+        return False
+    print(f"Output cache hit, reusing an earlier result for {output_path}")
+    if progress_callback:
+        progress_callback(EncodeProgress(1.0, total_size=os.path.getsize(output_path), eta=0.0, done=True))
+    return True
+
+def output_cache_copies():
+    """
+    Whether the output cache may store a full copy of an output where the filesystem can't clone
+    it (NTFS, ext4). On unless VIDEO_COMPRESSOR_OUTPUT_CACHE_COPY is 0, which keeps caching to
+    clones (reflink) so it never writes an output a second time.
+    """
+    return os.environ.get("VIDEO_COMPRESSOR_OUTPUT_CACHE_COPY", "1").strip().lower() not in ("0", "false", "no", "off")
+
+def store_cached_output(key, output_path):
+    """
+    Keep a clone of a finished output, or a copy where the filesystem can't clone it (unless
+    output_cache_copies() is off), unless it alone would exceed the cache budget. Hard links are never used: re-encoding to the same path
+    overwrites the file in place, which would change the cached result as well.
+    """
+    cache = get_output_cache()
+    if not cache or not key or not os.path.exists(output_path):
+        return
+    if os.path.getsize(output_path) > cache.max_bytes:
+        return
+    cache.put_file(key, output_path, clone_only=not output_cache_copies())
+
+# Longest stretch of a fragmented MP4 that is held back before it is written out. x264 puts
+# keyframes up to ~10s apart, so fragmenting on keyframes alone would leave the preview empty for that long.
+FRAGMENT_SECONDS = 1.0
+
+def container_args(output_path, fragmented=False):
+    """
+    Muxer flags for the output. fragmented=True writes a fragmented MP4 (a short fragment at each
+    keyframe and at least every FRAGMENT_SECONDS), which players can open and play while the encode
+    is still running. Other containers are left alone.
+    """
+    if fragmented and output_path.lower().endswith(('.mp4', '.mov', '.m4v')):
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                '-frag_duration', str(int(FRAGMENT_SECONDS * 1_000_000))]
+    return []
+
+def defragment_output(src_path, dst_path):
+    """
+    Remux a fragmented MP4 (see container_args) into a regular one with its index up front
+    (+faststart); some players and editors seek poorly in fragmented files or reject them.
+    Streams are copied, nothing is re-encoded. Returns True on success.
+    """
+    cmd = [get_ffmpeg_path(), '-y', '-v', 'error', '-nostdin', '-i', src_path,
+           '-map', '0', '-c', 'copy', '-movflags', '+faststart', dst_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True, errors='replace',
+                                startupinfo=hidden_window_startupinfo())
+    except OSError as e:
+        print(f"Error remuxing {src_path}: {e}")
+        return False
+    if result.returncode != 0 or not os.path.exists(dst_path):
+        print(f"Error remuxing {src_path}: {result.stderr.strip()}")
+        return False
+    return True
+
+def save_output(src_path, dst_path, move=True, defragment=False):
+    """
+    Put a finished output at dst_path without writing the data a second time where possible:
+    a rename when move=True and both are on the same filesystem, else a copy-on-write clone,
+    else a plain copy (after which a moved source is deleted).
+    defragment: src_path is a fragmented MP4 (see container_args); it is remuxed into a regular
+                one at dst_path instead (a stream copy), falling back to the steps above if that fails
+    Returns: 'remuxed', 'renamed', 'cloned' or 'copied'. Raises OSError if the file couldn't be saved.
+    """
+    if defragment and container_args(dst_path, fragmented=True):
+        base, ext = os.path.splitext(dst_path)
+        part_path = f"{base}.part{ext}"
+        if defragment_output(src_path, part_path):
+            os.replace(part_path, dst_path)
+            if move and os.path.abspath(src_path) != os.path.abspath(dst_path):
+                os.remove(src_path)
+            return 'remuxed'
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    if os.path.abspath(src_path) == os.path.abspath(dst_path):
+        return 'renamed'
+    if move:
+        try:
+            os.replace(src_path, dst_path)
+            return 'renamed'
+        except OSError:
+            # Different filesystem (or drive); fall through to clone/copy
+            pass
+    if clone_file(src_path, dst_path):
+        method = 'cloned'
+    else:
+        shutil.copyfile(src_path, dst_path)
+        method = 'copied'
+    if move:
+        os.remove(src_path)
+    return method
+
+def telemetry_phase(telemetry, name):
+    """telemetry.phase(name) when a telemetry.JobTelemetry is attached, a no-op otherwise."""
+    return telemetry.phase(name) if telemetry is not None else contextlib.nullcontext()
+
+def compress_settings(target_height, crf=23, preset='medium', fast_path=True, fragmented=False, tier=None,
+                      pipeline=None):
+    """
+    The settings of a compress_video call that decide its result, as used for the output cache key.
+    pipeline: select_pipeline result; the encoders and options it resolved to are part of the
+              result too, so another ffmpeg build never gets a result made with different encoders
+    """
+    settings = {'mode': 'crf', 'height': target_height, 'crf': crf, 'preset': preset, 'fast_path': fast_path,
+                'fragmented': fragmented}
+    if tier is not None:
+        settings['tier'] = tier
+    if pipeline is not None:
+        settings['video_args'] = video_codec_args(pipeline, crf, preset)
+        settings['audio_encoder'] = pipeline['audio']
+    return settings
+
+def encode_profile(tier=None, crf=23, preset='medium'):
+    """
+    Name of a compress_video call's encoder settings, as recorded in telemetry: the tier, the tier
+    whose libx264 options crf/preset match, or e.g. 'libx264 crf 20 slow'.
+    """
+    if tier is not None:
+        return tier
+    options = ['-preset', preset, '-crf', str(crf)]
+    for name, choices in SPEED_TIERS.items():
+        if choices[0] == ('libx264', options):
+            return name
+    return f"libx264 crf {crf} {preset}"
+
+def output_dimensions(source_info, target_height):
+    """(width, height) that 'scale=-2:target_height' gives for a probed source, (0, 0) if unknown."""
+    width, height = (source_info or {}).get('width', 0), (source_info or {}).get('height', 0)
+    if not width or not height or not target_height:
+        return 0, 0
+    return int(round(width * target_height / (height * 2))) * 2, target_height
+
+def describe_output(source_info, target_height, output_path, fast_path, pipeline, profile):
+    """
+    The video stream compress_video writes, for telemetry: width, height, fps, mode (plan_streams'
+    'scale', 'encode' or 'copy'), encoder ('copy' for a remux), profile (see encode_profile) and
+    the source's source_width / source_height.
+    """
+    mode = plan_streams(source_info, target_height, output_path, fast_path)['video']
+    width, height = (output_dimensions(source_info, target_height) if mode == 'scale'
+                     else ((source_info or {}).get('width', 0), (source_info or {}).get('height', 0)))
+    return {'width': width, 'height': height, 'fps': (source_info or {}).get('fps', 0.0), 'mode': mode,
+            'encoder': 'copy' if mode == 'copy' else pipeline['video'], 'profile': profile,
+            'source_width': (source_info or {}).get('width', 0), 'source_height': (source_info or {}).get('height', 0)}
+
+def build_compress_command(ffmpeg_exe, input_path, output_path, target_height, source_info, threads=0,
+                           fast_path=True, crf=23, preset='medium', fragmented=False, pipeline=None, input_args=()):
+    """
+    The ffmpeg command line compress_video runs (see its parameters), without the progress options.
+    pipeline: select_pipeline result, if the caller already has it
+    input_args: options placed before -i, e.g. -ss/-t to read only part of the input
+    """
+    pipeline = pipeline or select_pipeline(ffmpeg_exe)
+    plan = plan_streams(source_info, target_height, output_path, fast_path)
+    threads_args = thread_args(pipeline, threads)
+
+    cmd = [
+        ffmpeg_exe,
+        '-y', 
+        *threads_args,
+        *input_args,
+        '-i', input_path
+    ]
+
+    if source_info and source_info.get('streams'):
+        # Explicit mapping: ffmpeg's automatic selection fails on e.g. bitmap subtitles into MP4
+        cmd += stream_map_args(plan, pipeline)
+
+    if plan['video'] == 'copy':
+        print(f"Fast path: source is already {source_info.get('height')}p {source_info.get('video_codec')}, remuxing video")
+        cmd += ['-c:v', 'copy']
+        if source_info.get('video_codec') == 'hevc':
+            cmd += ['-tag:v', 'hvc1']
+    else:
+        if plan['video'] == 'scale':
+            cmd += ['-vf', f'scale=-2:{target_height}']
+        cmd += [
+            *video_codec_args(pipeline, crf, preset),
+            *threads_args
+        ]
+
+    if plan['audio'] == 'copy':
+        print(f"Fast path: copying {source_info.get('audio_codec')} audio")
+    cmd += audio_codec_args(plan, pipeline['audio'])
+    cmd += container_args(output_path, fragmented)
+    cmd.append(output_path)
+    return cmd
+
+def compress_video(input_path, output_path, target_height, total_duration=0, progress_callback=None, stop_event=None,
+                   threads=0, fast_path=True, source_info=None, crf=23, preset='medium', usage=None, use_cache=True,
+                   fragmented=False, telemetry=None, tier=None):
+    """
+    Compress video using subprocess to parse progress.
+    stop_event: threading.Event to check for cancellation
+    threads: cap on decoder/encoder threads for this job (0 lets ffmpeg use every core)
+    crf / preset: libx264 quality and speed settings
+    tier: a SPEED_TIERS name ('fastest' ... 'smallest'); picks the encoder and its settings
+          instead of crf / preset
+    usage: optional dict filled with ffmpeg's CPU time and peak memory
+    fast_path: stream-copy whatever doesn't need re-encoding (see plan_streams)
+    source_info: get_video_info result if the caller already has it
+    use_cache: reuse an earlier result for the same input and settings from the output cache
+    fragmented: write a fragmented MP4 that can be played while it is being written
+    telemetry: optional telemetry.JobTelemetry that gets the probe/encode timings, fps and ffmpeg usage
+    """
+    try:
+        ffmpeg_exe = get_ffmpeg_path()
+        print(f"Using FFmpeg path: {ffmpeg_exe}")
+        
+        # Check permissions/existence just in case
+        if not os.path.exists(input_path):
+            print("Input file not found.")
+            return False
+
+        pipeline = select_pipeline(ffmpeg_exe, tier=tier)
+        cache_key = None
+        if use_cache and get_output_cache():
+            cache_key = output_cache_key(input_path, output_path, compress_settings(target_height, crf, preset, fast_path,
+                                                                                    fragmented, tier, pipeline))
+            if restore_cached_output(cache_key, output_path, progress_callback):
+                if telemetry is not None:
+                    telemetry.cached = True
+                return True
+
+        if source_info is None:
+            with telemetry_phase(telemetry, 'probe'):
+                source_info = get_video_info(input_path)
+        cmd = build_compress_command(ffmpeg_exe, input_path, output_path, target_height, source_info, threads,
+                                     fast_path, crf, preset, fragmented, pipeline)
+
+        if telemetry is not None:
+            telemetry.output_video = describe_output(source_info, target_height, output_path, fast_path,
+                                                     pipeline, encode_profile(tier, crf, preset))
+            progress_callback = telemetry.track(progress_callback)
+            if usage is None:
+                usage = {}
+        with telemetry_phase(telemetry, 'encode'):
+            success = run_ffmpeg(cmd, total_duration, progress_callback, stop_event, usage)
+        if telemetry is not None:
+            telemetry.add_usage(usage)
+        if success and cache_key:
+            store_cached_output(cache_key, output_path)
+        return success
+    except FFmpegCapabilityError as e:
+        print(f"Cannot compress: {e}")
+        return False
+    except Exception as e:
+        print(f"General Error during compression: {e}")
+        return False
+
+# The quality search scores SAMPLE_COUNT samples of SAMPLE_SECONDS (see quality.py); preview
+# samples are longer, so the size and time extrapolated from them are steadier
+SAMPLE_COUNT = 2
+SAMPLE_SECONDS = 1.0
+PREVIEW_SAMPLE_COUNT = 3
+PREVIEW_SAMPLE_SECONDS = 5.0
+
+def pick_sample_ranges(duration, count=SAMPLE_COUNT, length=SAMPLE_SECONDS):
+    """
+    Evenly spaced (start, length) sample ranges that stay clear of the very start and end.
+    Short videos collapse to a single range covering the whole clip.
+    """
+    if duration <= 0:
+        return []
+    if duration <= length * count:
+        return [(0.0, duration)]
+    step = duration / (count + 1)
+    return [(round(step * (i + 1) - length / 2, 3), length) for i in range(count)]
+
+def estimate_from_sample(samples, duration):
+    """
+    Extrapolate a full encode from sample encodes.
+    samples: one dict per sample with media_seconds, bytes, wall_seconds and encode_seconds
+             (ffmpeg's own encode time, i.e. without process start-up and opening the input)
+    Size scales with the media covered. Time is one start-up (the samples' average) plus the
+    samples' encode time per media second over the whole duration.
+    Returns dict: sample_seconds, sample_bytes, sample_encode_seconds, kbps, speed,
+    estimated_bytes, estimated_seconds
+    """
+    sample_seconds = sum(s['media_seconds'] for s in samples)
+    sample_bytes = sum(s['bytes'] for s in samples)
+    encode_seconds = sum(s['encode_seconds'] for s in samples)
+    startup = sum(max(0.0, s['wall_seconds'] - s['encode_seconds']) for s in samples) / len(samples)
+    per_media_second = encode_seconds / sample_seconds if sample_seconds > 0 else 0.0
+    return {
+        'sample_seconds': round(sample_seconds, 3),
+        'sample_bytes': sample_bytes,
+        'sample_encode_seconds': round(encode_seconds, 3),
+        'kbps': round(sample_bytes * 8 / sample_seconds / 1000, 1) if sample_seconds > 0 else 0.0,
+        'speed': round(1 / per_media_second, 2) if per_media_second > 0 else 0.0,
+        'estimated_bytes': int(sample_bytes * duration / sample_seconds) if sample_seconds > 0 else 0,
+        'estimated_seconds': round(startup + per_media_second * duration, 1),
+    }
+
+def compress_video_sample(input_path, output_path, target_height, ranges=None, crf=23, preset='medium', threads=0,
+                          fast_path=True, source_info=None, progress_callback=None, stop_event=None, telemetry=None,
+                          tier=None):
+    """
+    Preview encode: a few short stretches of the input at the settings compress_video would use,
+    stitched into one short clip at output_path, so the result can be judged in seconds.
+    Each stretch is read with input seeking (-ss before -i): ffmpeg jumps to the keyframe before
+    it instead of decoding everything up to it.
+    ranges: (start, length) pairs in seconds (default: PREVIEW_SAMPLE_COUNT stretches of
+            PREVIEW_SAMPLE_SECONDS spread over the video)
+    Other parameters are those of compress_video.
+    Returns: estimate_from_sample dict for the whole video (plus 'duration'), or None on failure or cancel.
+    """
+    work_dir = None
+    try:
+        ffmpeg_exe = get_ffmpeg_path()
+        if not os.path.exists(input_path):
+            print("Input file not found.")
+            return None
+        pipeline = select_pipeline(ffmpeg_exe, tier=tier)
+        if source_info is None:
+            with telemetry_phase(telemetry, 'probe'):
+                source_info = get_video_info(input_path)
+        duration = source_info.get('duration', 0) if source_info else 0
+        if ranges is None:
+            ranges = pick_sample_ranges(duration, PREVIEW_SAMPLE_COUNT, PREVIEW_SAMPLE_SECONDS)
+        if duration > 0:
+            ranges = [(start, min(length, duration - start)) for start, length in ranges if start < duration]
+        if not ranges or not duration:
+            print("Cannot take samples of a video without a known duration.")
+            return None
+
+        work_dir = tempfile.mkdtemp(prefix="vc_sample_")
+        extension = os.path.splitext(output_path)[1] or ".mp4"
+        sample_total = sum(length for _, length in ranges)
+        start_time = time.monotonic()
+        samples = []
+        parts = []
+        for index, (start, length) in enumerate(ranges):
+            part = os.path.join(work_dir, f"part_{index:03d}{extension}")
+            cmd = build_compress_command(ffmpeg_exe, input_path, part, target_height, source_info, threads,
+                                         fast_path, crf, preset, pipeline=pipeline,
+                                         input_args=['-ss', f"{start:.3f}", '-t', f"{length:.3f}"])
+            done_before = sum(s['media_seconds'] for s in samples)
+            last = []
+
+            def report(p):
+                last[:] = [p]
+                if not progress_callback:
+                    return
+                fraction = min(1.0, (done_before + p.fraction * length) / sample_total)
+                elapsed = time.monotonic() - start_time
+                eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+                progress_callback(EncodeProgress(fraction, out_time=done_before + p.out_time, fps=p.fps,
+                                                 speed=p.speed, frame=p.frame, eta=eta))
+
+            usage = {}
+            part_start = time.monotonic()
+            with telemetry_phase(telemetry, 'encode'):
+                ok = run_ffmpeg(cmd, length, telemetry.track(report) if telemetry is not None else report,
+                                stop_event, usage)
+            wall = time.monotonic() - part_start
+            if telemetry is not None:
+                telemetry.add_usage(usage)
+            if not ok:
+                return None
+            final = last[0] if last else None
+            media_seconds = final.out_time if final and final.out_time > 0 else length
+            # ffmpeg's speed counts from when it started transcoding, after start-up and seeking
+            encode_seconds = min(wall, media_seconds / final.speed) if final and final.speed > 0 else wall
+            samples.append({'media_seconds': media_seconds, 'bytes': os.path.getsize(part),
+                            'wall_seconds': wall, 'encode_seconds': encode_seconds})
+            parts.append(part)
+
+        if len(parts) == 1:
+            shutil.move(parts[0], output_path)
+        else:
+            list_path = os.path.join(work_dir, "concat.txt")
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for path in parts:
+                    f.write(f"file '{os.path.basename(path)}'\n")
+            cmd = [ffmpeg_exe, '-y', '-f', 'concat', '-safe', '0', '-i', list_path, '-map', '0', '-c', 'copy',
+                   output_path]
+            if not run_ffmpeg(cmd, stop_event=stop_event):
+                return None
+
+        estimate = estimate_from_sample(samples, duration)
+        estimate['duration'] = duration
+        return estimate
+    except FFmpegCapabilityError as e:
+        print(f"Cannot compress: {e}")
+        return None
+    except Exception as e:
+        print(f"General Error during sample compression: {e}")
+        return None
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+# Target-size mode: share of the budget reserved for MP4 container overhead, and how far
+# over the target the first result may land before pass 2 is redone at a corrected bitrate
+CONTAINER_OVERHEAD = 0.02
+TARGET_SIZE_TOLERANCE = 0.03
+MIN_VIDEO_KBPS = 50
+
+def parse_size(text):
+    """'25M', '25MB', '1.5G', '800k' or plain bytes -> bytes (decimal units, so 25M fits a 25 MB limit)."""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9}
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(float(text))
+    except ValueError:
+        return None
+
+def compute_target_bitrates(target_bytes, duration, audio_kbps=128):
+    """
+    Split a file size budget into video and audio bitrates (kbit/s).
+    Audio gets at most a fifth of the budget, shrinking towards 32 kbit/s for tight targets.
+    Returns: (video_kbps, audio_kbps) or None if the target is too small for the duration.
+    """
+    if not duration or duration <= 0 or not target_bytes:
+        return None
+    budget_kbps = target_bytes * 8 * (1 - CONTAINER_OVERHEAD) / duration / 1000
+    if audio_kbps:
+        audio_kbps = int(max(32, min(audio_kbps, budget_kbps * 0.2)))
+    video_kbps = int(budget_kbps - audio_kbps)
+    if video_kbps < MIN_VIDEO_KBPS:
+        return None
+    return video_kbps, audio_kbps
+
+def compress_video_target_size(input_path, output_path, target_height, target_bytes, total_duration=0,
+                               progress_callback=None, stop_event=None, threads=0, audio_kbps=128, use_cache=True,
+                               fragmented=False, telemetry=None):
+    """
+    Compress to fit a file size with two-pass libx264 encoding.
+    Pass 1 only analyses (x264's fast first pass, no audio, output discarded); pass 2 encodes at
+    the bitrate computed from the probed duration and audio budget. If the result still exceeds
+    target_bytes by more than TARGET_SIZE_TOLERANCE, pass 2 is rerun once with a corrected bitrate
+    using the same pass 1 statistics.
+    target_height: height to scale to, or None to keep the source size
+    use_cache: reuse an earlier result for the same input and settings from the output cache
+    fragmented: write a fragmented MP4 that can be played while pass 2 is running
+    telemetry: optional telemetry.JobTelemetry; pass 1 is timed as 'analyze', pass 2 as 'encode'
+    """
+    work_dir = None
+    try:
+        ffmpeg_exe = get_ffmpeg_path()
+        print(f"Using FFmpeg path: {ffmpeg_exe}")
+
+        if not os.path.exists(input_path):
+            print("Input file not found.")
+            return False
+
+        pipeline = select_pipeline(ffmpeg_exe, PIPELINE_FILTERS if target_height else ())
+        cache_key = None
+        if use_cache and get_output_cache():
+            cache_key = output_cache_key(input_path, output_path, {'mode': 'size', 'height': target_height,
+                                                                   'target_bytes': target_bytes,
+                                                                   'audio_kbps': audio_kbps,
+                                                                   'fragmented': fragmented,
+                                                                   'video_encoder': pipeline['video'],
+                                                                   'audio_encoder': pipeline['audio']})
+            if restore_cached_output(cache_key, output_path, progress_callback):
+                if telemetry is not None:
+                    telemetry.cached = True
+                return True
+
+        if not total_duration:
+            with telemetry_phase(telemetry, 'probe'):
+                info = get_video_info(input_path)
+            total_duration = info.get('duration', 0) if info else 0
+        bitrates = compute_target_bitrates(target_bytes, total_duration, audio_kbps)
+        if not bitrates:
+            print(f"Target size of {target_bytes / 1e6:.1f} MB is too small for a {total_duration:.0f}s video.")
+            return False
+        video_kbps, audio_kbps = bitrates
+
+        work_dir = tempfile.mkdtemp(prefix="vc_2pass_")
+        passlog = os.path.join(work_dir, "x264")
+        threads_args = thread_args(pipeline, threads)
+        scale_args = ['-vf', f'scale=-2:{target_height}'] if target_height else []
+
+        def pass_cmd(pass_number, kbps):
+            cmd = [
+                ffmpeg_exe,
+                '-y',
+                *threads_args,
+                '-i', input_path,
+                *scale_args,
+                '-c:v', pipeline['video'],
+                '-b:v', f'{kbps}k',
+                '-preset', 'medium',
+                *threads_args,
+                '-pass', str(pass_number),
+                '-passlogfile', passlog
+            ]
+            if pass_number == 1:
+                return cmd + ['-an', '-f', 'null', '-']
+            return cmd + ['-c:a', pipeline['audio'], '-b:a', f'{audio_kbps}k', *container_args(output_path, fragmented),
+                          output_path]
+
+        # Pass 1 is the cheaper of the two, so it gets the smaller share of the progress bar
+        start = time.monotonic()
+
+        def scaled(offset, weight):
+            if not progress_callback and telemetry is None:
+                return None
+            def report(p):
+                if telemetry is not None and offset > 0:
+                    telemetry.observe(p)
+                if not progress_callback:
+                    return
+                fraction = offset + weight * p.fraction
+                elapsed = time.monotonic() - start
+                eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+                progress_callback(EncodeProgress(fraction, out_time=p.out_time, fps=p.fps, speed=p.speed,
+                                                 total_size=p.total_size, bitrate=p.bitrate,
+                                                 frame=p.frame, eta=eta))
+            return report
+
+        def run_pass(pass_number, kbps, offset, weight):
+            usage = {}
+            with telemetry_phase(telemetry, 'analyze' if pass_number == 1 else 'encode'):
+                ok = run_ffmpeg(pass_cmd(pass_number, kbps), total_duration, scaled(offset, weight), stop_event, usage)
+            if telemetry is not None:
+                telemetry.add_usage(usage)
+            return ok
+
+        if not run_pass(1, video_kbps, 0.0, 0.3):
+            return False
+        if not run_pass(2, video_kbps, 0.3, 0.7):
+            return False
+
+        size = os.path.getsize(output_path)
+        if size > target_bytes * (1 + TARGET_SIZE_TOLERANCE):
+            corrected = int(video_kbps * target_bytes / size * (1 - TARGET_SIZE_TOLERANCE))
+            print(f"Output is {size / 1e6:.2f} MB, over the {target_bytes / 1e6:.2f} MB target; "
+                  f"re-running pass 2 at {corrected} kbit/s")
+            if corrected < MIN_VIDEO_KBPS or not run_pass(2, corrected, 0.3, 0.7):
+                return False
+            size = os.path.getsize(output_path)
+
+        print(f"Target size {target_bytes / 1e6:.2f} MB, result {size / 1e6:.2f} MB "
+              f"({video_kbps} kbit/s video, {audio_kbps} kbit/s audio)")
+        if cache_key:
+            store_cached_output(cache_key, output_path)
+        return True
+    except FFmpegCapabilityError as e:
+        print(f"Cannot compress: {e}")
+        return False
+    except Exception as e:
+        print(f"General Error during target size compression: {e}")
+        return False
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def build_ladder_filter(heights):
+    """
+    Filter graph that decodes once and fans out to one scaled stream per height.
+    Returns: (filter_complex string, list of output pad labels in the same order as heights)
+    """
+    labels = [f"v{i}" for i in range(len(heights))]
+    if len(heights) == 1:
+        return f"[0:v]scale=-2:{heights[0]}[{labels[0]}]", labels
+    split = "[0:v]split=" + str(len(heights)) + "".join(f"[s{i}]" for i in range(len(heights)))
+    scales = [f"[s{i}]scale=-2:{h}[{labels[i]}]" for i, h in enumerate(heights)]
+    return ";".join([split] + scales), labels
+
+def compress_video_ladder(input_path, outputs, total_duration=0, progress_callback=None, stop_event=None, threads=0):
+    """
+    Produce several renditions from a single decode of the input. Each keeps the streams
+    compress_video would keep for its container (see plan_streams).
+    outputs: dict of {target_height: output_path}
+    progress_callback receives one combined percentage for the whole ladder.
+    Returns: dict of {target_height: bool} saying which renditions were written successfully.
+    """
+    heights = list(outputs)
+    status = {h: False for h in heights}
+    try:
+        if not heights:
+            return status
+
+        ffmpeg_exe = get_ffmpeg_path()
+        print(f"Using FFmpeg path: {ffmpeg_exe}")
+
+        if not os.path.exists(input_path):
+            print("Input file not found.")
+            return status
+
+        pipeline = select_pipeline(ffmpeg_exe, ('scale', 'split') if len(heights) > 1 else ('scale',))
+        threads_args = thread_args(pipeline, threads)
+        filter_graph, labels = build_ladder_filter(heights)
+        source_info = get_video_info(input_path)
+
+        cmd = [ffmpeg_exe, '-y', *threads_args, '-i', input_path, '-filter_complex', filter_graph]
+        for height, label in zip(heights, labels):
+            # Every rendition is scaled, but compatible audio and subtitles are kept as its container allows
+            plan = plan_streams(source_info, None, outputs[height])
+            if source_info and source_info.get('streams'):
+                cmd += stream_map_args(plan, pipeline, video_map=f'[{label}]')
+            else:
+                cmd += ['-map', f'[{label}]', '-map', '0:a:0?']
+            cmd += [
+                '-c:v', pipeline['video'],
+                '-crf', '23',
+                '-preset', 'medium',
+                *threads_args,
+                *audio_codec_args(plan, pipeline['audio']),
+                outputs[height]
+            ]
+
+        if not run_ffmpeg(cmd, total_duration, progress_callback, stop_event):
+            return status
+
+        for height in heights:
+            path = outputs[height]
+            status[height] = os.path.exists(path) and os.path.getsize(path) > 0
+        return status
+    except FFmpegCapabilityError as e:
+        print(f"Cannot compress: {e}")
+        return status
+    except Exception as e:
+        print(f"General Error during ladder compression: {e}")
+        return status
+
+class _EitherEvent:
+    """Looks like a threading.Event to run_ffmpeg; set when any of the wrapped events is set."""
+
+    def __init__(self, *events):
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+def split_at_keyframes(input_path, work_dir, segment_seconds, stop_event=None):
+    """
+    Losslessly cut the input's video stream into chunks at keyframes (stream copy, no decode).
+    Returns: list of (segment_path, duration_seconds) in playback order, or None on failure.
+    """
+    ffmpeg_exe = get_ffmpeg_path()
+    list_path = os.path.join(work_dir, "segments.csv")
+    cmd = [
+        ffmpeg_exe,
+        '-y',
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', f"{segment_seconds:.3f}",
+        '-segment_list', list_path,
+        '-segment_list_type', 'csv',
+        '-reset_timestamps', '1',
+        os.path.join(work_dir, "src_%05d.mkv")
+    ]
+    if not run_ffmpeg(cmd, stop_event=stop_event):
+        return None
+    return read_segment_list(work_dir)
+
+def read_segment_list(work_dir):
+    """The (segment_path, duration) list written by split_at_keyframes, or None if there is none."""
+    list_path = os.path.join(work_dir, "segments.csv")
+    if not os.path.exists(list_path):
+        return None
+    segments = []
+    with open(list_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) >= 3:
+                segments.append((os.path.join(work_dir, parts[0]), float(parts[2]) - float(parts[1])))
+    return segments
+
+def _combine_segment_progress(latest, segments, total_duration, start):
+    """Merge the newest EncodeProgress of every chunk into one report for the whole file."""
+    done_seconds = 0.0
+    fps = speed = 0.0
+    total_size = frame = 0
+    for p, (_, duration) in zip(latest, segments):
+        if p is None:
+            continue
+        done_seconds += p.fraction * duration
+        total_size += p.total_size
+        frame += p.frame
+        if not p.done:
+            fps += p.fps
+            speed += p.speed
+    fraction = min(done_seconds / total_duration, 1.0)
+    elapsed = time.monotonic() - start
+    eta = None
+    if done_seconds > 0 and elapsed > 0:
+        eta = (total_duration - done_seconds) / (done_seconds / elapsed)
+    return EncodeProgress(fraction, out_time=done_seconds, fps=fps, speed=speed,
+                          total_size=total_size, frame=frame, eta=eta)
+
+def compress_video_segmented(input_path, output_path, target_height, total_duration=0, progress_callback=None,
+                             stop_event=None, workers=0, threads=4, segment_seconds=0, crf=23, preset='medium',
+                             work_dir=None, segment_callback=None, fragmented=False, telemetry=None, tier=None):
+    """
+    Compress one long video by encoding keyframe-aligned chunks in parallel ffmpeg processes.
+    The video chunks are concatenated losslessly and the audio is encoded once while muxing,
+    so there are no audio gaps at chunk boundaries.
+    workers: concurrent chunk encodes (default: cores / threads, or one per core when governed)
+    threads: thread cap per chunk encode; None lets the resource governor size each chunk's threads
+    segment_seconds: target chunk length (default: sized so every worker gets several chunks)
+    work_dir: keep the split and finished chunks here instead of a throwaway temp dir. Calling
+              again with the same work_dir resumes: the split and finished chunks are reused.
+    segment_callback: optional callable(chunks_done, chunks_total) called as chunks finish
+    fragmented: write the final mux as a fragmented MP4 (see compress_video)
+    telemetry: optional telemetry.JobTelemetry; timed as 'split', 'encode' (all chunks) and 'concat'
+    tier: speed tier of the chunk encodes (see compress_video)
+    """
+    own_work_dir = work_dir is None
+    try:
+        ffmpeg_exe = get_ffmpeg_path()
+        print(f"Using FFmpeg path: {ffmpeg_exe}")
+
+        if not os.path.exists(input_path):
+            print("Input file not found.")
+            return False
+
+        pipeline = select_pipeline(ffmpeg_exe, tier=tier)
+        if not workers:
+            workers = get_governor().cores if threads is None else default_job_count(threads)
+        if not segment_seconds:
+            segment_seconds = max(30, total_duration / (workers * 3)) if total_duration > 0 else 60
+
+        if own_work_dir:
+            work_dir = tempfile.mkdtemp(prefix="vc_segments_")
+        else:
+            os.makedirs(work_dir, exist_ok=True)
+
+        # The marker is only written once the split finished, so a crash mid-split re-splits
+        split_marker = os.path.join(work_dir, "split.done")
+        segments = read_segment_list(work_dir) if os.path.exists(split_marker) else None
+        if segments:
+            print(f"Resuming from existing split in {work_dir}")
+        else:
+            with telemetry_phase(telemetry, 'split'):
+                segments = split_at_keyframes(input_path, work_dir, segment_seconds, stop_event)
+            if not segments:
+                print("Could not split input into segments.")
+                return False
+            open(split_marker, 'w').close()
+
+        if not total_duration:
+            total_duration = sum(d for _, d in segments)
+
+        # A failed chunk aborts the others as well as a user cancel
+        failed = threading.Event()
+        abort = _EitherEvent(stop_event, failed)
+        latest = [None] * len(segments)
+        progress_lock = threading.Lock()
+        start = time.monotonic()
+        source_info = get_video_info(input_path) if threads is None else None
+        finished = [os.path.exists(os.path.join(work_dir, f"enc_{i:05d}.mkv")) for i in range(len(segments))]
+        if any(finished):
+            print(f"Reusing {sum(finished)} of {len(segments)} finished chunks")
+
+        def encode_segment(index):
+            src, duration = segments[index]
+            dst = os.path.join(work_dir, f"enc_{index:05d}.mkv")
+            if finished[index]:
+                latest[index] = EncodeProgress(1.0, out_time=duration, done=True)
+                return dst
+            # Encode under a temporary name; only a complete chunk ever gets the final name
+            part = os.path.join(work_dir, f"enc_{index:05d}.part.mkv")
+
+            def segment_progress(p):
+                if not progress_callback or total_duration <= 0:
+                    return
+                with progress_lock:
+                    latest[index] = p
+                    progress_callback(_combine_segment_progress(latest, segments, total_duration, start))
+
+            def encode(chunk_threads):
+                threads_args = thread_args(pipeline, chunk_threads)
+                cmd = [
+                    ffmpeg_exe,
+                    '-y',
+                    *threads_args,
+                    '-i', src,
+                    '-vf', f'scale=-2:{target_height}',
+                    *video_codec_args(pipeline, crf, preset),
+                    *threads_args,
+                    '-an',
+                    part
+                ]
+                usage = {}
+                ok = run_ffmpeg(cmd, duration, segment_progress, abort, usage)
+                if telemetry is not None:
+                    telemetry.add_usage(usage)
+                return ok
+
+            if threads is None:
+                cost = estimate_job(dict(source_info or {}, duration=duration), target_height)
+                with get_governor().job(cost, abort, competing=min(workers, len(segments))) as chunk_threads:
+                    ok = chunk_threads is not None and encode(chunk_threads)
+            else:
+                ok = encode(threads)
+            if not ok:
+                failed.set()
+                return None
+            os.replace(part, dst)
+            with progress_lock:
+                finished[index] = True
+                if segment_callback:
+                    segment_callback(sum(finished), len(segments))
+            return dst
+
+        if telemetry is not None:
+            progress_callback = telemetry.track(progress_callback)
+        with telemetry_phase(telemetry, 'encode'), ThreadPoolExecutor(max_workers=workers) as pool:
+            encoded = list(pool.map(encode_segment, range(len(segments))))
+
+        if abort.is_set() or not all(encoded):
+            return False
+
+        list_path = os.path.join(work_dir, "concat.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in encoded:
+                f.write(f"file '{os.path.basename(path)}'\n")
+
+        # The chunks carry only video; audio and subtitles come from the source, as compress_video keeps them
+        source_info = source_info or get_video_info(input_path)
+        plan = plan_streams(source_info, None, output_path)
+        if source_info and source_info.get('streams'):
+            map_args = stream_map_args(plan, pipeline, source_input=1)
+        else:
+            map_args = ['-map', '0:v', '-map', '1:a:0?']
+
+        cmd = [
+            ffmpeg_exe,
+            '-y',
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_path,
+            '-i', input_path,
+            *map_args,
+            '-c:v', 'copy',
+            # The codec tag isn't carried over from the chunks
+            *ENCODER_TAGS.get(pipeline['video'], []),
+            *audio_codec_args(plan, pipeline['audio']),
+            *container_args(output_path, fragmented),
+            output_path
+        ]
+        with telemetry_phase(telemetry, 'concat'):
+            return run_ffmpeg(cmd, stop_event=stop_event)
+    except FFmpegCapabilityError as e:
+        print(f"Cannot compress: {e}")
+        return False
+    except Exception as e:
+        print(f"General Error during segmented compression: {e}")
+        return False
+    finally:
+        if own_work_dir and work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def collect_inputs(sources, manifests=()):
+    """
+    Expand directories, glob patterns, plain files and manifest files into a list of video paths.
+    A manifest is a text file with one path per line; blank lines and '#' comments are ignored.
+    Lines holding a JSON object (scanner.py manifests) contribute their 'path'; ones without a
+    path, or that aren't valid JSON, are reported and skipped.
+    Order is preserved and duplicates are dropped.
+    """
+    paths = []
+    for manifest in manifests:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if line.startswith('{'):
+                    try:
+                        path = json.loads(line).get('path')
+                    except (ValueError, AttributeError):
+                        path = None
+                    if isinstance(path, str) and path:
+                        paths.append(path)
+                    else:
+                        print(f"Skipping {manifest} line {number}: no 'path' in {line[:80]}")
+                elif line and not line.startswith('#'):
+                    paths.append(line)
+
+    for source in sources:
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                full = os.path.join(source, name)
+                if os.path.isfile(full) and name.lower().endswith(VIDEO_EXTENSIONS):
+                    paths.append(full)
+        elif glob.has_magic(source):
+            paths.extend(p for p in sorted(glob.glob(source)) if os.path.isfile(p))
+        else:
+            paths.append(source)
+
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def default_job_count(threads_per_job):
+    """Number of concurrent ffmpeg jobs that fits the machine when each job is capped at threads_per_job."""
+    cores = os.cpu_count() or 1
+    if not threads_per_job:
+        return 1
+    return max(1, cores // threads_per_job)
+
+def batch_output_path(input_path, output_dir, res_tag):
+    """Output name for a batch job, matching the GUI's default save name."""
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"compressed_{res_tag.split(' ')[0]}_{base}.mp4")
+
+@contextlib.contextmanager
+def job_threads(threads, info, target_height, stop_event=None, competing=1, telemetry=None):
+    """
+    Context manager around one encode that yields its thread count: `threads` as given, or when
+    it is None a grant from the resource governor, held until the block ends (None if stop_event
+    was set while waiting for it). The wait is timed as the 'wait' phase of `telemetry`.
+    """
+    if threads is not None:
+        yield threads
+        return
+    with contextlib.ExitStack() as stack:
+        with telemetry_phase(telemetry, 'wait'):
+            granted = stack.enter_context(get_governor().job(estimate_job(info, target_height), stop_event, competing))
+        yield granted
+
+def _run_batch_job(input_path, output_path, target_height, threads, stop_event, fast_path=True, competing=1, tier=None,
+                   progress_callback=None):
+    """
+    Compress one batch entry. Never raises, so one bad file can't take the batch down.
+    threads=None waits for the resource governor to start the job and size its threads.
+    """
+    result = {'input': input_path, 'output': output_path, 'success': False,
+              'seconds': 0.0, 'duration': 0.0, 'input_bytes': 0, 'output_bytes': 0}
+    start = time.monotonic()
+    telemetry = JobTelemetry('batch', input_path, output_path, height=target_height, tier=tier)
+    try:
+        result['input_bytes'] = os.path.getsize(input_path)
+        with telemetry.phase('probe'):
+            info = get_video_info(input_path)
+        if info:
+            result['duration'] = info.get('duration', 0)
+        with job_threads(threads, info, target_height, stop_event, competing, telemetry) as granted:
+            if granted is not None:
+                result['success'] = compress_video(input_path, output_path, target_height,
+                                                   total_duration=result['duration'],
+                                                   progress_callback=progress_callback,
+                                                   stop_event=stop_event, threads=granted,
+                                                   fast_path=fast_path, source_info=info, telemetry=telemetry,
+                                                   tier=tier)
+        if result['success']:
+            result['output_bytes'] = os.path.getsize(output_path)
+        elif os.path.exists(output_path):
+            os.remove(output_path)
+    except Exception as e:
+        print(f"Error in batch job for {input_path}: {e}")
+        result['success'] = False
+    result['seconds'] = time.monotonic() - start
+    if not (stop_event and stop_event.is_set()):
+        record_job(telemetry.finish(result['success']))
+    return result
+
+def run_batch(inputs, output_dir, target_height, res_tag=None, jobs=0, threads_per_job=None, stop_event=None, report=None,
+              fast_path=True, tier=None, progress=None):
+    """
+    Compress many files, running up to `jobs` ffmpeg processes at once.
+    Each job is supervised by a pool thread; the actual work happens in the ffmpeg child processes.
+    threads_per_job: fixed thread cap per job; None hands thread counts and the number of jobs that
+                     really run at once to the resource governor, based on each file's resolution.
+    report: optional callable(result_dict) invoked as each file finishes.
+    tier: speed tier of every job (see compress_video)
+    progress: optional scanner.BatchProgress keyed by the paths in `inputs`; gets every job's
+              progress and outcome, for a cost-weighted progress and ETA of the whole batch
+    Returns: (results list in input order, summary dict)
+    """
+    if res_tag is None:
+        res_tag = f"{target_height}p"
+    if not jobs:
+        jobs = get_governor().cores if threads_per_job is None else default_job_count(threads_per_job)
+    if stop_event is None:
+        stop_event = threading.Event()
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.monotonic()
+    results = [None] * len(inputs)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(_run_batch_job, path, batch_output_path(path, output_dir, res_tag),
+                        target_height, threads_per_job, stop_event, fast_path, min(jobs, len(inputs)), tier,
+                        (lambda p, path=path: progress.update(path, p)) if progress else None): i
+            for i, path in enumerate(inputs)
+        }
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                if progress:
+                    progress.finish(inputs[futures[future]], result['success'])
+                if report:
+                    report(result)
+        except KeyboardInterrupt:
+            print("Interrupted, cancelling remaining jobs...")
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+    elapsed = time.monotonic() - start
+    done = [r for r in results if r and r['success']]
+    summary = {
+        'total': len(inputs),
+        'succeeded': len(done),
+        'failed': len(inputs) - len(done),
+        'seconds': elapsed,
+        'files_per_second': len(done) / elapsed if elapsed > 0 else 0,
+        'input_mb_per_second': sum(r['input_bytes'] for r in done) / 1e6 / elapsed if elapsed > 0 else 0,
+        'realtime_factor': sum(r['duration'] for r in done) / elapsed if elapsed > 0 else 0,
+    }
+    return results, summary
+
+def _print_batch_result(result):
+    if result['success']:
+        ratio = result['output_bytes'] / result['input_bytes'] if result['input_bytes'] else 0
+        print(f"[OK]   {result['input']} -> {result['output']} ({result['seconds']:.1f}s, {ratio:.0%} of original)")
+    else:
+        print(f"[FAIL] {result['input']} ({result['seconds']:.1f}s)")
+
+def resolution_height(label):
+    """Look up a height from a resolution label such as '720p' or '2160p (4K)'. Returns None if unknown."""
+    for name, height in ALL_RESOLUTIONS.items():
+        if label == name or label == name.split(' ')[0]:
+            return height
+    return None
+
+def _resolve_height(args):
+    if args.height:
+        return args.height, f"{args.height}p"
+    if not args.resolution:
+        return None, "original size"
+    height = resolution_height(args.resolution)
+    if height is None:
+        raise SystemExit(f"Unknown resolution '{args.resolution}'. Choose from: {', '.join(ALL_RESOLUTIONS)}")
+    return height, args.resolution
+
+def _batch_command(args):
+    from scanner import scan_library, summarize, job_cost, BatchProgress
+    target_height, res_tag = _resolve_height(args)
+    inputs = collect_inputs(args.sources, args.manifest)
+    if not inputs:
+        print("No input videos found.")
+        return 1
+
+    # Probe everything up front, in parallel, so the batch progress can be weighted by each job's cost
+    entries, _ = scan_library(inputs, recursive=False)
+    scanned = summarize(entries)
+    print(f"Scanned {scanned['files']} video(s): {scanned['bytes'] / 1e9:.2f} GB, "
+          f"{format_eta(scanned['duration'])} of video")
+    by_path = {entry['path']: entry for entry in entries}
+    costs = {path: job_cost(by_path[os.path.abspath(path)], target_height, not args.no_fast_path)
+             if os.path.abspath(path) in by_path else 0.0 for path in inputs}
+    last_print = [0.0]
+
+    def show_progress(p):
+        # Several jobs report at once; a line per second is plenty
+        now = time.monotonic()
+        if now - last_print[0] >= 1.0 or p.done:
+            last_print[0] = now
+            print(f"\rBatch: {int(p * 100)}% of the work, ETA {format_eta(p.eta)}   ", end="", flush=True)
+
+    def report(result):
+        print("\r" + " " * 60 + "\r", end="")
+        _print_batch_result(result)
+
+    progress = BatchProgress(costs, show_progress)
+
+    if args.threads is None:
+        jobs = args.jobs or get_governor().cores
+        print(f"Compressing {len(inputs)} file(s) to {res_tag}, up to {jobs} job(s) at once, "
+              f"threads sized per file for {get_governor().cores} core(s)")
+    else:
+        jobs = args.jobs or default_job_count(args.threads)
+        print(f"Compressing {len(inputs)} file(s) to {res_tag} with {jobs} job(s) x {args.threads or 'auto'} thread(s)")
+    results, summary = run_batch(inputs, args.output_dir, target_height, res_tag=res_tag, jobs=jobs,
+                                 threads_per_job=args.threads, report=report,
+                                 fast_path=not args.no_fast_path, tier=args.tier, progress=progress)
+    print()
+
+    print(f"Batch finished: {summary['succeeded']}/{summary['total']} succeeded in {summary['seconds']:.1f}s "
+          f"({summary['files_per_second']:.2f} files/s, {summary['input_mb_per_second']:.1f} MB/s input, "
+          f"{summary['realtime_factor']:.1f}x realtime)")
+    for r in results:
+        if r and not r['success']:
+            print(f"  failed: {r['input']}")
+    return 0 if summary['failed'] == 0 else 1
+
+def _ladder_command(args):
+    heights = []
+    for label in args.resolution:
+        height = resolution_height(label)
+        if height is None:
+            raise SystemExit(f"Unknown resolution '{label}'. Choose from: {', '.join(ALL_RESOLUTIONS)}")
+        if height not in heights:
+            heights.append(height)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = {h: batch_output_path(args.input, args.output_dir, f"{h}p") for h in heights}
+    info = get_video_info(args.input)
+    duration = info.get('duration', 0) if info else 0
+
+    def progress(p):
+        print(f"\rLadder progress: {int(p * 100)}% ({p.fps:.0f} fps, {p.speed:.2f}x, "
+              f"ETA {format_eta(p.eta)})   ", end="", flush=True)
+
+    start = time.monotonic()
+    status = compress_video_ladder(args.input, outputs, total_duration=duration,
+                                   progress_callback=progress, threads=args.threads)
+    print()
+    for height in heights:
+        print(f"[{'OK' if status[height] else 'FAIL'}]   {height}p -> {outputs[height]}")
+    print(f"Ladder finished in {time.monotonic() - start:.1f}s")
+    return 0 if all(status.values()) else 1
+
+def _compress_command(args):
+    target_height, res_tag = _resolve_height(args)
+    if target_height is None and not (args.target_size or args.auto_quality):
+        raise SystemExit("Give a resolution (-r/--height), a target size (-s), or --auto-quality.")
+    if sum(bool(x) for x in (args.target_size, args.segmented, args.auto_quality)) > 1:
+        raise SystemExit("--target-size, --segmented and --auto-quality can't be combined.")
+    if args.tier and (args.target_size or args.auto_quality):
+        raise SystemExit("--tier can't be combined with --target-size or --auto-quality, which pick their own settings.")
+    telemetry = JobTelemetry('cli', args.input, args.output, height=target_height, target_size=args.target_size,
+                             segmented=args.segmented, auto_quality=args.auto_quality, tier=args.tier)
+    with telemetry.phase('probe'):
+        info = get_video_info(args.input)
+    duration = info.get('duration', 0) if info else 0
+
+    def progress(p):
+        print(f"\rCompressing to {res_tag}: {int(p * 100)}% ({p.fps:.0f} fps, {p.speed:.2f}x, "
+              f"ETA {format_eta(p.eta)})   ", end="", flush=True)
+
+    start = time.monotonic()
+    if args.auto_quality:
+        from quality import compress_video_auto_quality
+        heights = [h for h in ALL_RESOLUTIONS.values() if h <= target_height] if target_height else None
+        success, choice = compress_video_auto_quality(args.input, args.output, target=args.target_score,
+                                                      metric=args.metric, heights=heights,
+                                                      total_duration=duration, progress_callback=progress,
+                                                      status_callback=print, threads=args.threads,
+                                                      fragmented=args.fragmented, telemetry=telemetry)
+    elif args.target_size:
+        target_bytes = parse_size(args.target_size)
+        if not target_bytes:
+            raise SystemExit(f"Invalid target size '{args.target_size}'")
+        success = compress_video_target_size(args.input, args.output, target_height, target_bytes,
+                                             total_duration=duration, progress_callback=progress,
+                                             threads=args.threads, fragmented=args.fragmented, telemetry=telemetry)
+    elif args.segmented:
+        success = compress_video_segmented(args.input, args.output, target_height, total_duration=duration,
+                                           progress_callback=progress, workers=args.jobs,
+                                           threads=args.threads or None, segment_seconds=args.segment_seconds,
+                                           fragmented=args.fragmented, telemetry=telemetry, tier=args.tier)
+    else:
+        success = compress_video(args.input, args.output, target_height, total_duration=duration,
+                                 progress_callback=progress, threads=args.threads,
+                                 fast_path=not args.no_fast_path, source_info=info, fragmented=args.fragmented,
+                                 telemetry=telemetry, tier=args.tier)
+    record_job(telemetry.finish(success))
+    print()
+    print(f"[{'OK' if success else 'FAIL'}]   {args.input} -> {args.output} ({time.monotonic() - start:.1f}s)")
+    return 0 if success else 1
+
+def _sample_command(args):
+    target_height, res_tag = _resolve_height(args)
+    if target_height is None:
+        raise SystemExit("Give a resolution (-r/--height).")
+    ranges = [(args.start, args.length or PREVIEW_SAMPLE_SECONDS)] if args.start is not None else None
+    if ranges is None and args.length:
+        raise SystemExit("--length needs --start; use --count/--seconds for spread samples.")
+
+    def progress(p):
+        print(f"\rSampling {res_tag}: {int(p * 100)}%   ", end="", flush=True)
+
+    info = get_video_info(args.input)
+    if ranges is None and info:
+        ranges = pick_sample_ranges(info.get('duration', 0), args.count, args.seconds)
+    estimate = compress_video_sample(args.input, args.output, target_height, ranges, crf=args.crf,
+                                     preset=args.preset, threads=args.threads, source_info=info,
+                                     progress_callback=progress, tier=args.tier)
+    print()
+    if estimate is None:
+        print(f"[FAIL]   could not encode a sample of {args.input}")
+        return 1
+    print(f"[OK]   {args.output}: {estimate['sample_seconds']:.1f}s sample, {estimate['sample_bytes'] / 1e6:.2f} MB")
+    print(f"Full {res_tag} encode: ~{estimate['estimated_bytes'] / 1e6:.1f} MB "
+          f"({estimate['kbps']:.0f} kbit/s), ~{format_eta(estimate['estimated_seconds'])} at {estimate['speed']:.2f}x")
+    return 0
+
+def _preview_command(args):
+    sheet = get_preview_strip(args.input, args.compare, count=args.frames,
+                              mode='scene' if args.scenes else 'even', use_cache=False)
+    if sheet is None:
+        print(f"[FAIL]   could not extract frames from {args.input}")
+        return 1
+    sheet.save(args.output)
+    print(f"[OK]   {args.output} ({sheet.size[0]}x{sheet.size[1]})")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m compressor", description="Headless video compression.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    batch = sub.add_parser('batch', help="Compress a directory, glob or manifest of videos in parallel.")
+    batch.add_argument('sources', nargs='*', help="Video files, directories or glob patterns.")
+    batch.add_argument('-m', '--manifest', action='append', default=[], help="Text file listing one input path per line.")
+    batch.add_argument('-o', '--output-dir', required=True, help="Directory for compressed files.")
+    target = batch.add_mutually_exclusive_group(required=True)
+    target.add_argument('-r', '--resolution', help="Target resolution label, e.g. 720p.")
+    target.add_argument('--height', type=int, help="Target height in pixels.")
+    batch.add_argument('-j', '--jobs', type=int, default=0, help="Most ffmpeg jobs at once (default: as many as cores and memory allow).")
+    batch.add_argument('-t', '--threads', type=int, default=None, help="Fixed threads per ffmpeg job, 0 = unlimited (default: sized per file).")
+    batch.add_argument('--no-fast-path', action='store_true', help="Always re-encode, even when streams could be copied.")
+    batch.add_argument('--tier', choices=list(SPEED_TIERS), default=None, help=f"Speed tier: {', '.join(SPEED_TIERS)} (picks the encoder and its settings; default: x264 medium).")
+    batch.set_defaults(func=_batch_command)
+
+    compress = sub.add_parser('compress', help="Compress a single video.")
+    compress.add_argument('input', help="Source video.")
+    compress.add_argument('output', help="Output file.")
+    target = compress.add_mutually_exclusive_group()
+    target.add_argument('-r', '--resolution', help="Target resolution label, e.g. 720p.")
+    target.add_argument('--height', type=int, help="Target height in pixels.")
+    compress.add_argument('-t', '--threads', type=int, default=0, help="Thread cap for ffmpeg (per chunk with --segmented).")
+    compress.add_argument('--segmented', action='store_true', help="Split at keyframes and encode chunks in parallel (long videos on many cores).")
+    compress.add_argument('-j', '--jobs', type=int, default=0, help="Parallel chunk encodes with --segmented (default: as many as cores and memory allow).")
+    compress.add_argument('--segment-seconds', type=float, default=0, help="Target chunk length with --segmented.")
+    compress.add_argument('-s', '--target-size', help="Fit the output in this size with a two-pass encode, e.g. 25M.")
+    compress.add_argument('--auto-quality', action='store_true', help="Test short samples and pick the smallest resolution/CRF that meets --target-score (resolution, if given, is the upper limit).")
+    compress.add_argument('--metric', choices=['ssim', 'psnr'], default='ssim', help="Quality metric for --auto-quality.")
+    compress.add_argument('--target-score', type=float, default=None, help="Quality to reach with --auto-quality (default: SSIM 0.95 / PSNR 36).")
+    compress.add_argument('--no-fast-path', action='store_true', help="Always re-encode, even when streams could be copied.")
+    compress.add_argument('--fragmented', action='store_true', help="Write a fragmented MP4 that can be watched while it is being encoded.")
+    compress.add_argument('--tier', choices=list(SPEED_TIERS), default=None, help=f"Speed tier: {', '.join(SPEED_TIERS)} (picks the encoder and its settings; default: x264 medium).")
+    compress.set_defaults(func=_compress_command)
+
+    ladder = sub.add_parser('ladder', help="Encode several resolutions from one decode of the input.")
+    ladder.add_argument('input', help="Source video.")
+    ladder.add_argument('-r', '--resolution', action='append', required=True, help="Resolution label, repeat for each rendition (e.g. -r 1080p -r 720p).")
+    ladder.add_argument('-o', '--output-dir', required=True, help="Directory for the renditions.")
+    ladder.add_argument('-t', '--threads', type=int, default=0, help="Thread cap for ffmpeg (default: 0 = unlimited).")
+    ladder.set_defaults(func=_ladder_command)
+
+    sample = sub.add_parser('sample', help="Encode a few short stretches and estimate the full encode's size and time.")
+    sample.add_argument('input', help="Source video.")
+    sample.add_argument('output', help="Sample clip to write.")
+    target = sample.add_mutually_exclusive_group(required=True)
+    target.add_argument('-r', '--resolution', help="Target resolution label, e.g. 480p.")
+    target.add_argument('--height', type=int, help="Target height in pixels.")
+    sample.add_argument('-n', '--count', type=int, default=PREVIEW_SAMPLE_COUNT, help=f"Stretches spread over the video (default: {PREVIEW_SAMPLE_COUNT}).")
+    sample.add_argument('--seconds', type=float, default=PREVIEW_SAMPLE_SECONDS, help=f"Length of each stretch (default: {PREVIEW_SAMPLE_SECONDS:g}).")
+    sample.add_argument('--start', type=float, default=None, help="Sample one stretch starting here (seconds) instead.")
+    sample.add_argument('--length', type=float, default=None, help="Length of the --start stretch.")
+    sample.add_argument('--crf', type=int, default=23, help="x264 CRF (default: 23).")
+    sample.add_argument('--preset', default='medium', help="x264 preset (default: medium).")
+    sample.add_argument('--tier', choices=list(SPEED_TIERS), default=None, help="Speed tier to sample instead of --crf/--preset.")
+    sample.add_argument('-t', '--threads', type=int, default=0, help="Thread cap for ffmpeg (default: 0 = unlimited).")
+    sample.set_defaults(func=_sample_command)
+
+    preview = sub.add_parser('preview', help="Save a contact sheet of frames from across a video.")
+    preview.add_argument('input', help="Source video.")
+    preview.add_argument('compare', nargs='?', help="Compressed video, shown below the source at the same timestamps.")
+    preview.add_argument('-o', '--output', required=True, help="Image file to write, e.g. sheet.png.")
+    preview.add_argument('-n', '--frames', type=int, default=PREVIEW_STRIP_FRAMES, help=f"Frames per row (default: {PREVIEW_STRIP_FRAMES}).")
+    preview.add_argument('--scenes', action='store_true', help="Take frames just after scene changes instead of evenly spaced ones.")
+    preview.set_defaults(func=_preview_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
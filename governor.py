@@ -0,0 +1,191 @@
+import os
+import sys
+import threading
+import contextlib
+from collections import deque
+
+# Decoding a pixel costs roughly a third of encoding one with libx264 at the usual presets
+DECODE_WEIGHT = 0.3
+# Decoding and encoding keep scaling almost linearly while each thread has at least this much
+# work per frame (weighted pixels, as in estimate_job's 'work'); past that, extra threads mostly
+# wait on each other
+PIXELS_PER_THREAD = 256 * 1024
+MAX_THREADS_PER_JOB = 16
+# Frames held by the decoder (references) and by x264 (lookahead at preset medium, plus references)
+DECODER_FRAMES = 6
+ENCODER_FRAMES = 44
+# ffmpeg's own code, codec contexts and I/O buffers
+BASE_JOB_MEMORY = 64 * 1024 * 1024
+# Share of the memory that was free at start-up that jobs may take together
+MEMORY_HEADROOM = 0.75
+
+def cpu_cores():
+    """Cores this process may run on (respects affinity masks and container CPU sets where visible)."""
+    if hasattr(os, 'sched_getaffinity'):
+        try:
+            return max(1, len(os.sched_getaffinity(0)))
+        except OSError:
+            pass
+    return os.cpu_count() or 1
+
+def available_memory():
+    """Bytes of memory available to new processes without swapping, or None if unknown."""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/meminfo", 'r') as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+    elif os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    try:
+        # No cheap "available" figure (macOS): assume half of physical memory is free
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def estimate_job(info, target_height=None):
+    """
+    Cost of one encode, from the probed source (see compressor.get_video_info).
+    Returns dict with:
+        work:    pixels to decode and encode, weighted (compare jobs with it, not across machines)
+        threads: threads the encode can use efficiently, from the decode + encode work per frame
+        src_pixels, dst_pixels: per-frame pixel counts, for job_memory
+    """
+    info = info or {}
+    width = info.get('width') or 1920
+    height = info.get('height') or 1080
+    out_height = min(target_height or height, height)
+    out_width = width * out_height / height
+    src_pixels = width * height
+    dst_pixels = int(out_width * out_height)
+    frames = (info.get('duration') or 0) * (info.get('fps') or 30)
+    frame_work = src_pixels * DECODE_WEIGHT + dst_pixels
+    return {
+        'work': frames * frame_work,
+        # The decoder shares the job's threads, so a big source needs them even for a small output
+        'threads': max(1, min(MAX_THREADS_PER_JOB, int(frame_work // PIXELS_PER_THREAD))),
+        'src_pixels': src_pixels,
+        'dst_pixels': dst_pixels,
+    }
+
+def job_memory(cost, threads):
+    """Estimated peak memory of an encode running with `threads` threads (frames are 1.5 bytes/pixel)."""
+    return int(BASE_JOB_MEMORY + 1.5 * cost['src_pixels'] * (DECODER_FRAMES + threads)
+               + 1.5 * cost['dst_pixels'] * (ENCODER_FRAMES + threads))
+
+class ResourceGovernor:
+    """
+    Hands out cores and memory to concurrent encodes in one process, so jobs share the machine
+    instead of every ffmpeg sizing its thread pool for all cores.
+    Each job asks for a grant with acquire() (or the job() context manager) and gets a thread
+    count: its fair share of the cores among the jobs that can actually run alongside it, capped
+    at the threads its size can use (estimate_job). Jobs start first come, first served, once a
+    core is free and their estimated memory fits.
+    """
+
+    def __init__(self, cores=None, memory_bytes=None):
+        self.cores = cores or cpu_cores()
+        if memory_bytes is None:
+            available = available_memory()
+            memory_bytes = int(available * MEMORY_HEADROOM) if available else 4 * 1024 ** 3
+        self.memory_bytes = memory_bytes
+        self.running = 0
+        self._free_cores = self.cores
+        self._free_memory = memory_bytes
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    def threads_for(self, cost, competing=1):
+        """
+        Threads a job gets when `competing` jobs (including itself) want the machine, at most
+        cost['threads']. Running jobs keep the cores they hold; the free ones are shared among
+        this job and as many of the others wanting to start as fit in the free memory, assuming
+        they are its size. An ffmpeg keeps its thread count once started, so cores that would be
+        held back for jobs memory can't admit go to this job instead of sitting idle.
+        """
+        cap = max(1, min(cost['threads'], self.cores))
+        # `competing` counts the caller's jobs that already run too
+        wanting = max(1, competing - self.running, len(self._waiting))
+        for starting in range(wanting, 0, -1):
+            threads = max(1, min(cap, self._free_cores // starting))
+            if starting == 1 or starting * job_memory(cost, threads) <= self._free_memory:
+                return threads
+
+    def _try_grant(self, cost, competing):
+        if self._free_cores < 1:
+            return None
+        threads = min(self.threads_for(cost, competing), self._free_cores)
+        memory = job_memory(cost, threads)
+        # A job that doesn't fit still runs when it is alone; waiting could never help it
+        if memory > self._free_memory and self.running:
+            return None
+        self._free_cores -= threads
+        self._free_memory -= memory
+        self.running += 1
+        return {'threads': threads, 'memory': memory}
+
+    def acquire(self, cost, stop_event=None, competing=1):
+        """
+        Wait until the job described by `cost` (see estimate_job) may start.
+        competing: how many jobs the caller is about to run at once; lets the first job of a batch
+                   leave cores for the others instead of taking all of them.
+        Returns: grant dict with 'threads' (pass it to ffmpeg) and 'memory', or None if stop_event
+                 was set while waiting. Hand the grant back with release().
+        """
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while not (stop_event and stop_event.is_set()):
+                    if self._waiting[0] is ticket:
+                        grant = self._try_grant(cost, competing)
+                        if grant:
+                            return grant
+                    self._cond.wait(0.5)
+                return None
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self, grant):
+        with self._cond:
+            self._free_cores += grant['threads']
+            self._free_memory += grant['memory']
+            self.running -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def job(self, cost, stop_event=None, competing=1):
+        """Context manager around acquire()/release(); yields the thread count, or None if stopped."""
+        grant = self.acquire(cost, stop_event, competing)
+        try:
+            yield grant['threads'] if grant else None
+        finally:
+            if grant:
+                self.release(grant)
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor():
+    """The process-wide governor shared by batch runs, the job queue and watch folders."""
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = ResourceGovernor()
+        return _governor
@@ -0,0 +1,421 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+
+from cache import get_data_dir
+from governor import get_governor
+from telemetry import JobTelemetry, record_job
+from compressor import (get_video_info, compress_video, compress_video_segmented, plan_streams, job_threads,
+                        collect_inputs, batch_output_path, resolution_height, ALL_RESOLUTIONS, SPEED_TIERS)
+
+# Sources at least this long are encoded in keyframe-aligned chunks, so a crash only loses
+# the chunks in flight instead of the whole encode
+SEGMENT_THRESHOLD_SECONDS = 600
+
+# Runners refresh the heartbeat of their running jobs; a 'running' job whose heartbeat is
+# older than STALE_SECONDS belongs to a runner that died and is queued again
+HEARTBEAT_INTERVAL = 5.0
+STALE_SECONDS = 15.0
+
+# Jobs in these states are not added again when the same file and settings are queued twice
+_LIVE_STATUSES = ('queued', 'running', 'done')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    segments_done INTEGER NOT NULL DEFAULT 0,
+    segments_total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+def default_queue_path():
+    return os.path.join(get_data_dir(), "jobs.db")
+
+def partial_output_path(output_path):
+    """Where a job writes until it succeeds: 'movie.part.mp4' for 'movie.mp4' (ffmpeg picks the muxer from the extension)."""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.part{ext}"
+
+def _job_from_row(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['settings'] = json.loads(job['settings'])
+    return job
+
+class JobQueue:
+    """
+    Durable list of compression jobs in SQLite.
+    Every state change is committed on the spot, so after a crash the database says which jobs
+    finished; run() skips those and resumes the rest, segmented ones from their last finished chunk.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_queue_path()
+        self._lock = threading.Lock()
+        # Autocommit; claim() opens its own transaction
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def work_dir(self, job_id):
+        """Per-job directory for resumable state (the split and finished chunks), next to the database."""
+        return os.path.join(os.path.dirname(os.path.abspath(self.path)), "jobs", str(job_id))
+
+    def add(self, input_path, output_path, target_height=None, crf=23, preset='medium', fast_path=True, tier=None):
+        """
+        Queue one file. Returns the job id. tier: speed tier, see compressor.compress_video.
+        Adding the same input, output and settings again returns the existing job unless it failed
+        or was cancelled, so re-running an interrupted 'add' skips everything already done.
+        """
+        input_path = os.path.abspath(input_path)
+        output_path = os.path.abspath(output_path)
+        settings = {'height': target_height, 'crf': crf, 'preset': preset, 'fast_path': fast_path}
+        if tier is not None:
+            # Left out otherwise, so jobs queued before tiers existed still match
+            settings['tier'] = tier
+        settings = json.dumps(settings, sort_keys=True)
+        placeholders = ",".join("?" * len(_LIVE_STATUSES))
+        existing = self._execute(
+            f"SELECT id FROM jobs WHERE input_path = ? AND output_path = ? AND settings = ? "
+            f"AND status IN ({placeholders}) ORDER BY id LIMIT 1",
+            (input_path, output_path, settings, *_LIVE_STATUSES))
+        if existing:
+            return existing[0]['id']
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (input_path, output_path, settings, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (input_path, output_path, settings, now, now))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return _job_from_row(rows[0]) if rows else None
+
+    def jobs(self, status=None):
+        if status:
+            rows = self._execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+        else:
+            rows = self._execute("SELECT * FROM jobs ORDER BY id")
+        return [_job_from_row(row) for row in rows]
+
+    def claim(self):
+        """Atomically move the oldest queued job to 'running'. Returns the job, or None if nothing is queued."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (time.time(), row['id']))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return self.get(row['id'])
+
+    def heartbeat(self, job_ids):
+        now = time.time()
+        for job_id in job_ids:
+            self._execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'", (now, job_id))
+
+    def update_segments(self, job_id, done, total):
+        self._execute("UPDATE jobs SET segments_done = ?, segments_total = ?, updated_at = ? WHERE id = ?",
+                      (done, total, time.time(), job_id))
+
+    def finish(self, job_id, status, error=None):
+        """Record a job's outcome: 'done', 'failed', 'cancelled', or 'queued' to hand it back for a later run."""
+        now = time.time()
+        self._execute("UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                      (status, error, now, now if status in ('done', 'failed', 'cancelled') else None, job_id))
+
+    def requeue_stale(self, max_age=STALE_SECONDS):
+        """Queue 'running' jobs whose runner stopped sending heartbeats. Returns how many were recovered."""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                                      (time.time() - max_age,))
+            return cursor.rowcount
+
+    def retry(self, job_id):
+        """Queue a failed or cancelled job again. Returns False if the job isn't in one of those states."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, finished_at = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('failed', 'cancelled')", (time.time(), job_id))
+            return cursor.rowcount > 0
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; a runner working on it stops within a second. Returns False if already settled."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), time.time(), job_id))
+            return cursor.rowcount > 0
+
+    def run(self, workers=0, threads=None, stop_event=None, report=None):
+        """
+        Work through queued jobs with up to `workers` concurrent encodes until none are left or stop_event is set.
+        threads=None lets the resource governor size each encode and decide how many really run at once
+        (workers then defaults to one per core); a number is a fixed cap per ffmpeg process.
+        Jobs abandoned by a dead runner are recovered first. Interrupted jobs go back to 'queued'.
+        report: optional callable(job_dict) called as each job settles.
+        Returns: dict of job counts per resulting status
+        """
+        if stop_event is None:
+            stop_event = threading.Event()
+        if not workers:
+            workers = get_governor().cores if threads is None else 1
+        recovered = self.requeue_stale()
+        if recovered:
+            print(f"Recovered {recovered} interrupted job(s)")
+
+        active = {}
+        lock = threading.Lock()
+        counts = {}
+        all_done = threading.Event()
+
+        def worker():
+            while not stop_event.is_set():
+                job = self.claim()
+                if job is None:
+                    return
+                job_stop = threading.Event()
+                with lock:
+                    active[job['id']] = job_stop
+                try:
+                    status = run_job(self, job, job_stop, threads, competing=workers)
+                finally:
+                    with lock:
+                        active.pop(job['id'], None)
+                with lock:
+                    counts[status] = counts.get(status, 0) + 1
+                if report:
+                    report(self.get(job['id']))
+
+        def monitor():
+            # Heartbeats for the jobs in flight, and stop/cancel requests relayed to their encodes
+            last_beat = 0.0
+            while not all_done.wait(0.5):
+                with lock:
+                    current = dict(active)
+                if time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+                    self.heartbeat(list(current))
+                    last_beat = time.monotonic()
+                for job_id, job_stop in current.items():
+                    if stop_event.is_set() or self.get(job_id)['status'] == 'cancelled':
+                        job_stop.set()
+
+        monitor_thread = threading.Thread(target=monitor, daemon=True)
+        monitor_thread.start()
+        pool = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+        for t in pool:
+            t.start()
+        try:
+            for t in pool:
+                while t.is_alive():
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            print("Interrupted, stopping; unfinished jobs stay queued for the next run...")
+            stop_event.set()
+            for t in pool:
+                t.join()
+        finally:
+            all_done.set()
+            monitor_thread.join()
+        return counts
+
+def run_job(queue, job, stop_event=None, threads=None, competing=1):
+    """
+    Encode one claimed job into its partial output and rename that into place on success.
+    Long sources that need a real encode go through compress_video_segmented with a work dir
+    that outlives the process, so the next attempt starts at the first unfinished chunk.
+    threads=None waits for the resource governor (per chunk for segmented encodes).
+    Returns: the job's new status
+    """
+    settings = job['settings']
+    height = settings.get('height')
+    input_path = job['input_path']
+    output_path = job['output_path']
+    part_path = partial_output_path(output_path)
+    work_dir = queue.work_dir(job['id'])
+    success = False
+    telemetry = JobTelemetry('queue', input_path, output_path, job_id=job['id'], **settings)
+    try:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with telemetry.phase('probe'):
+            info = get_video_info(input_path)
+        duration = info.get('duration', 0) if info else 0
+        plan = plan_streams(info, height, output_path, settings.get('fast_path', True))
+        if height and duration >= SEGMENT_THRESHOLD_SECONDS and plan['video'] == 'scale':
+            success = compress_video_segmented(
+                input_path, part_path, height, total_duration=duration, stop_event=stop_event,
+                threads=threads, crf=settings.get('crf', 23), preset=settings.get('preset', 'medium'),
+                work_dir=work_dir, telemetry=telemetry, tier=settings.get('tier'),
+                segment_callback=lambda done, total: queue.update_segments(job['id'], done, total))
+        else:
+            with job_threads(threads, info, height, stop_event, competing, telemetry) as granted:
+                if granted is not None:
+                    success = compress_video(input_path, part_path, height, total_duration=duration,
+                                             stop_event=stop_event, threads=granted,
+                                             fast_path=settings.get('fast_path', True), source_info=info,
+                                             crf=settings.get('crf', 23), preset=settings.get('preset', 'medium'),
+                                             telemetry=telemetry, tier=settings.get('tier'))
+        if success:
+            with telemetry.phase('save'):
+                os.replace(part_path, output_path)
+    except Exception as e:
+        print(f"Error in queued job {job['id']} ({input_path}): {e}")
+        success = False
+
+    if success:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        queue.finish(job['id'], 'done')
+        record_job(telemetry.finish(True))
+        return 'done'
+
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    current = queue.get(job['id'])
+    if current and current['status'] == 'cancelled':
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return 'cancelled'
+    if stop_event and stop_event.is_set():
+        # Interrupted rather than broken: keep the finished chunks for the next run
+        queue.finish(job['id'], 'queued')
+        return 'queued'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    queue.finish(job['id'], 'failed', "Compression failed, see the log for ffmpeg's output")
+    record_job(telemetry.finish(False))
+    return 'failed'
+
+def _print_job(job):
+    segments = f" {job['segments_done']}/{job['segments_total']} chunks" if job['segments_total'] else ""
+    height = job['settings'].get('height')
+    target = f"{height}p" if height else "original"
+    print(f"{job['id']:>5} {job['status']:<9} {target:<8}{segments}  {job['input_path']} -> {job['output_path']}"
+          + (f"  ({job['error']})" if job['error'] else ""))
+
+def _add_command(queue, args):
+    if args.height:
+        height, res_tag = args.height, f"{args.height}p"
+    elif args.resolution:
+        height = resolution_height(args.resolution)
+        if height is None:
+            raise SystemExit(f"Unknown resolution '{args.resolution}'. Choose from: {', '.join(ALL_RESOLUTIONS)}")
+        res_tag = args.resolution
+    else:
+        height, res_tag = None, "original"
+    inputs = collect_inputs(args.sources, args.manifest)
+    if not inputs:
+        print("No input videos found.")
+        return 1
+    before = {job['id'] for job in queue.jobs()}
+    ids = [queue.add(path, batch_output_path(path, args.output_dir, res_tag), height,
+                     crf=args.crf, preset=args.preset, fast_path=not args.no_fast_path, tier=args.tier)
+           for path in inputs]
+    new = [i for i in ids if i not in before]
+    print(f"Queued {len(new)} job(s), {len(ids) - len(new)} already in the queue")
+    return 0
+
+def _run_command(queue, args):
+    def report(job):
+        _print_job(job)
+
+    counts = queue.run(workers=args.jobs, threads=args.threads, report=report)
+    print("Queue run finished: " + (", ".join(f"{n} {status}" for status, n in sorted(counts.items())) or "nothing to do"))
+    return 0 if not counts.get('failed') else 1
+
+def _list_command(queue, args):
+    for job in queue.jobs(args.status):
+        _print_job(job)
+    return 0
+
+def _retry_command(queue, args):
+    ok = True
+    for job_id in args.ids:
+        if not queue.retry(job_id):
+            print(f"Job {job_id} is not failed or cancelled.")
+            ok = False
+    return 0 if ok else 1
+
+def _cancel_command(queue, args):
+    ok = True
+    for job_id in args.ids:
+        if not queue.cancel(job_id):
+            print(f"Job {job_id} is not queued or running.")
+            ok = False
+    return 0 if ok else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python jobqueue.py",
+                                     description="Persistent compression queue that survives crashes and restarts.")
+    parser.add_argument('--db', help="Queue database (default: in the app's data directory).")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help="Queue videos for compression.")
+    add.add_argument('sources', nargs='*', help="Video files, directories or glob patterns.")
+    add.add_argument('-m', '--manifest', action='append', default=[], help="Text file listing one input path per line.")
+    add.add_argument('-o', '--output-dir', required=True, help="Directory for compressed files.")
+    target = add.add_mutually_exclusive_group()
+    target.add_argument('-r', '--resolution', help="Target resolution label, e.g. 720p.")
+    target.add_argument('--height', type=int, help="Target height in pixels.")
+    add.add_argument('--crf', type=int, default=23, help="x264 CRF (default: 23).")
+    add.add_argument('--preset', default='medium', help="x264 preset (default: medium).")
+    add.add_argument('--tier', choices=list(SPEED_TIERS), default=None, help="Speed tier, overrides --crf/--preset.")
+    add.add_argument('--no-fast-path', action='store_true', help="Always re-encode, even when streams could be copied.")
+    add.set_defaults(func=_add_command)
+
+    run = sub.add_parser('run', help="Work through the queue; interrupted jobs resume on the next run.")
+    run.add_argument('-j', '--jobs', type=int, default=0, help="Most jobs at once (default: as many as cores and memory allow).")
+    run.add_argument('-t', '--threads', type=int, default=None, help="Fixed thread cap per ffmpeg process, 0 = unlimited (default: sized per job).")
+    run.set_defaults(func=_run_command)
+
+    list_parser = sub.add_parser('list', help="Show the jobs in the queue.")
+    list_parser.add_argument('--status', choices=['queued', 'running', 'done', 'failed', 'cancelled'])
+    list_parser.set_defaults(func=_list_command)
+
+    retry = sub.add_parser('retry', help="Queue failed or cancelled jobs again.")
+    retry.add_argument('ids', type=int, nargs='+')
+    retry.set_defaults(func=_retry_command)
+
+    cancel = sub.add_parser('cancel', help="Cancel queued or running jobs.")
+    cancel.add_argument('ids', type=int, nargs='+')
+    cancel.set_defaults(func=_cancel_command)
+
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.db)
+    try:
+        return args.func(queue, args)
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
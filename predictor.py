@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import math
+import argparse
+import threading
+
+from governor import estimate_job, cpu_cores
+from telemetry import get_telemetry_dir
+from compressor import get_video_info, format_eta, ALL_RESOLUTIONS, DEFAULT_TIER
+
+# Starting points before there is any history, measured per speed tier on one core (see the
+# Speed Tiers table in the README): bits per output pixel at 720p, and governor work units
+# (estimate_job 'work') encoded per second per thread
+PRIOR_BITS_PER_PIXEL = {'fastest': 0.047, 'balanced': 0.054, 'small': 0.031, 'smallest': 0.020}
+PRIOR_WORK_RATE = {'fastest': 57e6, 'balanced': 35e6, 'small': 17e6, 'smallest': 7.8e6}
+PRIOR_PIXELS = 1280 * 720
+# Smaller frames need more bits per pixel: bpp goes with pixels ** -0.3 across the tier table
+BPP_PIXELS_EXPONENT = -0.3
+# Extra threads don't help linearly; an encode with n threads runs about n ** 0.8 times as fast
+THREAD_SCALING = 0.8
+# The prior counts as this many history samples, so a couple of jobs already move the estimate
+PRIOR_WEIGHT = 1.0
+# Earlier encodes of the same file say the most about how it compresses
+SAME_INPUT_WEIGHT = 4.0
+# Only the most recent samples of each profile are used
+HISTORY_SAMPLES = 200
+# Batch jobs share the machine by design, so their encode times say little about a job running alone
+TIMING_JOBS = ('gui', 'cli', 'queue', 'server')
+
+def history_sample(record, cores=None):
+    """
+    What one telemetry job record says about the encoder: dict with profile, input, pixels,
+    bpp (output bits per output pixel and frame, audio included) and rate (work units per
+    second per effective thread, None for jobs that shared the machine). None if the record
+    can't be used: failed, cached, a remux, or written before records described their output.
+    """
+    video = record.get('output_video')
+    if (not video or not record.get('success') or record.get('cached') or video.get('mode') == 'copy'
+            or not record.get('frames') or not record.get('output_bytes')):
+        return None
+    pixels = (video.get('width') or 0) * (video.get('height') or 0)
+    if not pixels:
+        return None
+    sample = {'profile': video.get('profile'), 'input': record.get('input'), 'pixels': pixels,
+              'bpp': record['output_bytes'] * 8 / (record['frames'] * pixels), 'rate': None}
+    encode_seconds = record.get('phases', {}).get('encode', 0)
+    if record.get('job') in TIMING_JOBS and encode_seconds > 0 and video.get('source_height'):
+        cost = estimate_job({'width': video.get('source_width'), 'height': video['source_height'],
+                             'duration': record['frames'], 'fps': 1}, video['height'])
+        sample['rate'] = cost['work'] / encode_seconds / _effective_threads(cost, cores)
+    return sample
+
+def _effective_threads(cost, cores=None):
+    return min(cores or cpu_cores(), cost['threads']) ** THREAD_SCALING
+
+_history_cache = {}
+_history_lock = threading.Lock()
+
+def load_history(directory=None):
+    """
+    history_sample of every usable job in the telemetry log (jobs.jsonl and its rotated .1), oldest
+    first. The parsed log is kept in memory until the files change.
+    """
+    directory = directory or get_telemetry_dir()
+    paths = [os.path.join(directory, name) for name in ("jobs.jsonl.1", "jobs.jsonl")]
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamps.append(None)
+    with _history_lock:
+        cached = _history_cache.get(directory)
+        if cached and cached[0] == stamps:
+            return cached[1]
+    samples = []
+    for path, stamp in zip(paths, stamps):
+        if stamp is None:
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        sample = history_sample(json.loads(line))
+                    except (ValueError, TypeError, KeyError, AttributeError):
+                        # A line cut short by a crash, or some other tool's record
+                        continue
+                    if sample:
+                        samples.append(sample)
+        except OSError as e:
+            print(f"Could not read job history {path}: {e}")
+    with _history_lock:
+        _history_cache[directory] = (stamps, samples)
+    return samples
+
+def _blend(prior, estimates):
+    # Weighted geometric mean: a job twice as big as typical pulls as hard as one half as big
+    total = PRIOR_WEIGHT
+    log_sum = PRIOR_WEIGHT * math.log(prior)
+    for value, weight in estimates:
+        total += weight
+        log_sum += weight * math.log(value)
+    return math.exp(log_sum / total)
+
+def predict(info, target_height, profile=DEFAULT_TIER, history=None, input_path=None, cores=None):
+    """
+    Estimated output size and encode time of compressing a probed source to target_height with
+    the speed tier (or encode_profile name) `profile`.
+    Starts from the tier table and learns from history (load_history() by default): each sample's
+    bits per pixel and encode rate are carried over to the target resolution and averaged,
+    weighted towards samples at a similar resolution and earlier encodes of input_path.
+    Returns dict with bytes, seconds and samples (how many history entries were used), or None
+    without a duration.
+    """
+    if not info or not info.get('duration'):
+        return None
+    if history is None:
+        history = load_history()
+    cost = estimate_job(info, target_height)
+    pixels = cost['dst_pixels']
+    frames = info['duration'] * (info.get('fps') or 30)
+    same_input = os.path.abspath(input_path) if input_path else None
+
+    bpp_estimates, rate_estimates = [], []
+    samples = [sample for sample in history if sample['profile'] == profile][-HISTORY_SAMPLES:]
+    for sample in samples:
+        weight = 1.0 / (1.0 + abs(math.log2(pixels / sample['pixels'])))
+        if same_input and sample['input'] and os.path.abspath(sample['input']) == same_input:
+            weight *= SAME_INPUT_WEIGHT
+        bpp_estimates.append((sample['bpp'] * (pixels / sample['pixels']) ** BPP_PIXELS_EXPONENT, weight))
+        if sample['rate']:
+            rate_estimates.append((sample['rate'], weight))
+
+    prior_bpp = (PRIOR_BITS_PER_PIXEL.get(profile, PRIOR_BITS_PER_PIXEL[DEFAULT_TIER])
+                 * (pixels / PRIOR_PIXELS) ** BPP_PIXELS_EXPONENT)
+    prior_rate = PRIOR_WORK_RATE.get(profile, PRIOR_WORK_RATE[DEFAULT_TIER])
+    bpp = _blend(prior_bpp, bpp_estimates)
+    rate = _blend(prior_rate, rate_estimates)
+    return {
+        'bytes': int(bpp * pixels * frames / 8),
+        'seconds': cost['work'] / (rate * _effective_threads(cost, cores)),
+        'samples': len(samples),
+    }
+
+def predict_resolutions(info, profile=DEFAULT_TIER, input_path=None, resolutions=ALL_RESOLUTIONS):
+    """predict for each of `resolutions` ({label: height}) below the source's height: {label: prediction}."""
+    if not info or not info.get('duration'):
+        return {}
+    history = load_history()
+    source_height = info.get('height') or 0
+    return {label: predict(info, height, profile, history, input_path)
+            for label, height in resolutions.items() if not source_height or height < source_height}
+
+def format_size(size_bytes):
+    """Bytes -> '140 MB' or '1.2 GB'."""
+    if size_bytes >= 1e9:
+        return f"{size_bytes / 1e9:.1f} GB"
+    if size_bytes >= 10e6:
+        return f"{size_bytes / 1e6:.0f} MB"
+    return f"{size_bytes / 1e6:.1f} MB"
+
+def format_duration(seconds):
+    """Seconds -> rounded for a glance: '40 s', '3 min', '1.5 h'."""
+    if seconds < 60:
+        return f"{max(1, round(seconds))} s"
+    if seconds < 3600:
+        return f"{round(seconds / 60)} min"
+    return f"{seconds / 3600:.1f} h"
+
+def format_prediction(prediction):
+    """'≈ 140 MB, ≈ 3 min' for a predict result ('' for None)."""
+    if not prediction:
+        return ""
+    return f"≈ {format_size(prediction['bytes'])}, ≈ {format_duration(prediction['seconds'])}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python predictor.py",
+                                     description="Estimate output size and encode time per resolution from past jobs.")
+    parser.add_argument('input', help="Video to estimate for.")
+    parser.add_argument('--tier', default=DEFAULT_TIER, help=f"Speed tier (default: {DEFAULT_TIER}).")
+    args = parser.parse_args(argv)
+
+    info = get_video_info(args.input)
+    if not info or not info.get('duration'):
+        print(f"Could not read {args.input}")
+        return 1
+    predictions = predict_resolutions(info, args.tier, args.input)
+    if not predictions:
+        print(f"No resolution below the source's {info.get('height')}p")
+        return 1
+    samples = next(iter(predictions.values()))['samples']
+    print(f"{args.input}: {info.get('width')}x{info.get('height')}, {format_eta(info['duration'])}, "
+          f"'{args.tier}' tier, {samples} past job(s) to learn from")
+    for label, prediction in sorted(predictions.items(), key=lambda item: -ALL_RESOLUTIONS.get(item[0], 0)):
+        print(f"  {label:<12} {format_prediction(prediction):<24} (ETA {format_eta(prediction['seconds'])})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import os
+import re
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from compressor import (get_ffmpeg_path, get_video_info, compress_video, hidden_window_startupinfo,
+                        default_job_count, telemetry_phase, select_pipeline, pick_sample_ranges, ALL_RESOLUTIONS,
+                        SAMPLE_COUNT)
+from capabilities import FFmpegCapabilityError
+from governor import estimate_job
+
+# Candidate CRF values, best quality first. Quality falls monotonically along the list,
+# which lets the search bisect instead of trying every value.
+CANDIDATE_CRFS = [18, 20, 23, 26, 28, 30, 32]
+
+# Each height's bisection starts here, the CRF most videos end up near
+DEFAULT_CRF = 23
+
+# Only the largest few candidate heights are searched, and each tries at most SEARCH_STEPS CRFs
+SEARCH_HEIGHTS = 2
+SEARCH_STEPS = 3
+
+# Scoring a sample (decode the source, scale the sample back up, ssim/psnr) costs about this many
+# governor work units per source pixel; measured at ~1/6 of an x264 medium encode at source size
+COMPARE_WEIGHT = 0.2
+
+# A search may cost at most this much of the full encode. Short videos search one height, then
+# one sample; when even that costs more, the largest height is encoded at DEFAULT_CRF unsearched
+MAX_SEARCH_COST_FRACTION = 0.15
+
+# Default targets: SSIM (0-1) or PSNR (dB), measured against the source at its own resolution
+DEFAULT_TARGETS = {'ssim': 0.95, 'psnr': 36.0}
+
+_SSIM_PATTERN = re.compile(r"SSIM .*All:([\d.]+)")
+_PSNR_PATTERN = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+def parse_score(text, metric):
+    """Pull the overall SSIM ('All:') or PSNR ('average:') value out of ffmpeg's log. None if missing."""
+    pattern = _SSIM_PATTERN if metric == 'ssim' else _PSNR_PATTERN
+    matches = pattern.findall(text)
+    if not matches:
+        return None
+    return float(matches[-1])
+
+def _run(cmd):
+    return subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, errors='replace', startupinfo=hidden_window_startupinfo())
+
+def score_sample(input_path, sample_range, height, crf, info, metric, work_dir, preset='medium', threads=2,
+                 encoder='libx264'):
+    """
+    Encode one sample range at (height, crf) and score it against the same range of the source.
+    The sample is scaled back up to the source size before comparing, so the score reflects
+    both resolution and compression loss, i.e. what the viewer sees.
+    Returns: (score, encoded bytes) or None on failure.
+    """
+    ffmpeg_exe = get_ffmpeg_path()
+    start, length = sample_range
+    sample_path = os.path.join(work_dir, f"sample_{height}_{crf}_{int(start * 1000)}.mp4")
+    encode = [
+        ffmpeg_exe, '-y', '-nostdin',
+        '-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', input_path,
+        '-map', '0:v:0',
+        '-vf', f'scale=-2:{height}',
+        '-c:v', encoder, '-crf', str(crf), '-preset', preset,
+        '-threads', str(threads),
+        '-an',
+        sample_path
+    ]
+    if _run(encode).returncode != 0 or not os.path.exists(sample_path):
+        return None
+    size = os.path.getsize(sample_path)
+
+    compare = [
+        ffmpeg_exe, '-hide_banner', '-nostdin',
+        '-ss', f"{start:.3f}", '-t', f"{length:.3f}", '-i', input_path,
+        '-i', sample_path,
+        '-lavfi', f"[1:v]scale={info['width']}:{info['height']}:flags=bicubic[d];[0:v:0][d]{metric}",
+        '-threads', str(threads),
+        '-f', 'null', '-'
+    ]
+    result = _run(compare)
+    score = parse_score(result.stderr, metric)
+    os.remove(sample_path)
+    if score is None:
+        return None
+    return score, size
+
+def estimate_search_cost(info, ranges, heights):
+    """
+    Governor work units (see governor.estimate_job) of a worst-case search: SEARCH_STEPS
+    candidates per height, each encoding every sample range and comparing it with the source.
+    """
+    sample_info = dict(info, duration=sum(length for _, length in ranges))
+    frames = sample_info['duration'] * (info.get('fps') or 30)
+    compare = frames * (info.get('width') or 0) * info['height'] * COMPARE_WEIGHT
+    return SEARCH_STEPS * sum(estimate_job(sample_info, height)['work'] + compare for height in heights)
+
+def plan_search(info, heights):
+    """
+    (sample ranges, heights) for a search within MAX_SEARCH_COST_FRACTION of the full encode at
+    heights[0]: all of them, then only the largest height, then also only one sample.
+    None if even the smallest search costs too much.
+    """
+    budget = MAX_SEARCH_COST_FRACTION * estimate_job(info, heights[0])['work']
+    for count, search_heights in ((SAMPLE_COUNT, heights), (SAMPLE_COUNT, heights[:1]), (1, heights[:1])):
+        ranges = pick_sample_ranges(info['duration'], count)
+        if estimate_search_cost(info, ranges, search_heights) < budget:
+            return ranges, search_heights
+    return None
+
+def find_quality_settings(input_path, target=None, metric='ssim', heights=None, crfs=None,
+                          preset='medium', stop_event=None, status_callback=None):
+    """
+    Pick the cheapest (height, crf) whose samples reach `target` on `metric`.
+    A couple of short samples are encoded per candidate and scored with ffmpeg's ssim/psnr filters,
+    in parallel. Only the SEARCH_HEIGHTS largest heights are tried, largest first. Each bisects its
+    CRF list from DEFAULT_CRF for at most SEARCH_STEPS candidates, and never goes above the CRF
+    the height before it settled on: a smaller frame can't score better at the same CRF.
+    heights: candidate heights (default: every ALL_RESOLUTIONS height below the source's)
+    status_callback: optional callable(str) for progress messages
+    The search is cut down to stay within MAX_SEARCH_COST_FRACTION of the full encode (see
+    plan_search); on videos too short for that it is skipped and the largest height is used at
+    DEFAULT_CRF.
+    Returns: dict with height, crf, score, kbps (sample bitrate), met_target, searched and every
+    evaluated candidate (score and kbps are None when the search was skipped), or None if the
+    source can't be sampled.
+    """
+    if metric not in DEFAULT_TARGETS:
+        raise ValueError(f"metric must be one of {', '.join(DEFAULT_TARGETS)}")
+    if target is None:
+        target = DEFAULT_TARGETS[metric]
+    crfs = sorted(crfs or CANDIDATE_CRFS)
+
+    try:
+        pipeline = select_pipeline(get_ffmpeg_path(), ('scale', metric))
+    except FFmpegCapabilityError as e:
+        print(f"Cannot run a quality search: {e}")
+        return None
+
+    info = get_video_info(input_path)
+    if not info or not info.get('duration') or not info.get('height'):
+        print("Cannot run a quality search without the source's size and duration.")
+        return None
+    if heights is None:
+        # Strictly lower, like the GUI menu; at the source height the remux fast path would apply
+        heights = [h for h in ALL_RESOLUTIONS.values() if h < info['height']] or [info['height']]
+    heights = sorted(set(heights), reverse=True)[:SEARCH_HEIGHTS]
+
+    plan = plan_search(info, heights)
+    if plan is None:
+        message = f"Video too short for a quality search; using {heights[0]}p CRF {DEFAULT_CRF}"
+        if status_callback:
+            status_callback(message)
+        else:
+            print(message)
+        return {'height': heights[0], 'crf': DEFAULT_CRF, 'score': None, 'kbps': None, 'met_target': False,
+                'searched': False, 'metric': metric, 'target': target, 'evaluated': []}
+    ranges, heights = plan
+    sample_seconds = sum(length for _, length in ranges)
+    work_dir = tempfile.mkdtemp(prefix="vc_quality_")
+    evaluated = []
+    pool = ThreadPoolExecutor(max_workers=default_job_count(2))
+
+    def evaluate(height, crf):
+        if stop_event and stop_event.is_set():
+            return None
+        futures = [pool.submit(score_sample, input_path, r, height, crf, info, metric, work_dir, preset,
+                               encoder=pipeline['video'])
+                   for r in ranges]
+        results = [f.result() for f in futures]
+        if not all(results):
+            return None
+        candidate = {
+            'height': height,
+            'crf': crf,
+            'score': sum(score for score, _ in results) / len(results),
+            'kbps': sum(size for _, size in results) * 8 / sample_seconds / 1000,
+        }
+        candidate['met_target'] = candidate['score'] >= target
+        evaluated.append(candidate)
+        if status_callback:
+            status_callback(f"{height}p CRF {crf}: {metric.upper()} {candidate['score']:.3f}, ~{candidate['kbps']:.0f} kbit/s")
+        return candidate
+
+    start = min(range(len(crfs)), key=lambda i: abs(crfs[i] - DEFAULT_CRF))
+
+    def search_height(height, hi):
+        # Highest CRF (smallest file) in crfs[:hi + 1] that still meets the target, by bisection
+        lo = 0
+        mid = min(start, hi)
+        best = None
+        for _ in range(SEARCH_STEPS):
+            if lo > hi:
+                break
+            candidate = evaluate(height, crfs[mid])
+            if candidate is None:
+                return best
+            if candidate['met_target']:
+                best = candidate
+                lo = mid + 1
+            else:
+                hi = mid - 1
+            mid = (lo + hi) // 2
+        return best
+
+    winners = []
+    try:
+        hi = len(crfs) - 1
+        for height in heights:
+            winner = search_height(height, hi)
+            if winner is None:
+                # A smaller frame won't reach the target either
+                break
+            winners.append(winner)
+            hi = crfs.index(winner['crf'])
+    finally:
+        pool.shutdown(wait=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if stop_event and stop_event.is_set():
+        return None
+    if not evaluated:
+        return None
+    if winners:
+        choice = min(winners, key=lambda c: c['kbps'])
+    else:
+        # Nothing reaches the target: settle for the best quality we measured
+        choice = max(evaluated, key=lambda c: c['score'])
+    result = dict(choice)
+    result['searched'] = True
+    result['metric'] = metric
+    result['target'] = target
+    result['evaluated'] = sorted(evaluated, key=lambda c: (-c['height'], c['crf']))
+    return result
+
+def compress_video_auto_quality(input_path, output_path, target=None, metric='ssim', heights=None,
+                                total_duration=0, progress_callback=None, stop_event=None,
+                                status_callback=None, threads=0, fragmented=False, telemetry=None):
+    """
+    Run the sample search, then do the one full encode with the chosen settings.
+    fragmented: write the full encode as a fragmented MP4 (see compress_video)
+    telemetry: optional telemetry.JobTelemetry; the search is timed as the 'search' phase
+    Returns: (success, chosen settings dict or None)
+    """
+    with telemetry_phase(telemetry, 'search'):
+        choice = find_quality_settings(input_path, target, metric, heights,
+                                       stop_event=stop_event, status_callback=status_callback)
+    if not choice:
+        return False, None
+    if status_callback and choice['searched']:
+        status_callback(f"Chose {choice['height']}p CRF {choice['crf']} "
+                        f"({metric.upper()} {choice['score']:.3f}, target {choice['target']})")
+    success = compress_video(input_path, output_path, choice['height'], total_duration=total_duration,
+                             progress_callback=progress_callback, stop_event=stop_event,
+                             threads=threads, crf=choice['crf'], fragmented=fragmented, telemetry=telemetry)
+    return success, choice
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from governor import estimate_job
+from compressor import (get_video_info, collect_inputs, plan_streams, format_eta, EncodeProgress,
+                        VIDEO_EXTENSIONS)
+
+# Probes are one short ffmpeg run each, mostly waiting on the disk, so many can run per core
+DEFAULT_SCAN_WORKERS = 8
+# A remux (plan_streams 'copy') reads and writes the file but decodes nothing; count it as
+# this share of a full encode of the same video
+REMUX_COST_FACTOR = 0.02
+
+def find_videos(sources, manifests=(), recursive=True):
+    """collect_inputs, but directories are walked recursively (in sorted order) unless recursive=False."""
+    if not recursive:
+        return collect_inputs(sources, manifests)
+    expanded = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                expanded.extend(os.path.join(root, name) for name in sorted(files)
+                                if name.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            expanded.append(source)
+    return collect_inputs(expanded, manifests)
+
+def probe_entry(path):
+    """
+    Manifest entry for one file: path, size, width, height, duration, fps, video_codec, audio_codec.
+    Returns None if the file can't be read as a video.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    info = get_video_info(path)
+    if not info or not info.get('height'):
+        return None
+    entry = {'path': os.path.abspath(path), 'size': size}
+    for key in ('width', 'height', 'duration', 'fps', 'video_codec', 'audio_codec'):
+        entry[key] = info.get(key)
+    # Kept so a batch run can plan streams and size threads without probing again
+    entry['info'] = info
+    return entry
+
+def scan_library(sources, manifests=(), recursive=True, workers=DEFAULT_SCAN_WORKERS, progress_callback=None):
+    """
+    Find every video under `sources` and probe them in parallel.
+    progress_callback: optional callable(scanned, total)
+    Returns: (entries in input order, paths that could not be probed)
+    """
+    paths = find_videos(sources, manifests, recursive)
+    entries = [None] * len(paths)
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(probe_entry, path): i for i, path in enumerate(paths)}
+        for future in as_completed(futures):
+            entries[futures[future]] = future.result()
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(paths))
+    failed = [path for path, entry in zip(paths, entries) if entry is None]
+    return [entry for entry in entries if entry], failed
+
+def job_cost(entry, target_height=None, fast_path=True):
+    """
+    Estimated cost of compressing one manifest entry, in the governor's weighted pixels (frames
+    times decoded and encoded pixels, see governor.estimate_job). Only comparable between jobs.
+    """
+    info = entry.get('info') or entry
+    work = estimate_job(info, target_height)['work']
+    if plan_streams(info, target_height, entry.get('path', 'out.mp4'), fast_path)['video'] == 'copy':
+        return work * REMUX_COST_FACTOR
+    return work
+
+def summarize(entries):
+    """Totals of a scan: files, bytes, seconds of video and counts per codec and height."""
+    return {
+        'files': len(entries),
+        'bytes': sum(e['size'] for e in entries),
+        'duration': sum(e.get('duration') or 0 for e in entries),
+        'codecs': dict(Counter(e.get('video_codec') or 'unknown' for e in entries).most_common()),
+        'heights': dict(Counter(e.get('height') for e in entries).most_common()),
+    }
+
+def write_manifest(entries, path):
+    """
+    Write entries as JSON lines. `python -m compressor batch -m` accepts the file like a plain
+    list of paths, and read_manifest gives the entries back without probing again.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    os.replace(tmp_path, path)
+
+def read_manifest(path):
+    """Entries of a write_manifest file (lines that aren't JSON objects with a path are skipped)."""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and entry.get('path'):
+                    entries.append(entry)
+    return entries
+
+class BatchProgress:
+    """
+    Progress of a whole batch, weighted by each job's cost instead of counting files, so one 4K
+    hour doesn't count the same as a 480p clip.
+        progress = BatchProgress({path: job_cost(entry, 720) for ...})
+        progress.update(path, 0.5)      # from each job's progress callback
+        progress.finish(path, success)
+        overall = progress.snapshot()   # EncodeProgress with the ETA
+    The ETA divides the remaining cost by the rate measured so far (cost done per second since
+    the first job started, all parallel jobs together), so it calibrates itself from the actual
+    encode speed as work completes. Finished jobs weigh in fully, running ones by their progress.
+    """
+
+    def __init__(self, costs, listener=None):
+        """listener: optional callable(snapshot()) called after every update and finish."""
+        self.costs = dict(costs)
+        self.listener = listener
+        self.total_cost = sum(self.costs.values())
+        self.fractions = {key: 0.0 for key in self.costs}
+        self.finished = {}
+        self.started_at = None
+        self._lock = threading.Lock()
+
+    def update(self, key, fraction):
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+            if key not in self.finished:
+                self.fractions[key] = max(self.fractions.get(key, 0.0), min(1.0, float(fraction)))
+        if self.listener:
+            self.listener(self.snapshot())
+
+    def finish(self, key, success=True):
+        """A failed job's remaining cost is dropped: nothing is left to do for it."""
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = time.monotonic()
+            self.finished[key] = bool(success)
+            if not success:
+                spent = self.costs.get(key, 0.0) * self.fractions.get(key, 0.0)
+                self.total_cost -= self.costs.get(key, 0.0) - spent
+                self.costs[key] = spent
+            self.fractions[key] = 1.0
+        if self.listener:
+            self.listener(self.snapshot())
+
+    def snapshot(self):
+        """
+        Overall EncodeProgress: the cost-weighted fraction done, eta in seconds (None until some
+        work was measured) and `speed` as cost units per second.
+        """
+        with self._lock:
+            done = sum(self.costs[key] * self.fractions.get(key, 0.0) for key in self.costs)
+            fraction = done / self.total_cost if self.total_cost > 0 else 1.0
+            elapsed = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+            rate = done / elapsed if elapsed > 0 and done > 0 else 0.0
+            eta = (self.total_cost - done) / rate if rate > 0 else None
+            return EncodeProgress(min(1.0, fraction), speed=rate, eta=eta,
+                                  done=len(self.finished) == len(self.costs))
+
+def _print_progress(scanned, total):
+    print(f"\rScanning: {scanned}/{total} files   ", end="", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python scanner.py",
+                                     description="Probe a video library in parallel and write a manifest.")
+    parser.add_argument('sources', nargs='*', help="Video files, directories (walked recursively) or glob patterns.")
+    parser.add_argument('-m', '--manifest', action='append', default=[], help="Text file listing one input path per line.")
+    parser.add_argument('-o', '--output', help="Write the manifest here as JSON lines (usable with 'batch -m').")
+    parser.add_argument('--no-recursive', action='store_true', help="Only look at the top level of each directory.")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_SCAN_WORKERS, help=f"Probes at once (default: {DEFAULT_SCAN_WORKERS}).")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    entries, failed = scan_library(args.sources, args.manifest, not args.no_recursive, args.jobs, _print_progress)
+    print()
+    for path in failed:
+        print(f"[SKIP] {path}: not a readable video")
+    summary = summarize(entries)
+    print(f"Scanned {summary['files']} video(s) in {time.monotonic() - start:.1f}s: "
+          f"{summary['bytes'] / 1e9:.2f} GB, {format_eta(summary['duration'])} of video")
+    print("Codecs: " + ", ".join(f"{codec} {count}" for codec, count in summary['codecs'].items()))
+    print("Heights: " + ", ".join(f"{h}p {count}" for h, count in summary['heights'].items()))
+    if args.output:
+        write_manifest(entries, args.output)
+        print(f"Manifest written to {args.output}")
+    return 0 if entries else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
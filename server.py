@@ -0,0 +1,501 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+import threading
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from governor import get_governor
+from telemetry import JobTelemetry, record_job
+from compressor import (get_video_info, compress_video, batch_output_path, default_job_count, resolution_height,
+                        job_threads, ALL_RESOLUTIONS, SPEED_TIERS)
+from jobqueue import partial_output_path
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Jobs allowed to wait for a worker, per worker; past that, submissions are turned away
+DEFAULT_QUEUE_PER_WORKER = 4
+# Suggested wait (Retry-After) for a turned-away client when no running job has an ETA yet
+DEFAULT_RETRY_AFTER = 30
+# Event streams send a comment this often, so clients and proxies notice a dead connection
+KEEPALIVE_SECONDS = 15.0
+# Finished jobs stay listed until this many newer ones finished
+FINISHED_JOBS_KEPT = 200
+MAX_REQUEST_BYTES = 64 * 1024
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+class OutputExists(ValueError):
+    """The job's output file already exists and the request didn't ask to overwrite it."""
+
+class ServiceBusy(RuntimeError):
+    """Every worker is busy and the wait list is full. `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"The service is at capacity, try again in {retry_after}s")
+
+def resolve_output_path(path, output_dir):
+    """
+    Where a client-named output goes: `path` relative to output_dir, with symlinks resolved.
+    Raises ValueError for absolute paths and paths that lead outside output_dir, so clients can
+    only write where the service was told to put outputs.
+    """
+    if not output_dir:
+        raise ValueError("The service has no output directory, so it can't write outputs")
+    if os.path.isabs(path) or os.path.splitdrive(path)[0]:
+        raise ValueError("output must be a path relative to the output directory")
+    root = os.path.realpath(output_dir)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if full_path == root or os.path.commonpath([root, full_path]) != root:
+        raise ValueError("output must stay inside the output directory")
+    return full_path
+
+def parse_job_request(body, output_dir=None):
+    """
+    Validate a submitted job (decoded JSON) and turn it into compress_video settings.
+    Fields: input (required), output (a path inside output_dir; default: named after the input
+    there), overwrite (replace an existing output, default false), resolution ('720p') or
+    height, crf, preset, tier, fast_path.
+    Returns dict with input, output, overwrite, height and settings. Raises ValueError with a
+    message for the client (OutputExists if the output is already there).
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object")
+    input_path = body.get('input')
+    if not isinstance(input_path, str) or not os.path.isfile(input_path):
+        raise ValueError(f"Input file not found: {input_path}")
+
+    if body.get('height') is not None:
+        height = body['height']
+        if not isinstance(height, int) or isinstance(height, bool) or height <= 0:
+            raise ValueError("height must be a positive integer")
+        res_tag = f"{height}p"
+    elif body.get('resolution'):
+        height = resolution_height(body['resolution'])
+        if height is None:
+            raise ValueError(f"Unknown resolution '{body['resolution']}'. Choose from: {', '.join(ALL_RESOLUTIONS)}")
+        res_tag = body['resolution']
+    else:
+        raise ValueError("Give a resolution (e.g. '720p') or a height")
+
+    output_path = body.get('output')
+    if output_path is None:
+        if not output_dir:
+            raise ValueError("The service has no output directory, so it can't write outputs")
+        output_path = os.path.basename(batch_output_path(input_path, output_dir, res_tag))
+    elif not isinstance(output_path, str) or not output_path:
+        raise ValueError("output must be a path")
+    output_path = resolve_output_path(output_path, output_dir)
+    overwrite = body.get('overwrite', False)
+    if not isinstance(overwrite, bool):
+        raise ValueError("overwrite must be true or false")
+    if not overwrite and os.path.exists(output_path):
+        raise OutputExists(f"{output_path} already exists; send \"overwrite\": true to replace it")
+
+    settings = {'crf': body.get('crf', 23), 'preset': body.get('preset', 'medium'),
+                'tier': body.get('tier'), 'fast_path': body.get('fast_path', True)}
+    if not isinstance(settings['crf'], int) or isinstance(settings['crf'], bool) or not 0 <= settings['crf'] <= 51:
+        raise ValueError("crf must be an integer from 0 to 51")
+    if settings['preset'] not in X264_PRESETS:
+        raise ValueError(f"Unknown preset '{settings['preset']}'. Choose from: {', '.join(X264_PRESETS)}")
+    if settings['tier'] is not None and settings['tier'] not in SPEED_TIERS:
+        raise ValueError(f"Unknown speed tier '{settings['tier']}'. Choose from: {', '.join(SPEED_TIERS)}")
+    if not isinstance(settings['fast_path'], bool):
+        raise ValueError("fast_path must be true or false")
+    return {'input': os.path.abspath(input_path), 'output': output_path, 'overwrite': overwrite,
+            'height': height, 'settings': settings}
+
+class JobService:
+    """
+    Compression jobs submitted over HTTP (see make_server), run by a fixed pool of worker threads.
+    At most `workers` jobs encode at once and at most `max_queued` more wait; past that, submit()
+    raises ServiceBusy instead of piling more encodes onto a saturated machine.
+    Without a fixed thread count the resource governor sizes each job's ffmpeg threads, so the
+    running jobs share the cores instead of each sizing itself for all of them. A job a worker
+    has picked up stays 'queued' until the governor lets it start, and counts as waiting.
+    Outputs are only written inside output_dir.
+    Jobs live in memory: they are for watching and cancelling encodes, not a durable queue (see
+    jobqueue.py for that).
+    """
+
+    def __init__(self, workers=0, max_queued=None, threads_per_job=None, output_dir=None):
+        self.workers = workers or (get_governor().cores if threads_per_job is None else default_job_count(threads_per_job))
+        self.max_queued = self.workers * DEFAULT_QUEUE_PER_WORKER if max_queued is None else max_queued
+        self.threads_per_job = threads_per_job
+        self.output_dir = os.path.abspath(output_dir) if output_dir else None
+        self.jobs = OrderedDict()
+        self.running = 0 # Jobs encoding
+        self.starting = 0 # Jobs a worker holds while they wait for the governor
+        self._waiting = deque()
+        self._stop_events = {}
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = []
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def close(self, timeout=None):
+        """Stop taking jobs, cancel the running ones and wait for the workers to finish."""
+        with self._cond:
+            self._closed = True
+            while self._waiting:
+                self._finish(self.jobs[self._waiting.popleft()], 'cancelled')
+            for event in self._stop_events.values():
+                event.set()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def status(self):
+        """Load summary for /health: worker and queue use, and whether a submission would be accepted."""
+        with self._cond:
+            return {'workers': self.workers, 'running': self.running, 'queued': len(self._waiting) + self.starting,
+                    'max_queued': self.max_queued, 'accepting': self._has_room()}
+
+    def _has_room(self):
+        # Every job that isn't encoding yet counts as waiting; an idle worker takes one more
+        idle_workers = self.workers - self.running - self.starting
+        return not self._closed and len(self._waiting) + self.starting < self.max_queued + idle_workers
+
+    def _retry_after(self):
+        etas = [job['eta'] for job in self.jobs.values() if job['status'] == 'running' and job['eta']]
+        return max(1, int(min(etas))) if etas else DEFAULT_RETRY_AFTER
+
+    def submit(self, request):
+        """Queue a parse_job_request result. Returns the job dict; raises ServiceBusy when full."""
+        with self._cond:
+            if not self._has_room():
+                raise ServiceBusy(self._retry_after())
+            job_id = next(self._ids)
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'input': request['input'],
+                'output': request['output'],
+                'overwrite': request.get('overwrite', False),
+                'height': request['height'],
+                'settings': request['settings'],
+                'progress': 0.0,
+                'fps': 0.0,
+                'speed': 0.0,
+                'eta': None,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                # Bumped on every change, so event streams know when to send
+                'revision': 0,
+            }
+            self._stop_events[job_id] = threading.Event()
+            self._waiting.append(job_id)
+            self._cond.notify_all()
+            return dict(self.jobs[job_id])
+
+    def get(self, job_id):
+        with self._cond:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self):
+        with self._cond:
+            return [dict(job) for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        """
+        Cancel a job: a waiting one is dropped at once, one a worker holds (starting or running)
+        is stopped. Returns the job dict (None if unknown); finished jobs are returned unchanged.
+        """
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job_id in self._waiting:
+                self._waiting.remove(job_id)
+                self._finish(job, 'cancelled')
+            elif job['status'] not in FINISHED_STATUSES:
+                self._stop_events[job_id].set()
+            return dict(job)
+
+    def wait_for_change(self, job_id, revision, timeout):
+        """Block until the job's revision passes `revision` (or timeout). Returns the job dict, or None if unknown."""
+        with self._cond:
+            self._cond.wait_for(lambda: job_id not in self.jobs or self.jobs[job_id]['revision'] > revision,
+                                timeout)
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job, **fields):
+        # Callers hold self._cond
+        job.update(fields)
+        job['revision'] += 1
+        self._cond.notify_all()
+
+    def _finish(self, job, status, error=None):
+        self._update(job, status=status, error=error, eta=0.0 if status == 'done' else None,
+                     finished_at=time.time())
+        self._stop_events.pop(job['id'], None)
+        finished = [i for i, j in self.jobs.items() if j['status'] in FINISHED_STATUSES]
+        for old_id in finished[:-FINISHED_JOBS_KEPT]:
+            del self.jobs[old_id]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._waiting or self._closed)
+                if self._closed:
+                    return
+                job = self.jobs[self._waiting.popleft()]
+                stop_event = self._stop_events[job['id']]
+                self.starting += 1
+                competing = self.running + self.starting
+            try:
+                status, error = self._run(job, stop_event, competing)
+            finally:
+                with self._cond:
+                    if job['started_at'] is None:
+                        self.starting -= 1
+                    else:
+                        self.running -= 1
+            with self._cond:
+                self._finish(job, status, error)
+
+    def _started(self, job):
+        # The governor granted the job its threads: it is encoding now
+        with self._cond:
+            self.starting -= 1
+            self.running += 1
+            self._update(job, status='running', started_at=time.time())
+
+    def _progress(self, job):
+        def callback(progress):
+            with self._cond:
+                self._update(job, progress=round(float(progress), 4), fps=round(progress.fps, 1),
+                             speed=round(progress.speed, 3),
+                             eta=round(progress.eta, 1) if progress.eta is not None else None)
+        return callback
+
+    def _run(self, job, stop_event, competing):
+        """Encode one job to a partial file and rename it when done. Returns (status, error)."""
+        input_path, output_path = job['input'], job['output']
+        part_path = partial_output_path(output_path)
+        settings = job['settings']
+        telemetry = JobTelemetry('server', input_path, output_path, job_id=job['id'], height=job['height'],
+                                 **settings)
+        success = False
+        error = None
+        try:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            with telemetry.phase('probe'):
+                info = get_video_info(input_path)
+            if not info:
+                error = "Not a readable video"
+            else:
+                with job_threads(self.threads_per_job, info, job['height'], stop_event, competing,
+                                 telemetry) as threads:
+                    if threads is not None:
+                        self._started(job)
+                        success = compress_video(input_path, part_path, job['height'],
+                                                 total_duration=info.get('duration', 0),
+                                                 progress_callback=self._progress(job), stop_event=stop_event,
+                                                 threads=threads, fast_path=settings['fast_path'],
+                                                 source_info=info, crf=settings['crf'], preset=settings['preset'],
+                                                 telemetry=telemetry, tier=settings['tier'])
+                if success and not job['overwrite'] and os.path.exists(output_path):
+                    # Written by someone else (or another job) since the job was accepted
+                    success = False
+                    error = f"{output_path} already exists"
+                elif success:
+                    with telemetry.phase('save'):
+                        os.replace(part_path, output_path)
+                elif not stop_event.is_set():
+                    error = "Compression failed, see the service log"
+        except Exception as e:
+            print(f"Error in service job {job['id']} ({input_path}): {e}")
+            success = False
+            error = str(e)
+
+        if not success and os.path.exists(part_path):
+            os.remove(part_path)
+        if stop_event.is_set() and not success:
+            return 'cancelled', None
+        record_job(telemetry.finish(success))
+        return ('done', None) if success else ('failed', error)
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "VideoCompressor/1.0"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, headers=()):
+        self._send_json(status, {'error': message}, headers)
+
+    def _route(self):
+        """(path parts, query) for /jobs/<id>/... style paths; a bad job id comes back as None."""
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            parts[1] = int(parts[1]) if parts[1].isdigit() else None
+        return parts, parse_qs(url.query)
+
+    def do_GET(self):
+        service = self.server.service
+        parts, query = self._route()
+        if parts == ['health']:
+            return self._send_json(200, service.status())
+        if parts == ['jobs']:
+            return self._send_json(200, {'jobs': service.list_jobs()})
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = service.get(parts[1])
+            if job is None:
+                return self._error(404, "No such job")
+            if len(parts) == 2:
+                return self._send_json(200, job)
+            if parts[2] == 'events':
+                return self._stream(job, query.get('format', ['sse'])[0])
+        self._error(404, "Not found")
+
+    def do_POST(self):
+        service = self.server.service
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            return self._error(404, "Not found")
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            return self._error(413, "Request too large")
+        try:
+            request = parse_job_request(json.loads(self.rfile.read(length) or b"null"), service.output_dir)
+        except OutputExists as e:
+            return self._error(409, str(e))
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            return self._error(400, str(e))
+        try:
+            job = service.submit(request)
+        except ServiceBusy as e:
+            return self._error(503, str(e), [('Retry-After', str(e.retry_after))])
+        self._send_json(202, job, [('Location', f"/jobs/{job['id']}")])
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._error(404, "Not found")
+        job = self.server.service.cancel(parts[1])
+        if job is None:
+            return self._error(404, "No such job")
+        self._send_json(200, job)
+
+    def _stream(self, job, fmt):
+        """
+        Send the job's state now and after every change until it finishes, then close.
+        format=sse (default): Server-Sent Events, 'progress' events and a final 'end' event
+        format=ndjson: one JSON object per line
+        """
+        if fmt not in ('sse', 'ndjson'):
+            return self._error(400, "format must be sse or ndjson")
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        service = self.server.service
+        try:
+            while True:
+                finished = job['status'] in FINISHED_STATUSES
+                if fmt == 'sse':
+                    event = 'end' if finished else 'progress'
+                    self.wfile.write(f"event: {event}\nid: {job['revision']}\ndata: {json.dumps(job)}\n\n".encode('utf-8'))
+                else:
+                    self.wfile.write((json.dumps(job) + "\n").encode('utf-8'))
+                self.wfile.flush()
+                if finished:
+                    return
+                revision = job['revision']
+                while True:
+                    job = service.wait_for_change(job['id'], revision, KEEPALIVE_SECONDS)
+                    if job is None:
+                        return
+                    if job['revision'] > revision:
+                        break
+                    if fmt == 'sse':
+                        self.wfile.write(b": keep-alive\n\n")
+                        self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the job carries on
+            pass
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, quiet=False):
+    """
+    HTTP front end for a JobService (port 0 picks a free port, see server.server_address):
+        GET    /health             load and admission state
+        GET    /jobs               every job
+        POST   /jobs               submit {"input", "resolution" | "height", "output"?, "overwrite"?,
+                                   "crf"?, "preset"?, "tier"?, "fast_path"?}: 202, 400, 409 (output
+                                   exists), or 503 with Retry-After
+        GET    /jobs/<id>          one job
+        GET    /jobs/<id>/events   progress stream (?format=sse or ndjson) until the job finishes
+        DELETE /jobs/<id>          cancel
+    There is no authentication: keep it on localhost unless the network is trusted.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    server.quiet = quiet
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python server.py",
+                                     description="Share one machine's encoders through a local HTTP job service.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}).")
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory for outputs; clients can't write anywhere else.")
+    parser.add_argument('-j', '--jobs', type=int, default=0, help="Jobs that encode at once (default: as many as cores and memory allow).")
+    parser.add_argument('--max-queued', type=int, default=None, help=f"Jobs that may wait for a worker before new ones are refused (default: {DEFAULT_QUEUE_PER_WORKER} per worker).")
+    parser.add_argument('-t', '--threads', type=int, default=None, help="Fixed threads per ffmpeg job, 0 = unlimited (default: sized per job).")
+    parser.add_argument('--quiet', action='store_true', help="Don't log every request.")
+    args = parser.parse_args(argv)
+
+    service = JobService(args.jobs, args.max_queued, args.threads, args.output_dir).start()
+    server = make_server(service, args.host, args.port, args.quiet)
+    if args.host not in ('127.0.0.1', 'localhost', '::1'):
+        print(f"Warning: listening on {args.host} without authentication")
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]} "
+          f"with {service.workers} worker(s), up to {service.max_queued} queued job(s)")
+    # Service managers stop daemons with SIGTERM; treat it like Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping, cancelling running jobs...")
+        server.server_close()
+        service.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
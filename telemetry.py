@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+from cache import get_data_dir
+
+# JSONL files are rotated to .1 once they reach this size, so at most twice this is kept
+JSONL_ROTATE_BYTES = 10 * 1024 * 1024
+# Instantaneous fps is measured over progress reports at least this far apart
+FPS_WINDOW_SECONDS = 1.0
+METRIC_PREFIX = "video_compressor"
+
+def telemetry_enabled():
+    """Telemetry is on unless VIDEO_COMPRESSOR_TELEMETRY is set to 0."""
+    return os.environ.get("VIDEO_COMPRESSOR_TELEMETRY", "1").strip().lower() not in ("0", "false", "no", "off")
+
+def get_telemetry_dir():
+    """Where jobs.jsonl and metrics.prom are written (a 'telemetry' folder in the data directory)."""
+    return get_data_dir("telemetry")
+
+class JobTelemetry:
+    """
+    Metrics of one job, filled in as it runs:
+        with telemetry.phase('probe'):
+            info = get_video_info(path)
+        compress_video(path, out, 720, source_info=info, telemetry=telemetry)
+        record_job(telemetry.finish(success))
+    compress_video and friends time their own 'probe' and 'encode' phases, collect ffmpeg's CPU
+    time and peak memory into `usage` and feed their progress reports to observe().
+    """
+
+    def __init__(self, job, input_path, output_path=None, **settings):
+        self.job = job
+        self.input_path = input_path
+        self.output_path = output_path
+        self.settings = settings
+        self.started_at = time.time()
+        self.phases = {}
+        self.usage = {}
+        self.cached = False
+        self.output_video = None # compress_video's compressor.describe_output, what predictor.py learns from
+        self.frames = 0
+        self.media_seconds = 0.0
+        self.fps_last = 0.0
+        self.fps_peak = 0.0
+        self._start = time.monotonic()
+        self._fps_mark = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the wall time spent inside the block to phase `name` (phases may repeat)."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - start
+
+    def add_usage(self, usage):
+        """Merge a run_ffmpeg usage dict (CPU seconds add up, peak memory is the maximum)."""
+        with self._lock:
+            for key in ('cpu_user', 'cpu_sys'):
+                self.usage[key] = self.usage.get(key, 0.0) + usage.get(key, 0.0)
+            self.usage['peak_rss_kb'] = max(self.usage.get('peak_rss_kb', 0), usage.get('peak_rss_kb', 0))
+
+    def observe(self, progress):
+        """Take in an EncodeProgress: frame count, media time and instantaneous fps."""
+        now = time.monotonic()
+        with self._lock:
+            self.frames = max(self.frames, progress.frame)
+            self.media_seconds = max(self.media_seconds, progress.out_time)
+            # A new pass starts counting frames from zero again
+            if self._fps_mark is None or progress.frame < self._fps_mark[1]:
+                self._fps_mark = (now, progress.frame)
+            elif now - self._fps_mark[0] >= FPS_WINDOW_SECONDS:
+                self.fps_last = (progress.frame - self._fps_mark[1]) / (now - self._fps_mark[0])
+                self.fps_peak = max(self.fps_peak, self.fps_last)
+                self._fps_mark = (now, progress.frame)
+
+    def track(self, progress_callback=None):
+        """Progress callback that observes each report and then passes it on to progress_callback."""
+        def callback(progress):
+            self.observe(progress)
+            if progress_callback:
+                progress_callback(progress)
+        return callback
+
+    def finish(self, success, output_path=None):
+        """The job's record as a dict, ready for record_job."""
+        output_path = output_path or self.output_path
+        wall = time.monotonic() - self._start
+        encode_seconds = self.phases.get('encode', 0.0)
+        input_bytes = _file_size(self.input_path)
+        output_bytes = _file_size(output_path) if success else 0
+        cpu_user = self.usage.get('cpu_user')
+        cpu_sys = self.usage.get('cpu_sys')
+        return {
+            'job': self.job,
+            'input': self.input_path,
+            'output': output_path,
+            'settings': self.settings,
+            'success': bool(success),
+            'cached': self.cached,
+            'started_at': self.started_at,
+            'wall_seconds': round(wall, 3),
+            'cpu_user_seconds': round(cpu_user, 3) if cpu_user is not None else None,
+            'cpu_sys_seconds': round(cpu_sys, 3) if cpu_sys is not None else None,
+            'peak_rss_bytes': self.usage['peak_rss_kb'] * 1024 if self.usage.get('peak_rss_kb') else None,
+            'frames': self.frames,
+            'media_seconds': round(self.media_seconds, 3),
+            'fps_avg': round(self.frames / encode_seconds, 2) if encode_seconds > 0 else 0.0,
+            'fps_last': round(self.fps_last, 2),
+            'fps_peak': round(self.fps_peak, 2),
+            'speed': round(self.media_seconds / encode_seconds, 3) if encode_seconds > 0 else 0.0,
+            'input_bytes': input_bytes,
+            'output_bytes': output_bytes,
+            'compression_ratio': round(input_bytes / output_bytes, 3) if output_bytes else None,
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'output_video': self.output_video,
+        }
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+_record_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _locked_file(path):
+    # Several processes (GUI, queue runner, watcher) may record at once; serialize them on a lock file
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def append_jsonl(path, record):
+    """Append one JSON line, rotating the file to path + '.1' once it passes JSONL_ROTATE_BYTES."""
+    try:
+        if os.path.getsize(path) >= JSONL_ROTATE_BYTES:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + "\n")
+
+def _label_string(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}" if labels else ""
+
+# name -> (type, help); counters are kept across runs in totals.json, gauges describe the last job
+METRICS = {
+    'jobs_total': ('counter', "Finished jobs by job type and outcome."),
+    'wall_seconds_total': ('counter', "Wall time of finished jobs."),
+    'phase_seconds_total': ('counter', "Wall time per job phase (probe, encode, thumbnail, save...)."),
+    'cpu_seconds_total': ('counter', "CPU time of ffmpeg child processes."),
+    'input_bytes_total': ('counter', "Bytes read from inputs of successful jobs."),
+    'output_bytes_total': ('counter', "Bytes written to outputs of successful jobs."),
+    'media_seconds_total': ('counter', "Seconds of video encoded."),
+    'frames_total': ('counter', "Frames encoded."),
+    'last_job_fps': ('gauge', "Average encode fps of the last successful job."),
+    'last_job_speed': ('gauge', "Realtime speed factor of the last successful job."),
+    'last_job_peak_rss_bytes': ('gauge', "Peak ffmpeg memory of the last successful job."),
+    'last_job_compression_ratio': ('gauge', "Input bytes / output bytes of the last successful job."),
+    'last_job_timestamp_seconds': ('gauge', "Unix time the last job finished."),
+}
+
+def update_totals(totals, record):
+    """Fold one job record into the persistent metric totals ({metric: {label string: value}})."""
+    def add(name, value, **labels):
+        if value:
+            series = totals.setdefault(name, {})
+            key = _label_string(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(name, value):
+        if value is not None:
+            totals[name] = {"": value}
+
+    if 'phase' in record:
+        # A standalone step (see record_phase), not a job
+        add('phase_seconds_total', record['seconds'], phase=record['phase'])
+        return totals
+    status = 'ok' if record['success'] else 'failed'
+    add('jobs_total', 1, job=record['job'], status=status)
+    add('wall_seconds_total', record['wall_seconds'], job=record['job'])
+    for phase, seconds in record.get('phases', {}).items():
+        add('phase_seconds_total', seconds, phase=phase)
+    add('cpu_seconds_total', record.get('cpu_user_seconds'), mode='user')
+    add('cpu_seconds_total', record.get('cpu_sys_seconds'), mode='system')
+    add('frames_total', record.get('frames'))
+    add('media_seconds_total', record.get('media_seconds'))
+    if record['success']:
+        add('input_bytes_total', record.get('input_bytes'))
+        add('output_bytes_total', record.get('output_bytes'))
+        if not record.get('cached'):
+            set_gauge('last_job_fps', record.get('fps_avg'))
+            set_gauge('last_job_speed', record.get('speed'))
+            set_gauge('last_job_peak_rss_bytes', record.get('peak_rss_bytes'))
+        set_gauge('last_job_compression_ratio', record.get('compression_ratio'))
+    set_gauge('last_job_timestamp_seconds', round(time.time(), 3))
+    return totals
+
+def format_prometheus(totals):
+    """Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = totals.get(name)
+        if not series:
+            continue
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{full_name}{labels} {round(value, 6) if isinstance(value, float) else value}")
+    return "\n".join(lines) + "\n"
+
+def record_job(record, directory=None):
+    """
+    Append a finished job's record to jobs.jsonl and refresh metrics.prom with the running totals.
+    Never raises: losing a metric must not fail the job. Returns the record.
+    """
+    if record is None or not telemetry_enabled():
+        return record
+    try:
+        directory = directory or get_telemetry_dir()
+        with _record_lock, _locked_file(os.path.join(directory, ".lock")):
+            append_jsonl(os.path.join(directory, "jobs.jsonl"), record)
+
+            totals_path = os.path.join(directory, "totals.json")
+            try:
+                with open(totals_path, 'r', encoding='utf-8') as f:
+                    totals = json.load(f)
+            except (OSError, ValueError):
+                totals = {}
+            update_totals(totals, record)
+            for path, text in ((totals_path, json.dumps(totals)),
+                               (os.path.join(directory, "metrics.prom"), format_prometheus(totals))):
+                # Written to a temp file and renamed, so a scraper never reads half a file
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: could not record telemetry: {e}")
+    return record
+
+def record_phase(job, phase, seconds, directory=None, **details):
+    """Record a step that happens outside a job, e.g. the GUI saving a result long after its encode."""
+    return record_job(dict(details, job=job, phase=phase, seconds=round(seconds, 3), recorded_at=time.time()),
+                      directory)
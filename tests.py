@@ -1,12 +1,64 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import os
+import io
+import json
+import sys
+import subprocess
+import tempfile
+import contextlib
+import importlib.util
+
+# Keep on-disk caches out of the user's profile while testing
+os.environ["VIDEO_COMPRESSOR_CACHE_DIR"] = tempfile.mkdtemp(prefix="vc_test_cache_")
+os.environ["VIDEO_COMPRESSOR_DATA_DIR"] = tempfile.mkdtemp(prefix="vc_test_data_")
+# Tests that compress the same fake input must not be served from each other's results
+os.environ["VIDEO_COMPRESSOR_OUTPUT_CACHE_MB"] = "0"
 
 # Ensure PIL is patched if needed, but since we moved import, we can patch global PIL.Image or compressor.Image
 from compressor import get_ffmpeg_path, get_video_info, get_thumbnail, parse_time_str, compress_video
+from compressor import collect_inputs, default_job_count, batch_output_path, run_batch
+from compressor import build_ladder_filter, compress_video_ladder, resolution_height
+from compressor import split_at_keyframes, compress_video_segmented
+from compressor import parse_probe_output
+from compressor import default_thumbnail_seek, _thumbnail_memory
+from compressor import preview_timestamps, detect_scene_changes, split_bmp_stream, get_preview_strip
+from compressor import parse_progress_block, format_eta, run_ffmpeg, EncodeProgress
+from compressor import parse_size, compute_target_bitrates, compress_video_target_size
+from compressor import estimate_from_sample, compress_video_sample
+from compressor import plan_streams, build_compress_command
+from compressor import pick_tier, compress_settings, SPEED_TIERS, encode_profile, output_dimensions, ALL_RESOLUTIONS
+import capabilities
+from capabilities import (parse_version, parse_encoders, parse_filters, get_capabilities, pick_encoder,
+                          require_filters, FFmpegCapabilityError)
+from compressor import container_args, save_output, output_cache_key, store_cached_output, get_output_cache
+from quality import pick_sample_ranges, parse_score, find_quality_settings, estimate_search_cost, plan_search
+from quality import DEFAULT_CRF, SEARCH_STEPS, MAX_SEARCH_COST_FRACTION
+import benchmark
+import jobqueue
+from jobqueue import JobQueue, run_job, partial_output_path
+from watcher import FolderWatcher
+import http.client
+import scanner
+from scanner import scan_library, job_cost, write_manifest, read_manifest, BatchProgress
+from server import JobService, make_server, parse_job_request
+import asyncio
+from aiocompressor import run_ffmpeg_async, compress_video_async, wait_for_compression, FFmpegError
+import threading
+import time
+from PIL import Image
+from cache import JsonCache, file_fingerprint, prune_stale_files
+import governor
+from governor import ResourceGovernor, estimate_job, job_memory
+from telemetry import JobTelemetry, record_job, record_phase
+from predictor import history_sample, load_history, predict, predict_resolutions, format_prediction
+
+# OpenCV is an optional fallback (see compressor.opencv_available); its tests need it installed
+HAVE_OPENCV = importlib.util.find_spec('cv2') is not None
 
 class TestCompressor(unittest.TestCase):
 
+    @patch('compressor._ffmpeg_path', None)
     @patch('compressor.imageio_ffmpeg.get_ffmpeg_exe')
     @patch('compressor.os.path.exists')
     def test_get_ffmpeg_path_success(self, mock_exists, mock_get_exe):
@@ -14,7 +66,11 @@ class TestCompressor(unittest.TestCase):
         mock_exists.return_value = True
         path = get_ffmpeg_path()
         self.assertEqual(path, '/path/to/ffmpeg')
+        # Looked up once per process
+        self.assertEqual(get_ffmpeg_path(), '/path/to/ffmpeg')
+        mock_get_exe.assert_called_once()
 
+    @patch('compressor._ffmpeg_path', None)
     @patch('compressor.imageio_ffmpeg.get_ffmpeg_exe')
     @patch('compressor.os.path.exists')
     def test_get_ffmpeg_path_fallback(self, mock_exists, mock_get_exe):
@@ -23,8 +79,10 @@ class TestCompressor(unittest.TestCase):
         path = get_ffmpeg_path()
         self.assertEqual(path, 'ffmpeg')
 
+    @unittest.skipUnless(HAVE_OPENCV, "OpenCV is optional")
+    @patch('compressor.opencv_available', return_value=True)
     @patch('compressor.cv2.VideoCapture')
-    def test_get_video_info_success(self, mock_cap_cls):
+    def test_get_video_info_success(self, mock_cap_cls, mock_available):
         mock_cap = MagicMock()
         mock_cap.isOpened.return_value = True
         mock_cap.get.side_effect = [1920.0, 1080.0, 30.0, 300.0] # Width, Height, FPS, FrameCount
@@ -36,8 +94,10 @@ class TestCompressor(unittest.TestCase):
         self.assertEqual(info['duration'], 10.0) # 300 frames / 30 fps
         mock_cap.release.assert_called_once()
 
+    @unittest.skipUnless(HAVE_OPENCV, "OpenCV is optional")
+    @patch('compressor.opencv_available', return_value=True)
     @patch('compressor.cv2.VideoCapture')
-    def test_get_video_info_fail(self, mock_cap_cls):
+    def test_get_video_info_fail(self, mock_cap_cls, mock_available):
         mock_cap = MagicMock()
         mock_cap.isOpened.return_value = False
         mock_cap_cls.return_value = mock_cap
@@ -46,10 +106,12 @@ class TestCompressor(unittest.TestCase):
         self.assertIsNone(info)
         mock_cap.release.assert_called_once()
 
+    @unittest.skipUnless(HAVE_OPENCV, "OpenCV is optional")
+    @patch('compressor.opencv_available', return_value=True)
     @patch('compressor.cv2.VideoCapture')
     @patch('compressor.Image.fromarray')
     @patch('compressor.cv2.cvtColor') 
-    def test_get_thumbnail_success(self, mock_cvt, mock_fromarray, mock_cap_cls):
+    def test_get_thumbnail_success(self, mock_cvt, mock_fromarray, mock_cap_cls, mock_available):
         mock_cap = MagicMock()
         mock_cap.read.return_value = (True, MagicMock()) # Ret, Frame
         mock_cap_cls.return_value = mock_cap
@@ -68,21 +130,22 @@ class TestCompressor(unittest.TestCase):
         self.assertEqual(parse_time_str("01:01:01.00"), 3661.0)
         self.assertEqual(parse_time_str("invalid"), 0)
 
+    @patch('compressor.get_video_info')
     @patch('compressor.get_ffmpeg_path')
     @patch('compressor.subprocess.Popen')
     @patch('compressor.os.path.exists')
-    def test_compress_video_success(self, mock_exists, mock_popen, mock_get_path):
+    def test_compress_video_success(self, mock_exists, mock_popen, mock_get_path, mock_info):
+        mock_info.return_value = None
         mock_exists.return_value = True
         mock_get_path.return_value = "ffmpeg"
         
         process_mock = MagicMock()
-        # Readline returns data then empty string indefinitely
-        process_mock.stderr.readline.side_effect = [
-            "frame=  1 fps=0.0 q=0.0 size=       0kB time=00:00:05.00 bitrate=N/A speed=   0x",
-            ""
-        ]
-        # Poll: Only called when readline is empty. Return 0 to indicate finish.
-        process_mock.poll.return_value = 0 
+        # ffmpeg -progress output: key=value lines, each block closed by a progress= line
+        process_mock.stdout = iter([
+            "frame=150\n", "fps=48.5\n", "total_size=262144\n", "out_time_us=5000000\n",
+            "speed=2.0x\n", "progress=continue\n",
+        ])
+        process_mock.stderr = iter([])
         process_mock.returncode = 0
         mock_popen.return_value = process_mock
 
@@ -91,6 +154,1803 @@ class TestCompressor(unittest.TestCase):
         
         self.assertTrue(success)
         callback.assert_called() 
+        progress = callback.call_args.args[0]
+        self.assertEqual(progress, 0.5)
+        self.assertEqual(progress.fps, 48.5)
+        self.assertEqual(progress.eta, 2.5)
+        self.assertIn('-progress', mock_popen.call_args.args[0])
+
+class TestBatch(unittest.TestCase):
+
+    def test_collect_inputs_dir_glob_and_manifest(self):
+        with tempfile.TemporaryDirectory() as d:
+            for name in ("a.mp4", "b.MKV", "notes.txt"):
+                open(os.path.join(d, name), 'w').close()
+            manifest = os.path.join(d, "list.txt")
+            with open(manifest, 'w') as f:
+                f.write("# comment\n\n/videos/x.mov\n")
+
+            paths = collect_inputs([d, os.path.join(d, "*.mp4")], [manifest])
+            names = [os.path.basename(p) for p in paths]
+            # Manifest entries first, directory scan filtered by extension, glob duplicate dropped
+            self.assertEqual(names, ["x.mov", "a.mp4", "b.MKV"])
+
+    def test_collect_inputs_skips_bad_manifest_lines(self):
+        with tempfile.TemporaryDirectory() as d:
+            manifest = os.path.join(d, "scan.jsonl")
+            with open(manifest, 'w') as f:
+                f.write('{"path": "/videos/a.mp4", "height": 1080}\n'
+                        '{"files": 2, "total_bytes": 100}\n'
+                        '{"path": "/videos/b.mp4", "cut short\n'
+                        '\n'
+                        '{"path": "/videos/c.mp4"}\n')
+            with patch('sys.stdout', new_callable=io.StringIO) as out:
+                paths = collect_inputs([], [manifest])
+            self.assertEqual(paths, ["/videos/a.mp4", "/videos/c.mp4"])
+            self.assertIn("line 2", out.getvalue())
+            self.assertIn("line 3", out.getvalue())
+
+    @patch('compressor.os.cpu_count')
+    def test_default_job_count(self, mock_cpus):
+        mock_cpus.return_value = 16
+        self.assertEqual(default_job_count(4), 4)
+        self.assertEqual(default_job_count(32), 1)
+        self.assertEqual(default_job_count(0), 1)
+
+    def test_batch_output_path(self):
+        out = batch_output_path("/in/clip.mov", "/out", "2160p (4K)")
+        self.assertEqual(out, os.path.join("/out", "compressed_2160p_clip.mp4"))
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.compress_video')
+    def test_run_batch_continues_after_failure(self, mock_compress, mock_info):
+        mock_info.return_value = {'width': 1920, 'height': 1080, 'duration': 10.0}
+
+        def fake_compress(input_path, output_path, target_height, **kwargs):
+            if "bad" in input_path:
+                return False
+            with open(output_path, 'wb') as f:
+                f.write(b"x" * 10)
+            return True
+        mock_compress.side_effect = fake_compress
+
+        with tempfile.TemporaryDirectory() as d:
+            inputs = []
+            for name in ("good1.mp4", "bad.mp4", "good2.mp4"):
+                path = os.path.join(d, name)
+                with open(path, 'wb') as f:
+                    f.write(b"y" * 100)
+                inputs.append(path)
+
+            reported = []
+            results, summary = run_batch(inputs, os.path.join(d, "out"), 720, jobs=2, threads_per_job=2,
+                                         report=reported.append)
+
+        self.assertEqual([r['success'] for r in results], [True, False, True])
+        self.assertEqual(summary['succeeded'], 2)
+        self.assertEqual(summary['failed'], 1)
+        self.assertEqual(len(reported), 3)
+        self.assertEqual(mock_compress.call_args.kwargs['threads'], 2)
+
+class TestGovernor(unittest.TestCase):
+    INFO_4K = {'width': 3840, 'height': 2160, 'duration': 60, 'fps': 30}
+
+    def test_threads_follow_decode_and_encode_work(self):
+        self.assertEqual(estimate_job(self.INFO_4K)['threads'], governor.MAX_THREADS_PER_JOB)
+        self.assertEqual(estimate_job({'width': 1280, 'height': 720}, 480)['threads'], 2)
+        # Decoding 4K still needs threads when the output is small
+        self.assertEqual(estimate_job(self.INFO_4K, 360)['threads'], 10)
+        self.assertEqual(estimate_job({'width': 854, 'height': 480}, 360)['threads'], 1)
+        # Downscaling makes the job cheaper, but decoding the 4K source still costs
+        self.assertGreater(estimate_job(self.INFO_4K, 360)['work'], estimate_job({'width': 640, 'height': 360,
+                                                                                 'duration': 60, 'fps': 30})['work'])
+
+    def test_fair_share_of_cores(self):
+        gov = ResourceGovernor(cores=16, memory_bytes=64 * 1024 ** 3)
+        cost = estimate_job(self.INFO_4K)
+        self.assertEqual(gov.acquire(cost)['threads'], 16)
+        gov = ResourceGovernor(cores=16, memory_bytes=64 * 1024 ** 3)
+        grants = [gov.acquire(cost, competing=4) for _ in range(4)]
+        self.assertEqual([g['threads'] for g in grants], [4, 4, 4, 4])
+        self.assertEqual(gov.running, 4)
+        # A small job gets only the threads it can use, alone or competing
+        small = estimate_job({'width': 1280, 'height': 720, 'duration': 60, 'fps': 30}, 480)
+        self.assertEqual(ResourceGovernor(cores=16, memory_bytes=64 * 1024 ** 3).acquire(small)['threads'], 2)
+        self.assertEqual(ResourceGovernor(cores=16, memory_bytes=64 * 1024 ** 3).acquire(small, competing=4)['threads'], 2)
+        # ... which leaves the other cores to the next job
+        gov = ResourceGovernor(cores=16, memory_bytes=64 * 1024 ** 3)
+        gov.acquire(small, competing=2)
+        self.assertEqual(gov.acquire(cost)['threads'], 14)
+
+    def test_memory_limits_concurrency(self):
+        cost = estimate_job(self.INFO_4K)
+        # Room for one 4K encode at a time; a second one waits until the first releases
+        gov = ResourceGovernor(cores=8, memory_bytes=int(job_memory(cost, 8) * 1.5))
+        first = gov.acquire(cost, competing=2)
+        # The second job can't run alongside it, so the first gets every core
+        self.assertEqual(first['threads'], 8)
+        granted = []
+        started = threading.Event()
+
+        def second():
+            grant = gov.acquire(cost, competing=2)
+            granted.append(grant['threads'])
+            gov.release(grant)
+            started.set()
+        threading.Thread(target=second, daemon=True).start()
+        self.assertFalse(started.wait(0.3))
+        gov.release(first)
+        self.assertTrue(started.wait(2))
+        self.assertEqual(granted, [8])
+
+        # With room for both they split the cores
+        gov = ResourceGovernor(cores=8, memory_bytes=int(job_memory(cost, 4) * 2.5))
+        self.assertEqual([gov.acquire(cost, competing=2)['threads'] for _ in range(2)], [4, 4])
+
+    def test_stop_while_waiting(self):
+        gov = ResourceGovernor(cores=1, memory_bytes=1024 ** 3)
+        cost = estimate_job({'width': 640, 'height': 360})
+        grant = gov.acquire(cost)
+        stop = threading.Event()
+        stop.set()
+        with gov.job(cost, stop) as threads:
+            self.assertIsNone(threads)
+        gov.release(grant)
+        self.assertEqual(gov.running, 0)
+
+    @patch('compressor.get_video_info', return_value={'width': 3840, 'height': 2160, 'duration': 10, 'fps': 30})
+    @patch('compressor.compress_video', return_value=True)
+    def test_batch_uses_governor(self, mock_compress, mock_info):
+        with patch('compressor.get_governor', return_value=ResourceGovernor(cores=8, memory_bytes=64 * 1024 ** 3)):
+            with tempfile.TemporaryDirectory() as d:
+                inputs = []
+                for name in ("a.mp4", "b.mp4"):
+                    inputs.append(os.path.join(d, name))
+                    with open(inputs[-1], 'wb') as f:
+                        f.write(b"y")
+                run_batch(inputs, os.path.join(d, "out"), 1080)
+        self.assertEqual([c.kwargs['threads'] for c in mock_compress.call_args_list], [4, 4])
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, "in.mp4")
+        self.output = os.path.join(self.tmp.name, "out.mp4")
+        with open(self.input, 'wb') as f:
+            f.write(b"x" * 1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @patch('telemetry.time.monotonic')
+    def test_instantaneous_fps(self, mock_clock):
+        telemetry = JobTelemetry('test', self.input)
+        for now, frame in ((0.0, 0), (0.5, 20), (1.0, 50), (3.0, 110)):
+            mock_clock.return_value = now
+            telemetry.observe(EncodeProgress(0.5, frame=frame))
+        self.assertEqual(telemetry.fps_last, 30.0)
+        self.assertEqual(telemetry.fps_peak, 50.0)
+
+    @patch('compressor.get_output_cache', return_value=None)
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.run_ffmpeg')
+    def test_compress_video_fills_telemetry(self, mock_run, mock_get_path, mock_cache):
+        def fake_run(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+            progress_callback(EncodeProgress(1.0, out_time=10.0, frame=250, done=True))
+            usage.update(cpu_user=4.0, cpu_sys=0.5, peak_rss_kb=2048)
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"y" * 100)
+            return True
+        mock_run.side_effect = fake_run
+
+        telemetry = JobTelemetry('test', self.input, self.output)
+        info = {'width': 1280, 'height': 720, 'duration': 10.0, 'video_codec': 'h264', 'audio_codec': 'aac', 'streams': []}
+        self.assertTrue(compress_video(self.input, self.output, 480, total_duration=10.0, source_info=info,
+                                       telemetry=telemetry))
+        record = telemetry.finish(True)
+        self.assertEqual(record['frames'], 250)
+        self.assertEqual(record['cpu_user_seconds'], 4.0)
+        self.assertEqual(record['peak_rss_bytes'], 2048 * 1024)
+        self.assertEqual(record['compression_ratio'], 10.0)
+        self.assertIn('encode', record['phases'])
+        self.assertGreater(record['fps_avg'], 0)
+        self.assertEqual(record['output_video'], {'width': 854, 'height': 480, 'fps': 0.0, 'mode': 'scale',
+                                                  'encoder': 'libx264', 'profile': 'balanced',
+                                                  'source_width': 1280, 'source_height': 720})
+
+    def test_record_job_writes_jsonl_and_prometheus(self):
+        directory = os.path.join(self.tmp.name, "telemetry")
+        os.makedirs(directory)
+        with open(self.output, 'wb') as f:
+            f.write(b"y" * 100)
+        for _ in range(2):
+            telemetry = JobTelemetry('batch', self.input, self.output)
+            telemetry.usage = {'cpu_user': 1.5, 'cpu_sys': 0.25}
+            telemetry.phases = {'encode': 2.0}
+            telemetry.frames = 60
+            record_job(telemetry.finish(True), directory)
+        record_phase('gui', 'save', 0.5, directory, method='renamed')
+
+        with open(os.path.join(directory, "jobs.jsonl")) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['job'] for line in lines], ['batch', 'batch', 'gui'])
+        self.assertEqual(lines[0]['fps_avg'], 30.0)
+
+        with open(os.path.join(directory, "metrics.prom")) as f:
+            prom = f.read()
+        self.assertIn('video_compressor_jobs_total{job="batch",status="ok"} 2', prom)
+        self.assertIn('video_compressor_cpu_seconds_total{mode="user"} 3.0', prom)
+        self.assertIn('video_compressor_phase_seconds_total{phase="encode"} 4.0', prom)
+        self.assertIn('video_compressor_phase_seconds_total{phase="save"} 0.5', prom)
+        self.assertIn('video_compressor_output_bytes_total 200', prom)
+        self.assertIn('video_compressor_last_job_compression_ratio 10.0', prom)
+        self.assertIn('# TYPE video_compressor_frames_total counter', prom)
+
+    def test_disabled(self):
+        directory = os.path.join(self.tmp.name, "telemetry")
+        os.makedirs(directory)
+        with patch.dict(os.environ, {"VIDEO_COMPRESSOR_TELEMETRY": "0"}):
+            record_job(JobTelemetry('batch', self.input).finish(False), directory)
+        self.assertEqual(os.listdir(directory), [])
+
+class TestPredictor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.info = {'width': 1920, 'height': 1080, 'duration': 100.0, 'fps': 30.0}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, height, output_bytes, encode_seconds, job='gui', profile='balanced', input_path="/v/a.mp4"):
+        width, _ = output_dimensions(self.info, height)
+        return {'job': job, 'input': input_path, 'success': True, 'cached': False, 'frames': 3000,
+                'output_bytes': output_bytes, 'phases': {'encode': encode_seconds},
+                'output_video': {'width': width, 'height': height, 'fps': 30.0, 'mode': 'scale',
+                                 'encoder': 'libx264', 'profile': profile,
+                                 'source_width': 1920, 'source_height': 1080}}
+
+    def test_encode_profile(self):
+        self.assertEqual(encode_profile('small'), 'small')
+        self.assertEqual(encode_profile(None, 23, 'veryfast'), 'fastest')
+        self.assertEqual(encode_profile(None, 20, 'slow'), 'libx264 crf 20 slow')
+        self.assertEqual(output_dimensions(self.info, 720), (1280, 720))
+
+    def test_history_sample(self):
+        sample = history_sample(self.record(720, 36_000_000, 50.0), cores=4)
+        self.assertEqual(sample['pixels'], 1280 * 720)
+        self.assertAlmostEqual(sample['bpp'], 36_000_000 * 8 / (3000 * 1280 * 720))
+        self.assertGreater(sample['rate'], 0)
+        # Batch jobs share the machine: size only
+        self.assertIsNone(history_sample(self.record(720, 1, 50.0, job='batch'))['rate'])
+        for unusable in (dict(self.record(720, 1, 1.0), cached=True), dict(self.record(720, 1, 1.0), success=False),
+                         dict(self.record(720, 1, 1.0), output_video=None)):
+            self.assertIsNone(history_sample(unusable))
+
+    def test_prediction_learns_from_history(self):
+        prior = predict(self.info, 720, 'balanced', history=[], cores=4)
+        self.assertEqual(prior['samples'], 0)
+        # Prior bpp at 720p: 100 s * 30 fps * 1280x720 px * 0.054 bits
+        self.assertAlmostEqual(prior['bytes'], 100 * 30 * 1280 * 720 * 0.054 / 8, delta=1000)
+        self.assertGreater(predict(self.info, 1080, history=[], cores=4)['seconds'], prior['seconds'])
+
+        # This machine turned out twice as slow and its videos twice as large
+        doubled = history_sample(self.record(720, prior['bytes'] * 2, prior['seconds'] * 2), cores=4)
+        learned = predict(self.info, 720, 'balanced', history=[doubled] * 9, cores=4)
+        self.assertAlmostEqual(learned['bytes'] / prior['bytes'], 2 ** 0.9, places=2)
+        self.assertAlmostEqual(learned['seconds'] / prior['seconds'], 2 ** 0.9, places=2)
+        # Other tiers keep their own history
+        self.assertEqual(predict(self.info, 720, 'fastest', history=[doubled], cores=4)['samples'], 0)
+        # Earlier encodes of the same file count for more
+        same = predict(self.info, 720, 'balanced', history=[doubled], input_path="/v/a.mp4", cores=4)
+        other = predict(self.info, 720, 'balanced', history=[doubled], input_path="/v/b.mp4", cores=4)
+        self.assertGreater(same['bytes'], other['bytes'])
+        self.assertIsNone(predict(dict(self.info, duration=0), 720, history=[]))
+
+    def test_load_history_and_menu_labels(self):
+        directory = os.path.join(self.tmp.name, "telemetry")
+        os.makedirs(directory)
+        jobs_path = os.path.join(directory, "jobs.jsonl")
+        with open(jobs_path, 'w') as f:
+            f.write(json.dumps(self.record(480, 5_000_000, 20.0)) + '\n{"cut short\n')
+            f.write(json.dumps(dict(self.record(480, 1, 1.0), cached=True)) + "\n")
+        self.assertEqual(len(load_history(directory)), 1)
+        with open(jobs_path, 'a') as f:
+            f.write(json.dumps(self.record(720, 9_000_000, 30.0)) + "\n")
+        self.assertEqual([s['pixels'] for s in load_history(directory)], [854 * 480, 1280 * 720])
+
+        with patch('predictor.load_history', return_value=load_history(directory)):
+            predictions = predict_resolutions(dict(self.info, height=720, width=1280))
+        self.assertEqual(sorted(predictions, key=ALL_RESOLUTIONS.get), ['144p', '240p', '360p', '480p'])
+        self.assertRegex(format_prediction(predictions['480p']), r"^≈ [\d.]+ MB, ≈ \d+ s$")
+        self.assertEqual(format_prediction({'bytes': 140e6, 'seconds': 185}), "≈ 140 MB, ≈ 3 min")
+
+class TestLadder(unittest.TestCase):
+
+    def test_build_ladder_filter(self):
+        graph, labels = build_ladder_filter([1080, 720, 480])
+        self.assertEqual(labels, ["v0", "v1", "v2"])
+        self.assertEqual(graph, "[0:v]split=3[s0][s1][s2];[s0]scale=-2:1080[v0];[s1]scale=-2:720[v1];[s2]scale=-2:480[v2]")
+
+        graph, labels = build_ladder_filter([720])
+        self.assertEqual(graph, "[0:v]scale=-2:720[v0]")
+
+    def test_resolution_height(self):
+        self.assertEqual(resolution_height("720p"), 720)
+        self.assertEqual(resolution_height("2160p"), 2160)
+        self.assertIsNone(resolution_height("999p"))
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.os.path.exists')
+    @patch('compressor.os.path.getsize')
+    def test_compress_video_ladder_single_invocation(self, mock_size, mock_exists, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        mock_exists.return_value = True
+        mock_size.side_effect = lambda p: 0 if p == "480.mp4" else 100
+        mock_run.return_value = True
+
+        status = compress_video_ladder("in.mp4", {720: "720.mp4", 480: "480.mp4"}, total_duration=10)
+
+        self.assertEqual(status, {720: True, 480: False})
+        mock_run.assert_called_once()
+        cmd = mock_run.call_args.args[0]
+        self.assertEqual(cmd.count('-i'), 1)
+        self.assertIn("720.mp4", cmd)
+        self.assertIn("480.mp4", cmd)
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.run_ffmpeg', return_value=True)
+    @patch('compressor.os.path.exists', return_value=True)
+    def test_compress_video_ladder_plans_streams_per_output(self, mock_exists, mock_run, mock_get_path, mock_info):
+        mock_info.return_value = {'width': 1920, 'height': 1080, 'duration': 10.0, 'video_codec': 'h264',
+                                  'audio_codec': 'opus', 'streams': [
+                                      {'index': 0, 'type': 'video', 'codec': 'h264'},
+                                      {'index': 1, 'type': 'audio', 'codec': 'opus'},
+                                      {'index': 2, 'type': 'subtitle', 'codec': 'hdmv_pgs_subtitle'}]}
+        pipeline = {'video': 'libx264', 'video_args': None, 'audio': 'aac', 'mov_text': True, 'threads': True}
+        with patch('compressor.select_pipeline', return_value=pipeline):
+            compress_video_ladder("in.mkv", {720: "720.mp4", 480: "480.mkv"})
+
+        cmd = mock_run.call_args.args[0]
+        mp4_args = cmd[cmd.index('-filter_complex') + 2:cmd.index("720.mp4")]
+        mkv_args = cmd[cmd.index("720.mp4") + 1:cmd.index("480.mkv")]
+        # MP4 can't take Opus or bitmap subtitles; MKV keeps both as they are
+        self.assertEqual(mp4_args[mp4_args.index('-c:a') + 1], 'aac')
+        self.assertNotIn('0:2', mp4_args)
+        self.assertEqual(mkv_args[mkv_args.index('-c:a') + 1], 'copy')
+        self.assertIn('0:2', mkv_args)
+        self.assertEqual(mkv_args[mkv_args.index('-c:s') + 1], 'copy')
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.os.path.exists')
+    def test_compress_video_ladder_failure(self, mock_exists, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        mock_exists.return_value = True
+        mock_run.return_value = False
+
+        status = compress_video_ladder("in.mp4", {720: "720.mp4", 480: "480.mp4"})
+        self.assertEqual(status, {720: False, 480: False})
+
+class TestSegmented(unittest.TestCase):
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    def test_split_at_keyframes_reads_segment_list(self, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        with tempfile.TemporaryDirectory() as d:
+            def fake_split(cmd, *args, **kwargs):
+                with open(os.path.join(d, "segments.csv"), 'w') as f:
+                    f.write("src_00000.mkv,0.000000,30.030000\nsrc_00001.mkv,30.030000,45.000000\n")
+                return True
+            mock_run.side_effect = fake_split
+
+            segments = split_at_keyframes("in.mp4", d, 30)
+
+        self.assertEqual([os.path.basename(p) for p, _ in segments], ["src_00000.mkv", "src_00001.mkv"])
+        self.assertAlmostEqual(segments[0][1], 30.03)
+        self.assertAlmostEqual(segments[1][1], 14.97)
+        self.assertIn('copy', mock_run.call_args.args[0])
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, "in.mp4")
+        with open(self.input, 'wb') as f:
+            f.write(b"video")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    @staticmethod
+    def fake_ffmpeg(fail_on=None, calls=None):
+        """run_ffmpeg stand-in that writes its output file, like a successful ffmpeg would."""
+        def fake_run(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+            if calls is not None:
+                calls.append((cmd, stop_event.is_set() if stop_event else False))
+            if fail_on and fail_on in cmd:
+                return False
+            if progress_callback:
+                progress_callback(EncodeProgress(1.0, out_time=total_duration, total_size=100, done=True))
+            if cmd[-1] != '-':
+                open(cmd[-1], 'wb').close()
+            return True
+        return fake_run
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.split_at_keyframes')
+    @patch('compressor.run_ffmpeg')
+    def test_segmented_combines_progress_and_concats(self, mock_run, mock_split, mock_get_path, mock_info):
+        mock_info.return_value = None
+        mock_get_path.return_value = "ffmpeg"
+        mock_split.return_value = [("s0.mkv", 10.0), ("s1.mkv", 30.0)]
+        mock_run.side_effect = self.fake_ffmpeg()
+        output = os.path.join(self.tmp.name, "out.mp4")
+
+        callback = MagicMock()
+        success = compress_video_segmented(self.input, output, 720, total_duration=40,
+                                           progress_callback=callback, workers=1)
+
+        self.assertTrue(success)
+        # Two chunk encodes plus the final concat/mux
+        self.assertEqual(mock_run.call_count, 3)
+        self.assertEqual(callback.call_args_list[-1].args[0], 1.0)
+        self.assertAlmostEqual(callback.call_args_list[0].args[0], 0.25)
+        self.assertEqual(callback.call_args_list[-1].args[0].total_size, 200)
+        concat_cmd = mock_run.call_args_list[-1].args[0]
+        self.assertIn('concat', concat_cmd)
+        self.assertEqual(concat_cmd[-1], output)
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.split_at_keyframes')
+    @patch('compressor.run_ffmpeg')
+    def test_segmented_keeps_the_streams_compress_video_keeps(self, mock_run, mock_split, mock_get_path, mock_info):
+        mock_info.return_value = {'width': 1920, 'height': 1080, 'duration': 20.0, 'video_codec': 'h264',
+                                  'audio_codec': 'aac', 'streams': [
+                                      {'index': 0, 'type': 'video', 'codec': 'h264'},
+                                      {'index': 1, 'type': 'audio', 'codec': 'aac'},
+                                      {'index': 2, 'type': 'subtitle', 'codec': 'subrip'},
+                                      {'index': 3, 'type': 'subtitle', 'codec': 'hdmv_pgs_subtitle'}]}
+        mock_get_path.return_value = "ffmpeg"
+        mock_split.return_value = [("s0.mkv", 10.0), ("s1.mkv", 10.0)]
+        mock_run.side_effect = self.fake_ffmpeg()
+        output = os.path.join(self.tmp.name, "out.mp4")
+
+        pipeline = {'video': 'libx264', 'video_args': None, 'audio': 'aac', 'mov_text': True, 'threads': True}
+        with patch('compressor.select_pipeline', return_value=pipeline):
+            self.assertTrue(compress_video_segmented(self.input, output, 720, total_duration=20, workers=1))
+        single = build_compress_command("ffmpeg", self.input, output, 720, mock_info.return_value, pipeline=pipeline)
+
+        def maps(cmd):
+            return [cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-map']
+        concat_cmd = mock_run.call_args_list[-1].args[0]
+        # Video from the chunks (input 0); audio and the text subtitles from the source (input 1),
+        # the same streams a single encode keeps
+        self.assertEqual(maps(single), ['0:v:0', '0:a:0?', '0:2'])
+        self.assertEqual(maps(concat_cmd), ['0:v:0', '1:a:0?', '1:2'])
+        self.assertEqual(concat_cmd[concat_cmd.index('-c:s') + 1], 'mov_text')
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.split_at_keyframes')
+    @patch('compressor.run_ffmpeg')
+    def test_segmented_failure_aborts_other_workers(self, mock_run, mock_split, mock_get_path, mock_info):
+        mock_info.return_value = None
+        mock_get_path.return_value = "ffmpeg"
+        mock_split.return_value = [("s0.mkv", 10.0), ("s1.mkv", 10.0)]
+        calls = []
+        mock_run.side_effect = self.fake_ffmpeg(fail_on="s0.mkv", calls=calls)
+
+        success = compress_video_segmented(self.input, "out.mp4", 720, total_duration=20, workers=1)
+
+        self.assertFalse(success)
+        self.assertEqual(calls[1][1], True)
+        # No concat after a failed chunk
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    def test_segmented_resumes_from_work_dir(self, mock_run, mock_get_path, mock_info):
+        mock_info.return_value = None
+        mock_get_path.return_value = "ffmpeg"
+        work_dir = os.path.join(self.tmp.name, "job")
+        os.makedirs(work_dir)
+        # A previous run split the input and finished the first chunk before dying
+        with open(os.path.join(work_dir, "segments.csv"), 'w') as f:
+            f.write("src_00000.mkv,0.0,10.0\nsrc_00001.mkv,10.0,20.0\n")
+        open(os.path.join(work_dir, "split.done"), 'w').close()
+        open(os.path.join(work_dir, "enc_00000.mkv"), 'w').close()
+        calls = []
+        mock_run.side_effect = self.fake_ffmpeg(calls=calls)
+        done = []
+
+        success = compress_video_segmented(self.input, os.path.join(self.tmp.name, "out.mp4"), 720,
+                                           total_duration=20, workers=1, work_dir=work_dir,
+                                           segment_callback=lambda n, total: done.append((n, total)))
+
+        self.assertTrue(success)
+        # No split, only the unfinished chunk, then the concat
+        self.assertEqual(len(calls), 2)
+        self.assertIn(os.path.join(work_dir, "src_00001.mkv"), calls[0][0])
+        self.assertEqual(done, [(2, 2)])
+        self.assertTrue(os.path.exists(os.path.join(work_dir, "enc_00001.mkv")))
+
+ENCODERS_OUTPUT = """Encoders:
+ V..... = Video
+ A..... = Audio
+ .F.... = Frame-level multithreading
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ VFS..D mpeg4                MPEG-4 part 2
+ A....D aac                  AAC (Advanced Audio Coding)
+ A..X.D opus                 Opus
+ S..... mov_text             3GPP Timed Text subtitle
+"""
+
+FILTERS_OUTPUT = """Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+ ..C scale             V->V       Scale the input video size and/or convert the image format.
+ ... split             V->N       Pass on the input to N video outputs.
+ TS. ssim              VV->V      Calculate the SSIM between two video streams.
+"""
+
+class TestCapabilities(unittest.TestCase):
+
+    def test_parse_listings(self):
+        encoders = parse_encoders(ENCODERS_OUTPUT)
+        self.assertEqual(sorted(encoders), ['aac', 'libx264', 'mov_text', 'mpeg4', 'opus'])
+        self.assertEqual(encoders['aac']['type'], 'audio')
+        self.assertTrue(encoders['mpeg4']['frame_threads'])
+        self.assertTrue(encoders['opus']['experimental'])
+        filters = parse_filters(FILTERS_OUTPUT)
+        self.assertEqual(sorted(filters), ['scale', 'split', 'ssim'])
+        self.assertTrue(filters['ssim']['slice_threads'])
+        self.assertEqual(parse_version("ffmpeg version 7.0.2-static https://x\nconfiguration: --enable-gpl"),
+                         ('7.0.2-static', ['--enable-gpl']))
+
+    @patch('capabilities.inspect_ffmpeg')
+    def test_capabilities_cached_until_binary_changes(self, mock_inspect):
+        mock_inspect.return_value = {'version': '7.0', 'encoders': {}, 'filters': {}}
+        with tempfile.TemporaryDirectory() as d:
+            exe = os.path.join(d, "ffmpeg")
+            with open(exe, 'wb') as f:
+                f.write(b"binary")
+            self.assertEqual(get_capabilities(exe)['version'], '7.0')
+            capabilities._capabilities_memory.clear()
+            get_capabilities(exe)
+            # The second lookup was served from disk
+            self.assertEqual(mock_inspect.call_count, 1)
+
+            os.utime(exe, ns=(0, 10 ** 9))
+            get_capabilities(exe)
+            self.assertEqual(mock_inspect.call_count, 2)
+
+    def test_pick_encoder(self):
+        caps = {'version': '7.0', 'encoders': parse_encoders(ENCODERS_OUTPUT), 'filters': {}}
+        self.assertEqual(pick_encoder(caps, ('libfdk_aac', 'aac'), "AAC"), 'aac')
+        self.assertEqual(pick_encoder(None, ('libfdk_aac', 'aac'), "AAC"), 'libfdk_aac')
+        with self.assertRaises(FFmpegCapabilityError):
+            pick_encoder(caps, ('libx265',), "HEVC")
+        with self.assertRaises(FFmpegCapabilityError):
+            require_filters(caps, ['scale'])
+
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.get_capabilities')
+    @patch('compressor.get_ffmpeg_path', return_value='ffmpeg')
+    def test_compress_fails_fast_without_encoder(self, mock_path, mock_caps, mock_run):
+        mock_caps.return_value = {'version': '7.0', 'threads': True, 'filters': parse_filters(FILTERS_OUTPUT),
+                                  'encoders': {'aac': {'type': 'audio'}}}
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.mp4")
+            with open(src, 'wb') as f:
+                f.write(b"data")
+            self.assertFalse(compress_video(src, os.path.join(d, "out.mp4"), 720, use_cache=False,
+                                            source_info={'width': 1920, 'height': 1080, 'duration': 5.0}))
+        mock_run.assert_not_called()
+
+class TestSpeedTiers(unittest.TestCase):
+
+    def caps(self, *encoders):
+        return {'version': '7.0', 'threads': True, 'filters': parse_filters(FILTERS_OUTPUT),
+                'encoders': {name: {'type': 'video'} for name in encoders + ('aac', 'mov_text')}}
+
+    def test_pick_tier_falls_back_to_available_encoders(self):
+        caps = self.caps('libx264', 'libaom-av1')
+        self.assertEqual(pick_tier(caps, 'smallest')[0], 'libaom-av1')
+        encoder, options = pick_tier(caps, 'small')
+        self.assertEqual((encoder, options[options.index('-preset') + 1]), ('libx264', 'slow'))
+        self.assertEqual(pick_tier(None, 'smallest')[0], SPEED_TIERS['smallest'][0][0])
+        with self.assertRaises(ValueError):
+            pick_tier(caps, 'ludicrous')
+        with self.assertRaises(FFmpegCapabilityError):
+            pick_tier(self.caps(), 'fastest')
+
+    @patch('compressor.run_ffmpeg', return_value=True)
+    @patch('compressor.get_capabilities')
+    @patch('compressor.get_ffmpeg_path', return_value='ffmpeg')
+    def test_compress_with_tier(self, mock_path, mock_caps, mock_run):
+        mock_caps.return_value = self.caps('libx264', 'libx265')
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.mp4")
+            with open(src, 'wb') as f:
+                f.write(b"data")
+            self.assertTrue(compress_video(src, os.path.join(d, "out.mp4"), 720, use_cache=False, tier='small',
+                                           source_info={'width': 1920, 'height': 1080, 'duration': 5.0}))
+        cmd = mock_run.call_args.args[0]
+        self.assertEqual(cmd[cmd.index('-c:v') + 1], 'libx265')
+        self.assertEqual(cmd[cmd.index('-crf') + 1], '28')
+        self.assertEqual(cmd[cmd.index('-tag:v') + 1], 'hvc1')
+
+    def test_tier_only_in_cache_key_when_set(self):
+        self.assertNotIn('tier', compress_settings(720))
+        self.assertEqual(compress_settings(720, tier='fastest')['tier'], 'fastest')
+
+PROBE_OUTPUT = """Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'phone.mp4':
+  Duration: 00:01:30.50, start: 0.000000, bitrate: 7545 kb/s
+  Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709, progressive), 1920x1080 [SAR 1:1 DAR 16:9], 7465 kb/s, 29.97 fps, 29.97 tbr, 90k tbn (default)
+      Side data:
+        displaymatrix: rotation of -90.00 degrees
+  Stream #0:1[0x2](und): Audio: aac (LC) (mp4a / 0x6134706D), 48000 Hz, stereo, fltp, 128 kb/s (default)
+  Stream #0:2[0x3](eng): Subtitle: mov_text (tx3g / 0x67337874), 0 kb/s
+At least one output file must be specified
+"""
+
+class TestProbe(unittest.TestCase):
+
+    def test_parse_probe_output(self):
+        info = parse_probe_output(PROBE_OUTPUT)
+        # Rotated 90 degrees, so the displayed size is portrait
+        self.assertEqual((info['width'], info['height']), (1080, 1920))
+        self.assertEqual(info['duration'], 90.5)
+        self.assertEqual(info['fps'], 29.97)
+        self.assertEqual(info['video_codec'], 'h264')
+        self.assertEqual(info['audio_codec'], 'aac')
+        self.assertEqual(info['bitrate'], 7545)
+        self.assertEqual([st['type'] for st in info['streams']], ['video', 'audio', 'subtitle'])
+
+    def test_parse_probe_output_no_video(self):
+        self.assertIsNone(parse_probe_output("Invalid data found when processing input"))
+
+    @patch('compressor.get_video_info_opencv')
+    @patch('compressor.probe_video')
+    def test_get_video_info_cached_by_size_and_mtime(self, mock_probe, mock_opencv):
+        mock_probe.return_value = {'width': 640, 'height': 360, 'duration': 5.0}
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "clip.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"data")
+
+            self.assertEqual(get_video_info(path)['height'], 360)
+            self.assertEqual(get_video_info(path)['height'], 360)
+            self.assertEqual(mock_probe.call_count, 1)
+
+            # Changing the file invalidates the entry
+            with open(path, 'ab') as f:
+                f.write(b"more")
+            get_video_info(path)
+            self.assertEqual(mock_probe.call_count, 2)
+        mock_opencv.assert_not_called()
+
+    @patch('compressor.opencv_available', return_value=False)
+    @patch('compressor.probe_video', return_value=None)
+    def test_get_video_info_without_opencv(self, mock_probe, mock_available):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "clip.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"data")
+            self.assertIsNone(get_video_info(path))
+
+    def test_import_does_not_load_heavy_modules(self):
+        # OpenCV, PIL and imageio-ffmpeg load on first use, not when the core is imported
+        code = ("import sys, compressor, jobqueue, watcher; "
+                "print(','.join(m for m in ('cv2', 'numpy', 'PIL', 'imageio_ffmpeg') if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_json_cache_lru_eviction_and_reload(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "cache.json")
+            cache = JsonCache(path, max_entries=2)
+            cache.put("a", 1)
+            cache.put("b", 2)
+            cache.get("a")
+            cache.put("c", 3)
+            cache.flush()
+
+            reloaded = JsonCache(path, max_entries=2)
+            self.assertIsNone(reloaded.get("b"))
+            self.assertEqual(reloaded.get("a"), 1)
+            self.assertEqual(reloaded.get("c"), 3)
+
+class TestThumbnails(unittest.TestCase):
+
+    def setUp(self):
+        _thumbnail_memory.clear()
+
+    def test_default_thumbnail_seek(self):
+        self.assertEqual(default_thumbnail_seek(0), 0)
+        self.assertAlmostEqual(default_thumbnail_seek(30), 3.0)
+        self.assertEqual(default_thumbnail_seek(7200), 10.0)
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.subprocess.run')
+    def test_thumbnail_decoded_at_preview_size(self, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        buffer = io.BytesIO()
+        Image.new('RGB', (55, 38), (255, 0, 0)).save(buffer, format='BMP')
+        mock_run.return_value = MagicMock(returncode=0, stdout=buffer.getvalue())
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "clip.mp4")
+            with open(path, 'wb') as f:
+                f.write(b"data")
+
+            thumb = get_thumbnail(path, size=(55, 38), seek=2.5)
+            self.assertEqual(thumb.size, (55, 38))
+            cmd = mock_run.call_args.args[0]
+            self.assertIn("scale=55:38:flags=bilinear", cmd)
+            self.assertEqual(cmd[cmd.index('-ss') + 1], "2.500")
+
+            # Memory hit, then disk hit after the memory tier is dropped
+            get_thumbnail(path, size=(55, 38), seek=2.5)
+            _thumbnail_memory.clear()
+            again = get_thumbnail(path, size=(55, 38), seek=2.5)
+            self.assertEqual(again.getpixel((0, 0)), (255, 0, 0))
+            self.assertEqual(mock_run.call_count, 1)
+
+            # A different size is a different entry
+            get_thumbnail(path, size=(110, 76), seek=2.5)
+            self.assertEqual(mock_run.call_count, 2)
+
+class TestPreviewStrip(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, "in.mp4")
+        self.output = os.path.join(self.tmp.name, "out.mp4")
+        for path in (self.input, self.output):
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1024))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def bmp_frames(self, *colors):
+        data = b""
+        for color in colors:
+            buffer = io.BytesIO()
+            Image.new('RGB', (16, 9), color).save(buffer, format='BMP')
+            data += buffer.getvalue()
+        return data
+
+    def test_preview_timestamps(self):
+        self.assertEqual(preview_timestamps(60, 3), [10.0, 30.0, 50.0])
+        self.assertEqual(preview_timestamps(0, 3), [])
+
+    def test_split_bmp_stream(self):
+        frames = split_bmp_stream(self.bmp_frames((255, 0, 0), (0, 255, 0)) + b"BM\x00")
+        self.assertEqual([f.getpixel((0, 0)) for f in frames], [(255, 0, 0), (0, 255, 0)])
+
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.subprocess.run')
+    def test_scene_changes_padded_with_even_points(self, mock_run, mock_get_path):
+        log = "[Parsed_showinfo_2 @ 0x1] n:   0 pts:  12800 pts_time:20.5 duration: 512\n"
+        mock_run.return_value = MagicMock(returncode=0, stderr=log.encode())
+        times = detect_scene_changes(self.input, count=3, duration=60)
+        # The cut (nudged past the blended frame), plus even points that aren't next to it
+        self.assertEqual(times, [10.0, 20.6, 50.0])
+
+    @patch('compressor.get_video_info', return_value={'duration': 60.0})
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.subprocess.run')
+    def test_one_ffmpeg_run_per_row(self, mock_run, mock_get_path, mock_info):
+        mock_run.return_value = MagicMock(returncode=0, stderr=b"",
+                                          stdout=self.bmp_frames((255, 0, 0), (0, 0, 255), (0, 255, 0)))
+        sheet = get_preview_strip(self.input, self.output, count=3, size=(16, 9))
+
+        self.assertEqual(sheet.size, (3 * 16 + 2 * 4, 2 * 9 + 4))
+        self.assertEqual(mock_run.call_count, 2)
+        for call, path in zip(mock_run.call_args_list, (self.input, self.output)):
+            cmd = call.args[0]
+            self.assertEqual([cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-ss'], ["10.000", "30.000", "50.000"])
+            self.assertEqual(cmd.count(path), 3)
+            self.assertIn("concat=n=3:v=1:a=0[frames]", cmd[cmd.index('-filter_complex') + 1])
+
+        # Cached with the thumbnails until either file changes
+        get_preview_strip(self.input, self.output, count=3, size=(16, 9))
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch('compressor.get_video_info', return_value={'duration': 60.0})
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.subprocess.run')
+    def test_missing_frames_fail(self, mock_run, mock_get_path, mock_info):
+        mock_run.return_value = MagicMock(returncode=0, stderr=b"", stdout=self.bmp_frames((255, 0, 0)))
+        self.assertIsNone(get_preview_strip(self.input, count=3, use_cache=False))
+
+class TestOutputCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, "in.mp4")
+        with open(self.input, 'wb') as f:
+            f.write(os.urandom(4096))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fingerprint_follows_content_not_name(self):
+        copy = os.path.join(self.tmp.name, "copy.mp4")
+        with open(self.input, 'rb') as src, open(copy, 'wb') as dst:
+            dst.write(src.read())
+        self.assertEqual(file_fingerprint(self.input), file_fingerprint(copy))
+        with open(copy, 'r+b') as f:
+            f.write(b"changed")
+        self.assertNotEqual(file_fingerprint(self.input), file_fingerprint(copy))
+        self.assertIsNone(file_fingerprint(os.path.join(self.tmp.name, "missing.mp4")))
+
+    @patch.dict(os.environ, {"VIDEO_COMPRESSOR_OUTPUT_CACHE_MB": "10"})
+    @patch('cache.clone_file', return_value=False)
+    @patch('compressor.get_video_info')
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    def test_repeat_settings_are_served_from_cache(self, mock_run, mock_get_path, mock_info, mock_clone):
+        # Without reflink (NTFS, ext4) outputs are copied into the cache
+        mock_get_path.return_value = "ffmpeg"
+        mock_info.return_value = None
+
+        def fake_run(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+            with open(cmd[-1], 'wb') as f:
+                f.write(cmd[cmd.index('-vf') + 1].encode())
+            return True
+        mock_run.side_effect = fake_run
+        out = os.path.join(self.tmp.name, "out.mp4")
+
+        self.assertTrue(compress_video(self.input, out, 720))
+        self.assertTrue(compress_video(self.input, out, 480))
+        os.remove(out)
+        callback = MagicMock()
+        self.assertTrue(compress_video(self.input, out, 720, progress_callback=callback))
+
+        # 720p -> 480p -> 720p only encodes twice
+        self.assertEqual(mock_run.call_count, 2)
+        with open(out, 'rb') as f:
+            self.assertEqual(f.read(), b"scale=-2:720")
+        self.assertEqual(callback.call_args.args[0], 1.0)
+        # Other settings, or an explicit opt-out, still encode
+        compress_video(self.input, out, 720, crf=28)
+        compress_video(self.input, out, 720, use_cache=False)
+        self.assertEqual(mock_run.call_count, 4)
+
+    @patch.dict(os.environ, {"VIDEO_COMPRESSOR_OUTPUT_CACHE_MB": "10"})
+    @patch('cache.clone_file', return_value=False)
+    def test_copying_outputs_into_the_cache_can_be_turned_off(self, mock_clone):
+        out = os.path.join(self.tmp.name, "out.mp4")
+        with open(out, 'wb') as f:
+            f.write(b"result")
+        key = output_cache_key(self.input, out, compress_settings(720))
+        with patch.dict(os.environ, {"VIDEO_COMPRESSOR_OUTPUT_CACHE_COPY": "0"}):
+            store_cached_output(key, out)
+        self.assertIsNone(get_output_cache().get(key))
+        store_cached_output(key, out)
+        self.assertIsNotNone(get_output_cache().get(key))
+
+    def test_prune_stale_work_files(self):
+        work = os.path.join(self.tmp.name, "work")
+        os.makedirs(os.path.join(work, "sub"))
+        old, fresh = os.path.join(work, "old.mp4"), os.path.join(work, "fresh.mp4")
+        for path in (old, fresh):
+            open(path, 'wb').close()
+        os.utime(old, (time.time() - 7200, time.time() - 7200))
+        self.assertEqual(prune_stale_files(work, 3600), 1)
+        self.assertEqual(sorted(os.listdir(work)), ["fresh.mp4", "sub"])
+        self.assertEqual(prune_stale_files(os.path.join(self.tmp.name, "missing"), 0), 0)
+
+    def test_cache_key_includes_resolved_encoders(self):
+        x264 = {'video': 'libx264', 'video_args': None, 'audio': 'aac'}
+        fdk = dict(x264, audio='libfdk_aac')
+        x265 = dict(x264, video='libx265', video_args=['-preset', 'medium', '-crf', '28'])
+        keys = {output_cache_key(self.input, "out.mp4", compress_settings(720, tier='small', pipeline=pipeline))
+                for pipeline in (x264, fdk, x265)}
+        self.assertEqual(len(keys), 3)
+
+class TestOutputFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "result.mp4")
+        with open(self.src, 'wb') as f:
+            f.write(b"encoded")
+        self.dst = os.path.join(self.tmp.name, "saved.mp4")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fragmented_flags_only_for_mp4(self):
+        self.assertEqual(container_args("out.mp4"), [])
+        args = container_args("out.MP4", fragmented=True)
+        self.assertIn('+frag_keyframe+empty_moov+default_base_moof', args)
+        self.assertIn('-frag_duration', args)
+        self.assertEqual(container_args("out.mkv", fragmented=True), [])
+
+    def test_save_renames_on_same_filesystem(self):
+        self.assertEqual(save_output(self.src, self.dst), 'renamed')
+        self.assertFalse(os.path.exists(self.src))
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), b"encoded")
+
+    @patch('compressor.clone_file')
+    @patch('compressor.os.replace')
+    def test_save_falls_back_to_copy_across_filesystems(self, mock_replace, mock_clone):
+        mock_replace.side_effect = OSError("cross-device link")
+        mock_clone.return_value = False
+        self.assertEqual(save_output(self.src, self.dst), 'copied')
+        self.assertFalse(os.path.exists(self.src))
+        self.assertTrue(os.path.exists(self.dst))
+
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.subprocess.run')
+    def test_save_remuxes_fragmented_output(self, mock_run, mock_get_path):
+        def fake_run(cmd, **kwargs):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"regular")
+            return MagicMock(returncode=0, stderr="")
+        mock_run.side_effect = fake_run
+        self.assertEqual(save_output(self.src, self.dst, defragment=True), 'remuxed')
+        cmd = mock_run.call_args.args[0]
+        # A stream copy into a regular MP4 with its index up front, no fragments
+        self.assertEqual(cmd[cmd.index('-c') + 1], 'copy')
+        self.assertEqual(cmd[cmd.index('-movflags') + 1], '+faststart')
+        self.assertNotIn('-frag_duration', cmd)
+        self.assertFalse(os.path.exists(self.src))
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), b"regular")
+        self.assertEqual(os.listdir(self.tmp.name), ["saved.mp4"])
+
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.subprocess.run', return_value=MagicMock(returncode=1, stderr="Invalid data"))
+    def test_save_keeps_fragmented_output_if_remux_fails(self, mock_run, mock_get_path):
+        self.assertEqual(save_output(self.src, self.dst, defragment=True), 'renamed')
+        with open(self.dst, 'rb') as f:
+            self.assertEqual(f.read(), b"encoded")
+
+    def test_save_copy_keeps_source(self):
+        method = save_output(self.src, self.dst, move=False)
+        self.assertIn(method, ('cloned', 'copied'))
+        self.assertTrue(os.path.exists(self.src))
+
+class TestProgress(unittest.TestCase):
+
+    def test_parse_progress_block(self):
+        p = parse_progress_block({'frame': '300', 'fps': '60.0', 'bitrate': ' 812.4kbits/s', 'total_size': '1048576',
+                                  'out_time_us': '10000000', 'speed': '2.5x', 'progress': 'continue'}, total_duration=40)
+        self.assertAlmostEqual(p, 0.25)
+        self.assertEqual(p.frame, 300)
+        self.assertEqual(p.total_size, 1048576)
+        self.assertAlmostEqual(p.bitrate, 812.4)
+        self.assertAlmostEqual(p.eta, 12.0)
+        self.assertFalse(p.done)
+
+    def test_parse_progress_block_na_values_and_end(self):
+        p = parse_progress_block({'bitrate': 'N/A', 'total_size': 'N/A', 'out_time_us': 'N/A',
+                                  'speed': 'N/A', 'progress': 'end'}, total_duration=10)
+        self.assertEqual(p, 1.0)
+        self.assertEqual(p.speed, 0)
+        self.assertTrue(p.done)
+
+    def test_format_eta(self):
+        self.assertEqual(format_eta(None), "--:--")
+        self.assertEqual(format_eta(75), "1:15")
+        self.assertEqual(format_eta(3725), "1:02:05")
+
+    @patch('compressor.subprocess.Popen')
+    def test_cancel_while_ffmpeg_is_silent(self, mock_popen):
+        release = threading.Event()
+
+        def silent_stdout():
+            # No progress at all until the process is killed
+            release.wait(5)
+            return
+            yield
+
+        process_mock = MagicMock()
+        process_mock.stdout = silent_stdout()
+        process_mock.stderr = iter([])
+        process_mock.kill.side_effect = release.set
+        mock_popen.return_value = process_mock
+
+        stop_event = threading.Event()
+        threading.Timer(0.2, stop_event.set).start()
+        start = time.monotonic()
+        self.assertFalse(run_ffmpeg(["ffmpeg", "-i", "in.mp4", "out.mp4"], stop_event=stop_event))
+        self.assertLess(time.monotonic() - start, 2)
+        process_mock.kill.assert_called_once()
+
+class TestTargetSize(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("25M"), 25000000)
+        self.assertEqual(parse_size("25mb"), 25000000)
+        self.assertEqual(parse_size("1.5G"), 1500000000)
+        self.assertEqual(parse_size("800k"), 800000)
+        self.assertEqual(parse_size("1234"), 1234)
+        self.assertIsNone(parse_size("huge"))
+
+    def test_compute_target_bitrates(self):
+        # 25 MB over 100 s: ~1960 kbit/s after container overhead, audio keeps 128
+        video, audio = compute_target_bitrates(25000000, 100)
+        self.assertEqual(audio, 128)
+        self.assertEqual(video, 1960 - 128)
+
+        # Tight budget squeezes audio down to its floor
+        video, audio = compute_target_bitrates(2000000, 100)
+        self.assertEqual(audio, 32)
+
+        self.assertIsNone(compute_target_bitrates(100000, 3600))
+        self.assertIsNone(compute_target_bitrates(25000000, 0))
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.os.path.exists')
+    @patch('compressor.os.path.getsize')
+    def test_two_pass_commands(self, mock_size, mock_exists, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        mock_exists.return_value = True
+        mock_run.return_value = True
+        mock_size.return_value = 24000000
+
+        self.assertTrue(compress_video_target_size("in.mp4", "out.mp4", 720, 25000000, total_duration=100))
+
+        self.assertEqual(mock_run.call_count, 2)
+        pass1 = mock_run.call_args_list[0].args[0]
+        pass2 = mock_run.call_args_list[1].args[0]
+        self.assertEqual(pass1[pass1.index('-pass') + 1], '1')
+        self.assertIn('-an', pass1)
+        self.assertEqual(pass1[-1], '-')
+        self.assertEqual(pass2[pass2.index('-pass') + 1], '2')
+        self.assertEqual(pass2[pass2.index('-b:v') + 1], '1832k')
+        self.assertEqual(pass2[-1], 'out.mp4')
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.os.path.exists')
+    @patch('compressor.os.path.getsize')
+    def test_overshoot_reruns_second_pass(self, mock_size, mock_exists, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        mock_exists.return_value = True
+        mock_run.return_value = True
+        mock_size.side_effect = [30000000, 24500000]
+
+        self.assertTrue(compress_video_target_size("in.mp4", "out.mp4", None, 25000000, total_duration=100))
+
+        self.assertEqual(mock_run.call_count, 3)
+        retry = mock_run.call_args_list[2].args[0]
+        self.assertLess(int(retry[retry.index('-b:v') + 1].rstrip('k')), 1832)
+        self.assertNotIn('-vf', retry)
+
+class TestSample(unittest.TestCase):
+
+    def test_estimate_from_sample(self):
+        # Two 5 s samples of 1 MB; each took 1.5 s of which 0.5 s was start-up
+        samples = [{'media_seconds': 5.0, 'bytes': 1000000, 'wall_seconds': 1.5, 'encode_seconds': 1.0}] * 2
+        estimate = estimate_from_sample(samples, 600)
+        self.assertEqual(estimate['sample_seconds'], 10.0)
+        self.assertEqual(estimate['estimated_bytes'], 120000000)
+        self.assertEqual(estimate['kbps'], 1600.0)
+        self.assertEqual(estimate['speed'], 5.0)
+        self.assertEqual(estimate['estimated_seconds'], 120.5)
+
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.get_ffmpeg_path', return_value='ffmpeg')
+    def test_sample_seeks_each_range_and_concatenates(self, mock_path, mock_run):
+        def fake_run(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+            if '-f' in cmd and cmd[cmd.index('-f') + 1] == 'concat':
+                with open(cmd[-1], 'wb') as f:
+                    f.write(b"joined")
+                return True
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"x" * 50000)
+            progress_callback(EncodeProgress(1.0, out_time=total_duration, speed=2.0, done=True))
+            return True
+        mock_run.side_effect = fake_run
+
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.mp4")
+            with open(src, 'wb') as f:
+                f.write(b"data")
+            out = os.path.join(d, "sample.mp4")
+            info = {'width': 1920, 'height': 1080, 'duration': 1000.0}
+            estimate = compress_video_sample(src, out, 480, ranges=[(100, 5), (500, 5), (998, 5)], source_info=info)
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), b"joined")
+
+        encodes = [call.args[0] for call in mock_run.call_args_list[:-1]]
+        # Input seeking: -ss/-t come before -i; the last range is cut at the end of the video
+        self.assertEqual([cmd[cmd.index('-ss') + 1] for cmd in encodes], ['100.000', '500.000', '998.000'])
+        self.assertEqual(encodes[2][encodes[2].index('-t') + 1], '2.000')
+        self.assertTrue(all(cmd.index('-ss') < cmd.index('-i') for cmd in encodes))
+        self.assertIn('scale=-2:480', encodes[0])
+        self.assertEqual(estimate['sample_seconds'], 12.0)
+        self.assertEqual(estimate['estimated_bytes'], 150000 * 1000 // 12)
+
+class TestFastPath(unittest.TestCase):
+
+    def setUp(self):
+        self.info = parse_probe_output(PROBE_OUTPUT)  # 1080x1920 h264 + aac + mov_text
+
+    def test_plan_copies_compatible_audio_and_scales_video(self):
+        plan = plan_streams(self.info, 720, "out.mp4")
+        self.assertEqual(plan['video'], 'scale')
+        self.assertEqual(plan['audio'], 'copy')
+        self.assertEqual(plan['subtitles'], [2])
+        self.assertEqual(plan['subtitle_codec'], 'mov_text')
+
+    def test_plan_remux_when_already_small_enough(self):
+        self.assertEqual(plan_streams(self.info, 1920, "out.mp4")['video'], 'copy')
+        self.info['video_codec'] = 'mpeg2video'
+        self.assertEqual(plan_streams(self.info, 1920, "out.mp4")['video'], 'encode')
+
+    def test_plan_drops_bitmap_subtitles_and_data(self):
+        self.info['streams'] += [{'index': 3, 'type': 'subtitle', 'codec': 'hdmv_pgs_subtitle'},
+                                 {'index': 4, 'type': 'data', 'codec': 'bin_data'}]
+        self.info['audio_codec'] = 'pcm_s16le'
+        plan = plan_streams(self.info, 720, "out.mp4")
+        self.assertEqual(plan['audio'], 'encode')
+        self.assertEqual(plan['subtitles'], [2])
+        self.assertEqual([st['index'] for st in plan['dropped']], [3, 4])
+
+    def test_plan_converts_mov_text_for_mkv(self):
+        self.info['streams'] += [{'index': 3, 'type': 'subtitle', 'codec': 'hdmv_pgs_subtitle'}]
+        plan = plan_streams(self.info, 720, "out.mkv")
+        self.assertEqual(plan['subtitle_codec'], 'srt')
+        self.assertEqual(plan['subtitles'], [2])
+        self.assertEqual([st['index'] for st in plan['dropped']], [3])
+        # Without mov_text MKV copies every track
+        self.info['streams'] = [st for st in self.info['streams'] if st['index'] != 2]
+        plan = plan_streams(self.info, 720, "out.mkv")
+        self.assertEqual((plan['subtitles'], plan['subtitle_codec']), ([3], 'copy'))
+
+    def test_plan_disabled(self):
+        plan = plan_streams(self.info, 1920, "out.mp4", fast_path=False)
+        self.assertEqual((plan['video'], plan['audio']), ('scale', 'encode'))
+
+    @patch('compressor.get_ffmpeg_path')
+    @patch('compressor.run_ffmpeg')
+    @patch('compressor.os.path.exists')
+    def test_compress_video_remux_command(self, mock_exists, mock_run, mock_get_path):
+        mock_get_path.return_value = "ffmpeg"
+        mock_exists.return_value = True
+        mock_run.return_value = True
+
+        self.assertTrue(compress_video("in.mov", "out.mp4", 1920, source_info=self.info))
+        cmd = mock_run.call_args.args[0]
+        self.assertEqual(cmd[cmd.index('-c:v') + 1], 'copy')
+        self.assertEqual(cmd[cmd.index('-c:a') + 1], 'copy')
+        self.assertNotIn('-vf', cmd)
+        self.assertIn('0:2', cmd)
+
+class TestQualitySearch(unittest.TestCase):
+
+    def test_pick_sample_ranges(self):
+        self.assertEqual(pick_sample_ranges(90), [(29.5, 1.0), (59.5, 1.0)])
+        self.assertEqual(pick_sample_ranges(80, 3, 2.0), [(19.0, 2.0), (39.0, 2.0), (59.0, 2.0)])
+        self.assertEqual(pick_sample_ranges(1.5), [(0.0, 1.5)])
+        self.assertEqual(pick_sample_ranges(0), [])
+
+    def test_parse_score(self):
+        ssim_log = "[Parsed_ssim_1 @ 0x1] SSIM Y:0.956017 (13.56) U:0.95 (13.2) V:0.95 (13.8) All:0.956007 (13.566152)"
+        psnr_log = "[Parsed_psnr_1 @ 0x1] PSNR y:34.38 u:32.71 v:28.55 average:32.481963 min:32.33 max:32.79"
+        self.assertAlmostEqual(parse_score(ssim_log, 'ssim'), 0.956007)
+        self.assertAlmostEqual(parse_score(psnr_log, 'psnr'), 32.481963)
+        self.assertIsNone(parse_score("nothing here", 'ssim'))
+
+    @patch('quality.score_sample')
+    @patch('quality.get_video_info')
+    def test_find_quality_settings_picks_cheapest_passing(self, mock_info, mock_score):
+        mock_info.return_value = {'width': 1920, 'height': 1080, 'duration': 1000.0}
+
+        # Quality drops with CRF and with resolution; size drops with both
+        def fake_score(input_path, sample_range, height, crf, info, metric, work_dir, preset='medium', **kwargs):
+            score = 1.0 - (crf - 18) * 0.004 - (1080 - height) / 10000
+            size = height * 1000 // crf
+            return score, size
+        mock_score.side_effect = fake_score
+
+        choice = find_quality_settings("in.mp4", target=0.95, heights=[720, 480, 360])
+
+        self.assertTrue(choice['met_target'])
+        self.assertTrue(choice['searched'])
+        self.assertGreaterEqual(choice['score'], 0.95)
+        # Every passing candidate we saw is at least as expensive as the choice
+        passing = [c for c in choice['evaluated'] if c['met_target']]
+        self.assertEqual(min(c['kbps'] for c in passing), choice['kbps'])
+        # Only the two largest heights, at most SEARCH_STEPS CRFs each, starting at the default
+        self.assertEqual({c['height'] for c in choice['evaluated']}, {720, 480})
+        self.assertLessEqual(len(choice['evaluated']), 2 * SEARCH_STEPS)
+        self.assertEqual(mock_score.call_args_list[0][0][3], DEFAULT_CRF)
+        # 480p never tries a CRF above the one 720p settled on
+        best_720 = max(c['crf'] for c in choice['evaluated'] if c['height'] == 720 and c['met_target'])
+        self.assertTrue(all(c['crf'] <= best_720 for c in choice['evaluated'] if c['height'] == 480))
+
+    @patch('quality.score_sample')
+    @patch('quality.get_video_info')
+    def test_find_quality_settings_unreachable_target(self, mock_info, mock_score):
+        mock_info.return_value = {'width': 1280, 'height': 720, 'duration': 600.0}
+        mock_score.side_effect = lambda *args, **kwargs: (0.5 + args[2] / 10000, 1000)
+
+        choice = find_quality_settings("in.mp4", target=0.99, heights=[480, 240])
+        self.assertFalse(choice['met_target'])
+        self.assertEqual(choice['height'], 480)
+
+    @patch('quality.score_sample')
+    @patch('quality.get_video_info')
+    def test_find_quality_settings_skips_search_that_costs_too_much(self, mock_info, mock_score):
+        # Even one 1 s sample at three CRFs is a big part of encoding a 10 s clip
+        mock_info.return_value = {'width': 1280, 'height': 720, 'duration': 10.0}
+        messages = []
+        choice = find_quality_settings("in.mp4", heights=[360, 480], status_callback=messages.append)
+        mock_score.assert_not_called()
+        self.assertFalse(choice['searched'])
+        self.assertEqual((choice['height'], choice['crf']), (480, DEFAULT_CRF))
+        self.assertIsNone(choice['score'])
+        self.assertIn("too short", messages[0])
+
+    def test_plan_search_shrinks_to_fit_the_budget(self):
+        info = {'width': 1920, 'height': 1080}
+        def plan(duration):
+            ranges, heights = plan_search(dict(info, duration=duration), [720, 480])
+            return len(ranges), heights
+        self.assertEqual(plan(600.0), (2, [720, 480]))
+        self.assertEqual(plan(60.0), (2, [720]))
+        self.assertEqual(plan(30.0), (1, [720]))
+        self.assertIsNone(plan_search(dict(info, duration=10.0), [720, 480]))
+        for duration in (30.0, 60.0, 120.0, 600.0):
+            source = dict(info, duration=duration)
+            ranges, heights = plan_search(source, [720, 480])
+            self.assertLess(estimate_search_cost(source, ranges, heights),
+                            MAX_SEARCH_COST_FRACTION * estimate_job(source, 720)['work'])
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_compare_flags_slowdowns(self):
+        baseline = {'results': [{'name': 'encode/a', 'wall': 1.0}, {'name': 'encode/b', 'wall': 2.0},
+                                {'name': 'encode/gone', 'wall': 1.0}]}
+        current = {'results': [{'name': 'encode/a', 'wall': 1.05}, {'name': 'encode/b', 'wall': 2.5},
+                               {'name': 'encode/new', 'wall': 1.0}]}
+        rows = benchmark.compare(baseline, current, threshold=0.10)
+        self.assertEqual([r['name'] for r in rows], ['encode/a', 'encode/b'])
+        self.assertEqual([r['regression'] for r in rows], [False, True])
+        self.assertAlmostEqual(rows[1]['change'], 0.25)
+
+    def test_compare_flags_memory_growth(self):
+        baseline = {'results': [{'name': 'startup/compressor', 'wall': 0.05, 'peak_rss_kb': 20000}]}
+        current = {'results': [{'name': 'startup/compressor', 'wall': 0.05, 'peak_rss_kb': 60000}]}
+        row = benchmark.compare(baseline, current)[0]
+        self.assertAlmostEqual(row['rss_change'], 2.0)
+        self.assertTrue(row['regression'])
+
+    def test_bench_startup_reports_loaded_modules(self):
+        result = benchmark.bench_startup('compressor', repeat=1)
+        self.assertEqual(result['name'], "startup/compressor")
+        self.assertNotIn('cv2', result['loaded'])
+        self.assertGreater(result['process_wall'], result['wall'])
+
+    @patch('benchmark.time.perf_counter')
+    def test_measure_reports_median_run(self, mock_clock):
+        # Three runs taking 3s, 1s and 2s
+        mock_clock.side_effect = [0, 3, 10, 11, 20, 22]
+        calls = iter([{'run': 1}, {'run': 2}, {'run': 3}])
+        result = benchmark._measure(lambda: (True, next(calls)), repeat=3)
+        self.assertEqual(result['run'], 3)
+        self.assertEqual(result['wall'], 2)
+
+    @patch('benchmark.compress_video')
+    def test_bench_encode_records_usage(self, mock_compress):
+        def fake_compress(source, output, target_height, usage=None, **kwargs):
+            usage.update({'cpu_user': 1.5, 'cpu_sys': 0.1, 'peak_rss_kb': 65536})
+            with open(output, 'wb') as f:
+                f.write(b"x" * 1000)
+            return True
+        mock_compress.side_effect = fake_compress
+
+        with tempfile.TemporaryDirectory() as d:
+            result = benchmark.bench_encode("src.mp4", 1080, 5, 720, 'medium', d)
+        self.assertEqual(result['name'], "encode/1080p-5s/720p/medium")
+        self.assertEqual(result['output_bytes'], 1000)
+        self.assertEqual(result['peak_rss_kb'], 65536)
+        self.assertGreater(result['fps'], 0)
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.tmp.name, "jobs.db"))
+        self.output = os.path.join(self.tmp.name, "out", "movie.mp4")
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_add_is_idempotent_and_claims_in_order(self):
+        first = self.queue.add("a.mp4", "a_out.mp4", 720)
+        second = self.queue.add("b.mp4", "b_out.mp4", 720)
+        self.assertEqual(self.queue.add("a.mp4", "a_out.mp4", 720), first)
+        # Different settings are a different job
+        self.assertNotEqual(self.queue.add("a.mp4", "a_out.mp4", 480), first)
+
+        job = self.queue.claim()
+        self.assertEqual(job['id'], first)
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(job['settings']['height'], 720)
+        self.assertEqual(self.queue.claim()['id'], second)
+
+    def test_state_survives_reopening(self):
+        job_id = self.queue.add("a.mp4", "a_out.mp4", 720)
+        self.queue.claim()
+        self.queue.update_segments(job_id, 3, 10)
+        self.queue.close()
+
+        self.queue = JobQueue(os.path.join(self.tmp.name, "jobs.db"))
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['segments_done'], job['segments_total']), ('running', 3, 10))
+        # The runner that held it is gone
+        self.assertEqual(self.queue.requeue_stale(max_age=0), 1)
+        self.assertEqual(self.queue.get(job_id)['status'], 'queued')
+
+    def test_retry_and_cancel_transitions(self):
+        job_id = self.queue.add("a.mp4", "a_out.mp4", 720)
+        self.assertFalse(self.queue.retry(job_id))
+        self.assertTrue(self.queue.cancel(job_id))
+        self.assertIsNone(self.queue.claim())
+        self.assertFalse(self.queue.cancel(job_id))
+        self.assertTrue(self.queue.retry(job_id))
+        self.assertEqual(self.queue.claim()['id'], job_id)
+
+    @patch('jobqueue.get_video_info')
+    @patch('jobqueue.compress_video')
+    def test_run_job_renames_partial_output_on_success(self, mock_compress, mock_info):
+        mock_info.return_value = {'height': 1080, 'duration': 30, 'streams': []}
+
+        def fake_compress(input_path, output_path, target_height, **kwargs):
+            with open(output_path, 'wb') as f:
+                f.write(b"video")
+            return True
+        mock_compress.side_effect = fake_compress
+        self.queue.add("in.mp4", self.output, 720)
+
+        status = run_job(self.queue, self.queue.claim())
+
+        self.assertEqual(status, 'done')
+        self.assertEqual(mock_compress.call_args.args[1], partial_output_path(self.output))
+        self.assertTrue(os.path.exists(self.output))
+        self.assertFalse(os.path.exists(partial_output_path(self.output)))
+        self.assertEqual(self.queue.jobs('done')[0]['output_path'], self.output)
+
+    @patch('jobqueue.get_video_info')
+    @patch('jobqueue.compress_video')
+    def test_run_job_failure_and_interruption(self, mock_compress, mock_info):
+        mock_info.return_value = None
+        mock_compress.return_value = False
+        failed_id = self.queue.add("in.mp4", self.output, 720)
+        self.assertEqual(run_job(self.queue, self.queue.claim()), 'failed')
+        self.assertIsNotNone(self.queue.get(failed_id)['error'])
+
+        # Stopped by the user rather than broken: handed back to the queue
+        stopped_id = self.queue.add("other.mp4", self.output, 720)
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(run_job(self.queue, self.queue.claim(), stop), 'queued')
+        self.assertEqual(self.queue.get(stopped_id)['status'], 'queued')
+
+    @patch('compressor.get_output_cache', return_value=None)
+    @patch('compressor.get_ffmpeg_path', return_value="ffmpeg")
+    @patch('compressor.run_ffmpeg')
+    @patch('jobqueue.get_video_info')
+    def test_run_job_without_resolution_keeps_source_size(self, mock_info, mock_run, mock_path, mock_cache):
+        source = os.path.join(self.tmp.name, "in.mp4")
+        open(source, 'wb').close()
+        mock_info.return_value = {'width': 1280, 'height': 720, 'duration': 30, 'video_codec': 'h264',
+                                  'streams': [{'index': 0, 'type': 'video', 'codec': 'h264'}]}
+
+        def fake_run(cmd, total_duration=0, progress_callback=None, stop_event=None, usage=None):
+            open(cmd[-1], 'wb').close()
+            return True
+        mock_run.side_effect = fake_run
+        self.queue.add(source, self.output)
+
+        self.assertEqual(run_job(self.queue, self.queue.claim()), 'done')
+        cmd = mock_run.call_args.args[0]
+        self.assertNotIn('-vf', cmd)
+        self.assertEqual(cmd[cmd.index('-c:v') + 1], 'libx264')
+        self.assertEqual(plan_streams(mock_info.return_value, None, self.output)['video'], 'encode')
+
+    @patch('jobqueue.get_video_info')
+    @patch('jobqueue.compress_video_segmented')
+    def test_long_sources_encode_in_resumable_segments(self, mock_segmented, mock_info):
+        mock_info.return_value = {'height': 1080, 'duration': jobqueue.SEGMENT_THRESHOLD_SECONDS * 2,
+                                  'video_codec': 'h264', 'streams': [{'index': 0, 'type': 'video', 'codec': 'h264'}]}
+
+        def fake_segmented(input_path, output_path, target_height, segment_callback=None, **kwargs):
+            segment_callback(4, 4)
+            open(output_path, 'wb').close()
+            return True
+        mock_segmented.side_effect = fake_segmented
+        job_id = self.queue.add("in.mp4", self.output, 720)
+
+        counts = self.queue.run(workers=1)
+
+        self.assertEqual(counts, {'done': 1})
+        self.assertEqual(mock_segmented.call_args.kwargs['work_dir'], self.queue.work_dir(job_id))
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['segments_done']), ('done', 4))
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp.name, "in")
+        self.output_dir = os.path.join(self.input_dir, "out")
+        os.makedirs(self.output_dir)
+        self.state_path = os.path.join(self.tmp.name, "state.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_watcher(self, **kwargs):
+        return FolderWatcher([self.input_dir], self.output_dir, 720, workers=1, settle_seconds=5,
+                             state_path=self.state_path, **kwargs)
+
+    def write(self, name, data=b"video"):
+        path = os.path.join(self.input_dir, name)
+        with open(path, 'ab') as f:
+            f.write(data)
+        return path
+
+    def test_candidates_exclude_outputs_and_partial_files(self):
+        watcher = self.make_watcher()
+        self.assertTrue(watcher.is_candidate(os.path.join(self.input_dir, "clip.MP4")))
+        self.assertFalse(watcher.is_candidate(os.path.join(self.input_dir, "notes.txt")))
+        self.assertFalse(watcher.is_candidate(os.path.join(self.input_dir, "clip.part.mp4")))
+        self.assertFalse(watcher.is_candidate(os.path.join(self.output_dir, "compressed_720p_clip.mp4")))
+
+    @patch('watcher.time.monotonic')
+    def test_file_is_ready_only_after_it_stops_growing(self, mock_clock):
+        watcher = self.make_watcher()
+        mock_clock.return_value = 100.0
+        path = self.write("clip.mp4")
+        watcher.scan()
+        self.assertIn(path, watcher.pending)
+
+        mock_clock.return_value = 104.0
+        self.write("clip.mp4", b"more")
+        self.assertEqual(watcher.ready_files(), [])
+        # Settle time restarts from the last change
+        mock_clock.return_value = 108.0
+        self.assertEqual(watcher.ready_files(), [])
+        mock_clock.return_value = 109.0
+        self.assertEqual(watcher.ready_files(), [path])
+        self.assertNotIn(path, watcher.pending)
+
+    @patch('watcher.get_video_info')
+    @patch('watcher.compress_video')
+    def test_processed_files_are_skipped_after_restart(self, mock_compress, mock_info):
+        mock_info.return_value = {'duration': 10, 'height': 1080, 'streams': []}
+
+        def fake_compress(input_path, output_path, target_height, **kwargs):
+            open(output_path, 'wb').close()
+            return True
+        mock_compress.side_effect = fake_compress
+        path = self.write("clip.mp4")
+        watcher = self.make_watcher()
+
+        result = watcher.process(path)
+        self.assertTrue(result['success'])
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "compressed_720p_clip.mp4")))
+
+        restarted = self.make_watcher()
+        mock_info.reset_mock()
+        restarted.scan()
+        self.assertEqual(restarted.pending, {})
+        mock_info.assert_not_called()
+
+        # A changed file is new work
+        self.write("clip.mp4", b"more")
+        restarted.scan()
+        self.assertIn(path, restarted.pending)
+
+    def test_dispatch_never_exceeds_worker_count(self):
+        watcher = self.make_watcher()
+        pool = MagicMock()
+        watcher.waiting = {"a.mp4": True, "b.mp4": True}
+        watcher.dispatch(pool)
+        self.assertEqual(pool.submit.call_count, 1)
+        self.assertEqual(watcher.in_flight, {"a.mp4"})
+        self.assertEqual(list(watcher.waiting), ["b.mp4"])
+
+@unittest.skipIf(os.name == 'nt', "uses a shell script as a stand-in for ffmpeg")
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pid_file = os.path.join(self.tmp.name, "pid")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def fake_ffmpeg(self, body):
+        """Executable that ignores its arguments and runs `body`, like ffmpeg writing -progress to stdout."""
+        path = os.path.join(self.tmp.name, "ffmpeg")
+        with open(path, 'w') as f:
+            f.write(f"#!/bin/sh\necho $$ > {self.pid_file}\n{body}\n")
+        os.chmod(path, 0o755)
+        return path
+
+    def test_progress_is_yielded_until_success(self):
+        ffmpeg = self.fake_ffmpeg("printf 'out_time_us=5000000\\nprogress=continue\\n'\n"
+                                  "printf 'out_time_us=10000000\\nprogress=end\\n'")
+
+        async def collect():
+            return [p async for p in run_ffmpeg_async([ffmpeg, '-i', 'in.mp4', 'out.mp4'], total_duration=10)]
+
+        progress = asyncio.run(collect())
+        self.assertEqual([p.fraction for p in progress], [0.5, 1.0])
+        self.assertTrue(progress[-1].done)
+
+    def test_failure_raises_with_log(self):
+        ffmpeg = self.fake_ffmpeg("echo 'Invalid data found' >&2\nexit 1")
+
+        async def run():
+            return [p async for p in run_ffmpeg_async([ffmpeg, 'out.mp4'])]
+
+        with self.assertRaises(FFmpegError) as caught:
+            asyncio.run(run())
+        self.assertEqual(caught.exception.returncode, 1)
+        self.assertIn('Invalid data found', caught.exception.log_tail)
+        self.assertFalse(asyncio.run(wait_for_compression(run_ffmpeg_async([ffmpeg, 'out.mp4']))))
+
+    def test_cancelling_the_task_kills_ffmpeg(self):
+        ffmpeg = self.fake_ffmpeg("printf 'out_time_us=0\\nprogress=continue\\n'\nexec sleep 30")
+
+        async def run():
+            started = asyncio.Event()
+
+            async def consume():
+                async for _ in run_ffmpeg_async([ffmpeg, 'out.mp4']):
+                    started.set()
+            task = asyncio.ensure_future(consume())
+            await asyncio.wait_for(started.wait(), timeout=5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 5)
+        with open(self.pid_file) as f:
+            pid = int(f.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_missing_input(self):
+        async def run():
+            return [p async for p in compress_video_async(os.path.join(self.tmp.name, "missing.mp4"), "out.mp4", 720)]
+
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(run())
+
+class TestScanner(unittest.TestCase):
+
+    @patch('scanner.get_video_info')
+    def test_scan_walks_tree_and_writes_manifest(self, mock_info):
+        mock_info.side_effect = lambda path: None if "broken" in path else {
+            'width': 1920, 'height': 1080, 'duration': 10.0, 'fps': 30.0, 'video_codec': 'h264'}
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, "b", "c"))
+            for name in ("a.mp4", os.path.join("b", "c", "deep.mkv"), os.path.join("b", "broken.mov"), "notes.txt"):
+                with open(os.path.join(d, name), 'wb') as f:
+                    f.write(b"data")
+            entries, failed = scan_library([d], workers=4)
+            self.assertEqual([os.path.basename(e['path']) for e in entries], ["a.mp4", "deep.mkv"])
+            self.assertEqual([os.path.basename(p) for p in failed], ["broken.mov"])
+            self.assertEqual(entries[0]['size'], 4)
+
+            manifest = os.path.join(d, "library.jsonl")
+            write_manifest(entries, manifest)
+            self.assertEqual(read_manifest(manifest)[1]['height'], 1080)
+            # batch -m takes the same file
+            self.assertEqual(collect_inputs([], [manifest]), [e['path'] for e in entries])
+
+    def test_job_cost(self):
+        hd = {'width': 1920, 'height': 1080, 'duration': 60.0, 'fps': 30.0, 'video_codec': 'h264',
+              'streams': [{'index': 0, 'type': 'video', 'codec': 'h264'}]}
+        sd = dict(hd, width=854, height=480)
+        self.assertGreater(job_cost(hd, 720), 3 * job_cost(sd, 360))
+        # Already small enough: remuxed, nearly free
+        self.assertLess(job_cost(sd, 720), job_cost(sd, 360) * scanner.REMUX_COST_FACTOR * 2)
+
+    @patch('scanner.time.monotonic')
+    def test_batch_progress_weighted_eta(self, mock_time):
+        mock_time.return_value = 100.0
+        progress = BatchProgress({'big': 300.0, 'small': 100.0})
+        self.assertIsNone(progress.snapshot().eta)
+        progress.update('small', 0.5)
+        mock_time.return_value = 110.0
+        progress.finish('small')
+        progress.update('big', 0.1)
+        snapshot = progress.snapshot()
+        # 130 of 400 done in 10 s -> 270 left at 13/s
+        self.assertAlmostEqual(float(snapshot), 130 / 400)
+        self.assertAlmostEqual(snapshot.eta, 270 / 13)
+        progress.finish('big', success=False)
+        snapshot = progress.snapshot()
+        self.assertEqual((float(snapshot), snapshot.eta, snapshot.done), (1.0, 0.0, True))
+
+    @patch('compressor.compress_video')
+    @patch('compressor.get_video_info', return_value={'duration': 5.0})
+    def test_run_batch_reports_to_batch_progress(self, mock_info, mock_compress):
+        def fake_compress(input_path, output_path, target_height, progress_callback=None, **kwargs):
+            progress_callback(EncodeProgress(0.5))
+            open(output_path, 'wb').close()
+            return True
+        mock_compress.side_effect = fake_compress
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "in.mp4")
+            with open(src, 'wb') as f:
+                f.write(b"data")
+            progress = BatchProgress({src: 10.0})
+            progress.update = MagicMock(wraps=progress.update)
+            run_batch([src], os.path.join(d, "out"), 480, jobs=1, threads_per_job=0, progress=progress)
+        progress.update.assert_called_once_with(src, 0.5)
+        self.assertTrue(progress.snapshot().done)
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.tmp.name, "in.mp4")
+        with open(self.input, 'wb') as f:
+            f.write(b"data")
+        self.release = threading.Event()
+        patchers = [patch('server.get_video_info', return_value={'duration': 10.0, 'height': 1080}),
+                    patch('server.compress_video', side_effect=self.fake_compress)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.service = JobService(workers=1, max_queued=1, threads_per_job=0, output_dir=self.tmp.name).start()
+        self.server = make_server(self.service, port=0, quiet=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close(timeout=5)
+        self.tmp.cleanup()
+
+    def fake_compress(self, input_path, output_path, target_height, progress_callback=None, stop_event=None, **kwargs):
+        progress_callback(EncodeProgress(0.5, fps=30.0, speed=1.5, eta=4.0))
+        while not self.release.is_set():
+            if stop_event.wait(0.01):
+                return False
+        with open(output_path, 'wb') as f:
+            f.write(b"compressed")
+        return True
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        conn.request(method, path, json.dumps(body) if body is not None else None)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response, data
+
+    def wait_for(self, job_id, status):
+        deadline = time.monotonic() + 5
+        while self.service.get(job_id)['status'] != status and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.service.get(job_id)
+
+    def test_parse_job_request(self):
+        request = parse_job_request({'input': self.input, 'resolution': '720p', 'tier': 'fastest'}, self.tmp.name)
+        self.assertEqual(request['height'], 720)
+        self.assertEqual(request['output'], os.path.join(os.path.realpath(self.tmp.name), "compressed_720p_in.mp4"))
+        self.assertFalse(request['overwrite'])
+        for bad in ({'input': self.input}, {'input': "missing.mp4", 'height': 480},
+                    {'input': self.input, 'height': 480, 'crf': 99}, {'input': self.input, 'height': 480, 'tier': 'x'}):
+            with self.assertRaises(ValueError):
+                parse_job_request(bad, self.tmp.name)
+
+    def test_outputs_stay_in_the_output_dir(self):
+        request = parse_job_request({'input': self.input, 'height': 480, 'output': "sub/out.mp4"}, self.tmp.name)
+        self.assertEqual(request['output'], os.path.join(os.path.realpath(self.tmp.name), "sub", "out.mp4"))
+        for output in ("/etc/out.mp4", "../out.mp4", "sub/../../out.mp4", "."):
+            with self.assertRaises(ValueError):
+                parse_job_request({'input': self.input, 'height': 480, 'output': output}, self.tmp.name)
+        with self.assertRaises(ValueError):
+            parse_job_request({'input': self.input, 'height': 480}, None)
+
+        # in.mp4 is already there: only replaced when asked
+        response, _ = self.request('POST', '/jobs', {'input': self.input, 'height': 480, 'output': "in.mp4"})
+        self.assertEqual(response.status, 409)
+        request = parse_job_request({'input': self.input, 'height': 480, 'output': "in.mp4", 'overwrite': True},
+                                    self.tmp.name)
+        self.assertTrue(request['overwrite'])
+
+    def test_jobs_stay_queued_until_granted(self):
+        grant = threading.Event()
+
+        @contextlib.contextmanager
+        def fake_job_threads(threads, info, target_height, stop_event=None, competing=1, telemetry=None):
+            while not grant.is_set():
+                if stop_event.wait(0.01):
+                    yield None
+                    return
+            yield 2
+
+        with patch('server.job_threads', side_effect=fake_job_threads):
+            _, data = self.request('POST', '/jobs', {'input': self.input, 'height': 480})
+            first = json.loads(data)['id']
+            deadline = time.monotonic() + 5
+            while not self.service.starting and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # A worker holds it, but it waits for cores: still queued, and counted as waiting
+            self.assertEqual(self.service.get(first)['status'], 'queued')
+            self.assertEqual(self.service.status()['running'], 0)
+            self.assertEqual(self.service.status()['queued'], 1)
+            # The one queue slot is taken and the only worker is busy
+            self.assertEqual(self.request('POST', '/jobs', {'input': self.input, 'height': 360})[0].status, 503)
+
+            grant.set()
+            self.assertEqual(self.wait_for(first, 'running')['status'], 'running')
+            self.assertEqual(self.service.status()['running'], 1)
+            self.assertEqual(self.request('POST', '/jobs', {'input': self.input, 'height': 360})[0].status, 202)
+            self.release.set()
+            self.assertEqual(self.wait_for(first, 'done')['status'], 'done')
+
+    def test_admission_control_and_events(self):
+        response, data = self.request('POST', '/jobs', {'input': self.input, 'height': 480})
+        self.assertEqual(response.status, 202)
+        first = json.loads(data)['id']
+        self.assertEqual(self.wait_for(first, 'running')['status'], 'running')
+        response, _ = self.request('POST', '/jobs', {'input': self.input, 'height': 360})
+        self.assertEqual(response.status, 202)
+        # One running and one waiting: the box is full
+        response, data = self.request('POST', '/jobs', {'input': self.input, 'height': 240})
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '4')
+        self.assertFalse(json.loads(self.request('GET', '/health')[1])['accepting'])
+
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=5)
+        conn.request('GET', f'/jobs/{first}/events')
+        stream = conn.getresponse()
+        self.assertEqual(stream.getheader('Content-Type'), 'text/event-stream')
+        self.release.set()
+        events = stream.read().decode('utf-8')
+        conn.close()
+        self.assertIn('event: end', events)
+        last = json.loads(events.strip().splitlines()[-1][len('data: '):])
+        self.assertEqual(last['status'], 'done')
+        self.assertTrue(os.path.exists(last['output']))
+
+    def test_cancel(self):
+        _, data = self.request('POST', '/jobs', {'input': self.input, 'height': 480})
+        running = json.loads(data)['id']
+        _, data = self.request('POST', '/jobs', {'input': self.input, 'height': 360})
+        queued = json.loads(data)['id']
+        self.wait_for(running, 'running')
+        response, data = self.request('DELETE', f'/jobs/{queued}')
+        self.assertEqual(json.loads(data)['status'], 'cancelled')
+        self.request('DELETE', f'/jobs/{running}')
+        self.assertEqual(self.wait_for(running, 'cancelled')['status'], 'cancelled')
+        self.assertEqual(self.request('DELETE', '/jobs/99')[0].status, 404)
 
 if __name__ == '__main__':
     unittest.main()
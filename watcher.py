@@ -0,0 +1,367 @@
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import struct
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import JsonCache, get_data_dir
+from governor import get_governor
+from telemetry import JobTelemetry, record_job
+from compressor import (get_video_info, compress_video, batch_output_path, default_job_count, resolution_height,
+                        job_threads, VIDEO_EXTENSIONS, ALL_RESOLUTIONS)
+from jobqueue import partial_output_path
+
+# A file counts as complete once its size and mtime stayed the same for this long
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_INTERVAL = 2.0
+
+# With inotify the directories are still rescanned now and then, to catch anything the
+# kernel can't report (e.g. files written to a network share by another machine)
+INOTIFY_RESCAN_INTERVAL = 300.0
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+class Inotify:
+    """Minimal inotify binding through libc, for Linux without extra dependencies."""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._ctypes = ctypes
+        self._dirs = {}
+
+    def add(self, directory):
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(self._ctypes.get_errno(), f"Cannot watch {directory}")
+        self._dirs[wd] = directory
+
+    def read(self, timeout):
+        """
+        Wait up to `timeout` seconds for events.
+        Returns: list of (path, is_dir), or None if the kernel queue overflowed and events were lost.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if wd in self._dirs and name:
+                events.append((os.path.join(self._dirs[wd], os.fsdecode(name)), bool(mask & IN_ISDIR)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def open_inotify():
+    """An Inotify instance, or None where inotify isn't available (other platforms, exhausted limits)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return Inotify()
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable ({e}), falling back to polling")
+        return None
+
+class FolderWatcher:
+    """
+    Watches input directories and compresses every video that lands in them.
+    A new file is only picked up once it stopped growing for `settle_seconds`, and at most
+    `workers` compressions run at once. Processed inputs are remembered by path, size and mtime,
+    so a restart only has to stat the folder, not probe every file in it again.
+    """
+
+    def __init__(self, directories, output_dir, target_height, res_tag=None, workers=0, threads_per_job=None,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL, recursive=False,
+                 use_inotify=True, fast_path=True, state_path=None, report=None):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.output_dir = os.path.abspath(output_dir)
+        self.target_height = target_height
+        self.res_tag = res_tag or (f"{target_height}p" if target_height else "original")
+        # Without a fixed thread count the resource governor decides how many of the workers encode at once
+        self.workers = workers or (get_governor().cores if threads_per_job is None else default_job_count(threads_per_job))
+        self.threads_per_job = threads_per_job
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.recursive = recursive
+        self.use_inotify = use_inotify
+        self.fast_path = fast_path
+        self.report = report
+        self.state = JsonCache(state_path or os.path.join(get_data_dir(), "watch_state.json"), max_entries=200000)
+        # path -> (size, mtime_ns, monotonic time it was first seen with that size/mtime)
+        self.pending = {}
+        # Settled files waiting for a free worker, in arrival order
+        self.waiting = {}
+        self.in_flight = set()
+        self._lock = threading.Lock()
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def is_candidate(self, path):
+        """Video files only, never our own outputs or partial files."""
+        name = os.path.basename(path)
+        if name.startswith('.') or not name.lower().endswith(VIDEO_EXTENSIONS):
+            return False
+        if os.path.splitext(os.path.splitext(name)[0])[1] == '.part':
+            return False
+        return not self._key(path).startswith(os.path.normcase(self.output_dir) + os.sep)
+
+    def is_processed(self, path, st):
+        entry = self.state.get(self._key(path))
+        return bool(entry) and entry[0] == st.st_size and entry[1] == st.st_mtime_ns
+
+    def _walk(self, directory):
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"Cannot scan {directory}: {e}")
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if self.recursive and self._key(entry.path) != os.path.normcase(self.output_dir):
+                    yield from self._walk(entry.path)
+            elif entry.is_file() and self.is_candidate(entry.path):
+                yield entry.path
+
+    def scan(self):
+        """Queue every unprocessed video in the watched directories. Costs one stat per file."""
+        for directory in self.directories:
+            for path in self._walk(directory):
+                self.notice(path)
+
+    def notice(self, path):
+        """Start tracking a file that may have appeared or changed."""
+        if not self.is_candidate(path):
+            return
+        with self._lock:
+            if path in self.in_flight or path in self.pending or path in self.waiting:
+                return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if self.is_processed(path, st):
+            return
+        with self._lock:
+            self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def ready_files(self):
+        """Pending files whose size and mtime haven't changed for settle_seconds. They leave `pending`."""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            items = list(self.pending.items())
+        for path, (size, mtime_ns, since) in items:
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Deleted or renamed away before it settled
+                with self._lock:
+                    self.pending.pop(path, None)
+                continue
+            with self._lock:
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+                elif st.st_size > 0 and now - since >= self.settle_seconds:
+                    del self.pending[path]
+                    ready.append(path)
+        return ready
+
+    def dispatch(self, pool, stop_event=None):
+        """Hand waiting files to the pool, never more than `workers` at a time."""
+        with self._lock:
+            while self.waiting and len(self.in_flight) < self.workers:
+                path = next(iter(self.waiting))
+                del self.waiting[path]
+                self.in_flight.add(path)
+                pool.submit(self.process, path, stop_event)
+
+    def output_path_for(self, path):
+        """Mirror the input's sub-folder (relative to its watched directory) under output_dir."""
+        output_dir = self.output_dir
+        for directory in self.directories:
+            if self._key(path).startswith(os.path.normcase(directory) + os.sep):
+                output_dir = os.path.join(self.output_dir, os.path.relpath(os.path.dirname(path), directory))
+                break
+        return os.path.normpath(batch_output_path(path, output_dir, self.res_tag))
+
+    def process(self, path, stop_event=None):
+        """Compress one settled file and record the outcome. Returns the result dict."""
+        output_path = self.output_path_for(path)
+        part_path = partial_output_path(output_path)
+        result = {'input': path, 'output': output_path, 'success': False, 'seconds': 0.0}
+        start = time.monotonic()
+        telemetry = JobTelemetry('watch', path, output_path, height=self.target_height)
+        try:
+            st = os.stat(path)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with telemetry.phase('probe'):
+                info = get_video_info(path)
+            if info:
+                with self._lock:
+                    competing = len(self.in_flight)
+                with job_threads(self.threads_per_job, info, self.target_height, stop_event, competing,
+                                 telemetry) as threads:
+                    if threads is not None:
+                        result['success'] = compress_video(path, part_path, self.target_height,
+                                                           total_duration=info.get('duration', 0),
+                                                           stop_event=stop_event, threads=threads,
+                                                           fast_path=self.fast_path, source_info=info,
+                                                           telemetry=telemetry)
+            else:
+                print(f"Skipping {path}: not a readable video")
+            if result['success']:
+                with telemetry.phase('save'):
+                    os.replace(part_path, output_path)
+        except Exception as e:
+            print(f"Error processing {path}: {e}")
+            result['success'] = False
+            st = None
+
+        if not result['success'] and os.path.exists(part_path):
+            os.remove(part_path)
+        result['seconds'] = time.monotonic() - start
+        interrupted = stop_event is not None and stop_event.is_set() and not result['success']
+        # Failures are recorded too, so a broken file isn't retried until it changes.
+        # Interrupted ones aren't, so the next start picks them up again.
+        if st is not None and not interrupted:
+            self.state.put(self._key(path), [st.st_size, st.st_mtime_ns, 'done' if result['success'] else 'failed',
+                                             output_path])
+            self.state.flush()
+        with self._lock:
+            self.in_flight.discard(path)
+        if not interrupted:
+            record_job(telemetry.finish(result['success']))
+        if self.report and not interrupted:
+            self.report(result)
+        return result
+
+    def run(self, stop_event=None):
+        """Watch until stop_event is set (or Ctrl+C). Files already settled at startup are processed first."""
+        if stop_event is None:
+            stop_event = threading.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        inotify = open_inotify() if self.use_inotify else None
+        if inotify:
+            for directory in self.directories:
+                for root, dirs, _ in os.walk(directory) if self.recursive else [(directory, [], [])]:
+                    if self._key(root) != os.path.normcase(self.output_dir):
+                        inotify.add(root)
+        rescan_interval = INOTIFY_RESCAN_INTERVAL if inotify else self.poll_interval
+        print(f"Watching {', '.join(self.directories)} ({'inotify' if inotify else 'polling'}), "
+              f"{self.workers} worker(s) -> {self.output_dir}")
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        last_scan = 0.0
+        try:
+            while not stop_event.is_set():
+                if time.monotonic() - last_scan >= rescan_interval:
+                    self.scan()
+                    last_scan = time.monotonic()
+
+                if inotify:
+                    # Wake up early while files are settling so they're picked up on time
+                    events = inotify.read(min(self.poll_interval, 1.0) if self.pending else self.poll_interval)
+                    if events is None:
+                        last_scan = 0.0
+                        continue
+                    for path, is_dir in events:
+                        if is_dir and self.recursive:
+                            inotify.add(path)
+                            for sub_path in self._walk(path):
+                                self.notice(sub_path)
+                        elif not is_dir:
+                            self.notice(path)
+                else:
+                    stop_event.wait(min(self.poll_interval, 1.0) if self.pending else self.poll_interval)
+
+                for path in self.ready_files():
+                    with self._lock:
+                        self.waiting[path] = True
+                self.dispatch(pool, stop_event)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for running compressions to be cancelled...")
+        finally:
+            stop_event.set()
+            pool.shutdown(wait=True)
+            self.state.flush()
+            if inotify:
+                inotify.close()
+
+def _print_result(result):
+    if result['success']:
+        print(f"[OK]   {result['input']} -> {result['output']} ({result['seconds']:.1f}s)")
+    else:
+        print(f"[FAIL] {result['input']} ({result['seconds']:.1f}s)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python watcher.py",
+                                     description="Compress every video that appears in the watched folders.")
+    parser.add_argument('directories', nargs='+', help="Folders to watch.")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory for compressed files.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-r', '--resolution', help="Target resolution label, e.g. 720p.")
+    target.add_argument('--height', type=int, help="Target height in pixels.")
+    parser.add_argument('-j', '--jobs', type=int, default=0, help="Most compressions at once (default: as many as cores and memory allow).")
+    parser.add_argument('-t', '--threads', type=int, default=None, help="Fixed threads per ffmpeg job, 0 = unlimited (default: sized per file).")
+    parser.add_argument('--recursive', action='store_true', help="Also watch sub-folders; their layout is mirrored in the output.")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS, help="Seconds a file must stop changing before it's picked up.")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between checks.")
+    parser.add_argument('--poll', action='store_true', help="Poll instead of using inotify (e.g. for network shares).")
+    parser.add_argument('--no-fast-path', action='store_true', help="Always re-encode, even when streams could be copied.")
+    args = parser.parse_args(argv)
+
+    if args.height:
+        height, res_tag = args.height, f"{args.height}p"
+    else:
+        height = resolution_height(args.resolution)
+        if height is None:
+            raise SystemExit(f"Unknown resolution '{args.resolution}'. Choose from: {', '.join(ALL_RESOLUTIONS)}")
+        res_tag = args.resolution
+
+    watcher = FolderWatcher(args.directories, args.output_dir, height, res_tag=res_tag, workers=args.jobs,
+                            threads_per_job=args.threads, settle_seconds=args.settle,
+                            poll_interval=args.poll_interval, recursive=args.recursive,
+                            use_inotify=not args.poll, fast_path=not args.no_fast_path, report=_print_result)
+    stop_event = threading.Event()
+    # Service managers stop daemons with SIGTERM; treat it like Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    watcher.run(stop_event)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())